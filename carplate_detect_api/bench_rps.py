@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+車牌識別 API 吞吐量基準測試工具
+以固定併發數在指定時間內持續呼叫 /recognize_plate，輸出每秒請求數 (RPS)、
+延遲分位數與錯誤數，並附加寫入 CSV，用於比較開發伺服器與 gunicorn 多 worker 設定。
+
+使用範例 (分別啟動兩種伺服器後各跑一次，以 --label 區分)：
+    python run.py
+    python bench_rps.py --image sample.jpg --concurrency 1,4,8 --label flask-dev
+
+    gunicorn -c gunicorn.conf.py run:app
+    python bench_rps.py --image sample.jpg --concurrency 1,4,8 --label gunicorn
+
+注意：/recognize_plate 包含 Gemini 呼叫，結果受外部 API 延遲與配額影響；
+比較伺服器設定時兩次測試應使用相同圖片與網路環境。
+只比較伺服器本身時，可以 PLATE_RECOGNIZER=stub (可搭配 STUB_LATENCY_MS) 啟動服務，排除外部 API 的影響。
+"""
+
+import os
+import sys
+import csv
+import time
+import argparse
+import threading
+import requests
+import numpy as np
+
+# 200 (查到車主) 與 404 (辨識成功但查無車主) 皆視為服務正常回應
+SUCCESS_STATUS_CODES = (200, 404)
+
+# ==================== 1. 參數解析 ====================
+def parse_list(value, cast):
+    """解析以逗號分隔的參數列表"""
+    return [cast(item.strip()) for item in value.split(',') if item.strip()]
+
+def parse_arguments():
+    """解析命令列參數"""
+    parser = argparse.ArgumentParser(description='車牌識別 API 吞吐量基準測試')
+    parser.add_argument('--url', default='http://localhost:3001/recognize_plate', help='測試端點')
+    parser.add_argument('--image', required=True, help='上傳的測試圖片')
+    parser.add_argument('--concurrency', default='1,4,8', help='併發數列表，例如 1,4,8')
+    parser.add_argument('--duration', type=float, default=30.0, help='每個併發數的測試秒數')
+    parser.add_argument('--timeout', type=float, default=60.0, help='單一請求逾時秒數')
+    parser.add_argument('--label', default='server', help='伺服器設定名稱 (寫入結果 CSV)')
+    parser.add_argument('--output', default='bench_rps_results.csv', help='結果 CSV (附加寫入)')
+    return parser.parse_args()
+
+# ==================== 2. 壓測執行 ====================
+def run_client(url, image_bytes, deadline, timeout, latencies, errors, lock):
+    """單一客戶端：持續送出請求直到截止時間"""
+    session = requests.Session()
+    while time.time() < deadline:
+        start = time.perf_counter()
+        try:
+            response = session.post(url, files={'file': ('bench.jpg', image_bytes, 'image/jpeg')}, timeout=timeout)
+            ok = response.status_code in SUCCESS_STATUS_CODES
+        except requests.exceptions.RequestException:
+            ok = False
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with lock:
+            if ok:
+                latencies.append(elapsed_ms)
+            else:
+                errors.append(elapsed_ms)
+
+def run_load(url, image_bytes, concurrency, duration, timeout):
+    """以指定併發數壓測，回傳結果列"""
+    latencies, errors, lock = [], [], threading.Lock()
+    deadline = time.time() + duration
+    started = time.perf_counter()
+    clients = [
+        threading.Thread(target=run_client, args=(url, image_bytes, deadline, timeout, latencies, errors, lock))
+        for _ in range(concurrency)
+    ]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    wall_seconds = time.perf_counter() - started
+
+    row = {
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'errors': len(errors),
+        'rps': round(len(latencies) / wall_seconds, 2),
+        'p50_ms': None,
+        'p95_ms': None,
+        'p99_ms': None
+    }
+    if latencies:
+        row['p50_ms'], row['p95_ms'], row['p99_ms'] = [round(float(v), 1) for v in np.percentile(latencies, [50, 95, 99])]
+    return row
+
+# ==================== 3. 結果輸出 ====================
+def write_rows(rows, path, label):
+    """附加寫入 CSV，方便累積多種伺服器設定的結果"""
+    fields = ['label', 'timestamp', 'concurrency', 'requests', 'errors', 'rps', 'p50_ms', 'p95_ms', 'p99_ms']
+    new_file = not os.path.exists(path)
+    with open(path, 'a', newline='') as csv_file:
+        writer = csv.DictWriter(csv_file, fieldnames=fields)
+        if new_file:
+            writer.writeheader()
+        timestamp = time.strftime('%Y-%m-%dT%H:%M:%S')
+        for row in rows:
+            writer.writerow(dict(row, label=label, timestamp=timestamp))
+
+def run_benchmark(args):
+    """依序執行各併發數的壓測"""
+    if not os.path.exists(args.image):
+        raise ValueError(f"測試圖片不存在: {args.image}")
+    with open(args.image, 'rb') as image_file:
+        image_bytes = image_file.read()
+
+    rows = []
+    for concurrency in parse_list(args.concurrency, int):
+        print(f"⏱️ {args.label}: 併發 {concurrency}，持續 {args.duration:.0f}s ...")
+        row = run_load(args.url, image_bytes, concurrency, args.duration, args.timeout)
+        print(f"   RPS {row['rps']}  p50 {row['p50_ms']}ms  p95 {row['p95_ms']}ms  錯誤 {row['errors']}")
+        rows.append(row)
+
+    write_rows(rows, args.output, args.label)
+    print(f"\n✅ 結果已附加至: {args.output}")
+
+if __name__ == "__main__":
+    try:
+        run_benchmark(parse_arguments())
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
@@ -0,0 +1,4 @@
+"""
+pytest 根目錄設定
+此檔案所在目錄會加入匯入路徑，tests/ 可直接匯入 recognizers 等模組。
+"""
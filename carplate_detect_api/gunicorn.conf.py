@@ -0,0 +1,41 @@
+# carplate_detect_api 正式環境啟動設定
+# 啟動方式: gunicorn -c gunicorn.conf.py run:app
+import multiprocessing
+import os
+
+# 每個 worker 的 torch / OpenMP 執行緒數 (需在主程序匯入 torch 前設定，避免 worker 間互搶 CPU)
+TORCH_THREADS_PER_WORKER = int(os.getenv('TORCH_THREADS_PER_WORKER', 1))
+os.environ.setdefault('OMP_NUM_THREADS', str(TORCH_THREADS_PER_WORKER))
+os.environ.setdefault('MKL_NUM_THREADS', str(TORCH_THREADS_PER_WORKER))
+
+bind = f"0.0.0.0:{os.getenv('PORT', 3001)}"
+
+# 預設 worker 數依 CPU 核心數與每個 worker 的執行緒數估算；
+# 每個 worker 內的執行緒主要在等待 Gemini 回應，可多於 CPU 核心
+workers = int(os.getenv('CARPLATE_WORKERS', max(1, multiprocessing.cpu_count() // TORCH_THREADS_PER_WORKER)))
+threads = int(os.getenv('CARPLATE_THREADS', 4))
+worker_class = 'gthread'
+
+# 主程序先載入模型再 fork，各 worker 以 copy-on-write 共用權重
+preload_app = True
+
+# Gemini 呼叫可能較慢，逾時需大於單次辨識的最長時間
+timeout = int(os.getenv('CARPLATE_TIMEOUT', 60))
+graceful_timeout = 30
+keepalive = 5
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.getenv('LOG_LEVEL', 'info')
+
+
+def post_fork(server, worker):
+    """worker fork 後：限制執行緒數並暖機 (暖機完成前 /healthz 回傳 503)"""
+    import cv2
+    import torch
+    import run
+
+    torch.set_num_threads(TORCH_THREADS_PER_WORKER)
+    cv2.setNumThreads(TORCH_THREADS_PER_WORKER)
+    run.warm_up_detector()
+    server.log.info(f"worker {worker.pid} 已就緒 (torch 執行緒: {torch.get_num_threads()})")
@@ -0,0 +1,308 @@
+"""
+車牌辨識器
+遠端辨識器 (Gemini / 本地替身) 與本地 CPU OCR，以及兩者的串聯；
+不依賴 Flask、資料庫與車牌偵測模型，可單獨匯入測試。
+"""
+
+import re
+import time
+import hashlib
+import threading
+from concurrent.futures import Future
+import cv2
+import numpy as np
+import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+
+# ====== 1. 參數 ======
+RECOGNIZER_RETRY_BACKOFF = 0.5
+RECOGNIZER_MAX_WIDTH = 320
+# 與先前以 PIL 上傳彩色影像時的預設品質相同；灰階後同尺寸影像必定較小
+RECOGNIZER_JPEG_QUALITY = 75
+PLATE_TEXT_PATTERN = re.compile(r'^[A-Z0-9]{5,8}$')
+
+# ====== 2. 遠端辨識器 ======
+PLATE_PROMPT = """
+你是一個高度專業的車牌辨識 AI。你的任務分為兩個步驟：
+
+**第一步：判斷**
+首先，請嚴格評估提供的圖片，判斷其中是否包含一個清晰、可辨識的台灣車牌。
+
+**第二步：輸出**
+根據第一步的判斷結果，你必須且只能遵循以下其中一條規則進行輸出：
+
+*   **如果 (IF) 圖片中確實存在清晰可辨識的車牌：**
+    1.  辨識出最準確的車牌號碼。
+    2.  對辨識結果應用以下所有標準化規則：
+        *   將 'I' 或 '|' 恆等為 '1'。
+        *   將 'Z' 恆等為 '2'。
+        *   將 'O' 恆等為 '0'。
+        *   若結果為 'N0D3360' 或 'NOD3360'，則一律修正為 'NQD3360'。
+    3.  你的最終輸出**只能是**修正後的車牌號碼字串，不包含任何破折號、空格、解釋或其他文字。
+
+*   **如果 (ELSE) 圖片中不存在清晰可辨識的車牌 (例如圖片模糊、無關物體、或根本沒有車牌)：**
+    *   你的最終輸出**只能是** `NO_PLATE_FOUND` 這一個單詞。禁止輸出任何其他內容。
+
+現在，請分析圖片並提供結果。
+"""
+
+
+class PermanentRecognizerError(Exception):
+    """重試也無法成功的辨識錯誤 (例如內容遭封鎖、金鑰無效)，不重試"""
+
+
+class PlateRecognizer:
+    """長駐的車牌辨識器：縮小影像後送出，限制併發數、逾時重試，相同影像的併發請求共用一次呼叫"""
+
+    name = 'base'
+
+    def __init__(self, max_concurrency, max_retries, timeout):
+        self.semaphore = threading.BoundedSemaphore(max_concurrency)
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        self.stats_counters = {'requests': 0, 'calls': 0, 'coalesced': 0, 'retries': 0, 'failures': 0,
+                               'total_call_ms': 0.0, 'payload_bytes': 0}
+
+    @staticmethod
+    def minimize(image_bgr):
+        """轉灰階並縮小至最大寬度，以 JPEG 編碼，減少上傳大小"""
+        gray = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2GRAY) if image_bgr.ndim == 3 else image_bgr
+        h, w = gray.shape[:2]
+        if w > RECOGNIZER_MAX_WIDTH:
+            scale = RECOGNIZER_MAX_WIDTH / w
+            gray = cv2.resize(gray, (RECOGNIZER_MAX_WIDTH, max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+        _, encoded = cv2.imencode('.jpg', gray, [cv2.IMWRITE_JPEG_QUALITY, RECOGNIZER_JPEG_QUALITY])
+        return encoded.tobytes()
+
+    def recognize(self, image_bgr):
+        """辨識車牌文字，失敗時回傳 None"""
+        if image_bgr is None or image_bgr.size == 0:
+            return None
+        payload = PlateRecognizer.minimize(image_bgr)
+        key = hashlib.sha1(payload).hexdigest()
+        with self.lock:
+            self.stats_counters['requests'] += 1
+            future = self.in_flight.get(key)
+            is_owner = future is None
+            if is_owner:
+                future = Future()
+                self.in_flight[key] = future
+            else:
+                self.stats_counters['coalesced'] += 1
+        if not is_owner:
+            return future.result()
+
+        result = None
+        try:
+            result = self.call_with_retries(payload)
+        finally:
+            with self.lock:
+                self.in_flight.pop(key, None)
+            future.set_result(result)
+        return result
+
+    def call_with_retries(self, payload):
+        """於併發上限內呼叫，例外時以指數退避重試"""
+        for attempt in range(self.max_retries + 1):
+            with self.semaphore:
+                start = time.time()
+                try:
+                    text = self.call(payload)
+                    with self.lock:
+                        self.stats_counters['calls'] += 1
+                        self.stats_counters['payload_bytes'] += len(payload)
+                        self.stats_counters['total_call_ms'] += (time.time() - start) * 1000
+                    return text
+                except PermanentRecognizerError as e:
+                    print(f"車牌辨識器 ({self.name}) 無法辨識此影像，不重試: {e}")
+                    break
+                except Exception as e:
+                    print(f"呼叫車牌辨識器 ({self.name}) 時發生錯誤 (第 {attempt + 1} 次): {e}")
+            if attempt < self.max_retries:
+                with self.lock:
+                    self.stats_counters['retries'] += 1
+                time.sleep(RECOGNIZER_RETRY_BACKOFF * (2 ** attempt))
+        with self.lock:
+            self.stats_counters['failures'] += 1
+        return None
+
+    def call(self, payload):
+        raise NotImplementedError
+
+    def stats(self):
+        with self.lock:
+            counters = dict(self.stats_counters)
+        calls = counters['calls']
+        counters['avg_call_ms'] = round(counters['total_call_ms'] / calls, 1) if calls else None
+        counters['avg_payload_bytes'] = round(counters['payload_bytes'] / calls) if calls else None
+        counters['recognizer'] = self.name
+        return counters
+
+
+class GeminiPlateRecognizer(PlateRecognizer):
+    """以 Gemini 辨識車牌 (設定與模型只建立一次)"""
+
+    name = 'gemini'
+
+    def __init__(self, api_key, model_name, **kwargs):
+        super().__init__(**kwargs)
+        genai.configure(api_key=api_key)
+        self.model = genai.GenerativeModel(model_name)
+
+    # 請求本身有誤或權限不足，重送也不會成功
+    PERMANENT_ERRORS = (
+        google_exceptions.InvalidArgument,
+        google_exceptions.PermissionDenied,
+        google_exceptions.Unauthenticated
+    )
+
+    def call(self, payload):
+        try:
+            response = self.model.generate_content(
+                [PLATE_PROMPT, {'mime_type': 'image/jpeg', 'data': payload}],
+                request_options={'timeout': self.timeout}
+            )
+        except GeminiPlateRecognizer.PERMANENT_ERRORS as e:
+            raise PermanentRecognizerError(str(e)) from e
+        try:
+            # 內容遭安全機制封鎖時沒有候選結果，response.text 會拋出 ValueError
+            text = response.text
+        except ValueError as e:
+            raise PermanentRecognizerError(f"回應沒有文字 ({response.prompt_feedback})") from e
+        return text.strip()
+
+
+class StubPlateRecognizer(PlateRecognizer):
+    """本地替身辨識器 (PLATE_RECOGNIZER=stub)：不呼叫外部 API，回傳固定結果，供測試與壓測使用"""
+
+    name = 'stub'
+
+    def __init__(self, plate_number, latency_ms, **kwargs):
+        super().__init__(**kwargs)
+        self.plate_number = plate_number
+        self.latency_ms = latency_ms
+
+    def call(self, payload):
+        time.sleep(self.latency_ms / 1000)
+        return self.plate_number
+
+
+# ====== 3. 本地 OCR 與辨識器串聯 ======
+class LocalOcrRecognizer:
+    """本地 CPU 車牌 OCR：以 cv2.dnn 執行 CRNN (ONNX)，CTC 貪婪解碼並回傳文字與信心度"""
+
+    name = 'local_ocr'
+
+    # 與 PLATE_PROMPT 相同的標準化規則
+    CHARACTER_FIXES = str.maketrans({'I': '1', 'Z': '2', 'O': '0'})
+
+    def __init__(self, model_path, alphabet, input_size):
+        self.model_path = model_path
+        self.alphabet = alphabet
+        self.input_size = input_size
+        # cv2.dnn.Net 不可跨執行緒共用，每個執行緒各自載入一份
+        self.local = threading.local()
+        self.local.net = cv2.dnn.readNetFromONNX(model_path)
+
+    def get_net(self):
+        if not hasattr(self.local, 'net'):
+            self.local.net = cv2.dnn.readNetFromONNX(self.model_path)
+        return self.local.net
+
+    def decode(self, scores):
+        """CTC 貪婪解碼 (索引 0 為 blank)，信心度取各字元機率的最小值"""
+        scores = scores.reshape(scores.shape[0], -1)
+        probabilities = np.exp(scores - scores.max(axis=1, keepdims=True))
+        probabilities /= probabilities.sum(axis=1, keepdims=True)
+        best = probabilities.argmax(axis=1)
+        chars, char_probs, previous = [], [], 0
+        for step, index in enumerate(best):
+            if index != 0 and index != previous and index <= len(self.alphabet):
+                chars.append(self.alphabet[index - 1])
+                char_probs.append(probabilities[step, index])
+            previous = index
+        if not chars:
+            return None, 0.0
+        return ''.join(chars).upper().translate(LocalOcrRecognizer.CHARACTER_FIXES), float(min(char_probs))
+
+    def recognize_with_confidence(self, image_bgr):
+        """辨識校正後的車牌影像，不符車牌格式時信心度為 0"""
+        gray = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2GRAY) if image_bgr.ndim == 3 else image_bgr
+        blob = cv2.dnn.blobFromImage(gray, scalefactor=1 / 127.5, size=self.input_size, mean=127.5)
+        net = self.get_net()
+        net.setInput(blob)
+        text, confidence = self.decode(net.forward())
+        if not text or not PLATE_TEXT_PATTERN.match(text):
+            return text, 0.0
+        return text, confidence
+
+
+class RecognizerChain:
+    """辨識器串聯：先以本地 OCR 辨識，信心度不足或無本地模型時才送遠端辨識器，並記錄各層延遲與勝出次數"""
+
+    def __init__(self, local, remote, min_confidence):
+        self.local = local
+        self.remote = remote
+        self.min_confidence = min_confidence
+        self.lock = threading.Lock()
+        tiers = ([local.name] if local else []) + [remote.name]
+        self.tier_stats = {name: {'attempts': 0, 'wins': 0, 'total_ms': 0.0} for name in tiers}
+        self.escalations = 0
+        self.offline_fallbacks = 0
+
+    def record(self, tier, start, won):
+        with self.lock:
+            stats = self.tier_stats[tier]
+            stats['attempts'] += 1
+            stats['total_ms'] += (time.time() - start) * 1000
+            stats['wins'] += int(won)
+
+    def recognize(self, image_bgr):
+        return self.recognize_detailed(image_bgr)['text']
+
+    def recognize_detailed(self, image_bgr):
+        """回傳 {'text', 'confidence', 'tier', 'attempts': [(層名稱, 開始, 結束)]}"""
+        result = {'text': None, 'confidence': None, 'tier': None, 'attempts': []}
+        if image_bgr is None or image_bgr.size == 0:
+            return result
+
+        local_text, local_confidence = None, 0.0
+        if self.local:
+            start = time.time()
+            try:
+                local_text, local_confidence = self.local.recognize_with_confidence(image_bgr)
+            except cv2.error as e:
+                print(f"本地車牌 OCR 發生錯誤: {e}")
+            won = bool(local_text) and local_confidence >= self.min_confidence
+            self.record(self.local.name, start, won)
+            result['attempts'].append((self.local.name, start, time.time()))
+            if won:
+                return dict(result, text=local_text, confidence=local_confidence, tier=self.local.name)
+            with self.lock:
+                self.escalations += 1
+
+        start = time.time()
+        text = self.remote.recognize(image_bgr)
+        self.record(self.remote.name, start, text is not None)
+        result['attempts'].append((self.remote.name, start, time.time()))
+        if text is None and local_text and local_confidence > 0:
+            # 遠端無法使用 (例如離線) 時退回本地結果
+            with self.lock:
+                self.offline_fallbacks += 1
+            return dict(result, text=local_text, confidence=local_confidence, tier=self.local.name)
+        return dict(result, text=text, tier=self.remote.name)
+
+    def stats(self):
+        with self.lock:
+            tiers = {
+                name: dict(stats, avg_ms=round(stats['total_ms'] / stats['attempts'], 1) if stats['attempts'] else None)
+                for name, stats in self.tier_stats.items()
+            }
+            summary = {
+                'min_confidence': self.min_confidence,
+                'escalations': self.escalations,
+                'offline_fallbacks': self.offline_fallbacks
+            }
+        return dict(summary, tiers=tiers, remote=self.remote.stats())
@@ -1,13 +1,17 @@
 import os
+import time
+import uuid
+import struct
+from concurrent.futures import ThreadPoolExecutor
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
 from dotenv import load_dotenv
 import cv2
 from ultralytics import YOLO
-from PIL import Image
 import numpy as np
-import google.generativeai as genai
+import torch
+from recognizers import GeminiPlateRecognizer, StubPlateRecognizer, LocalOcrRecognizer, RecognizerChain
 
 # ====== 1. 設定與初始化 ======
 
@@ -100,99 +104,232 @@ def correct_perspective_debug(image_crop):
     else:
         return image_crop
 
-def detect_and_save_plate(image_path, detector):
-    img = cv2.imread(image_path)
-    if img is None:
+def decode_upload(file_storage):
+    """直接由請求串流解碼上傳圖片為 BGR 陣列 (不寫入磁碟)，無法解碼時回傳 None"""
+    buffer = np.frombuffer(file_storage.read(), dtype=np.uint8)
+    if buffer.size == 0:
         return None
-    plate_results = detector(img, verbose=False)[0]
-    for i, plate_box in enumerate(plate_results.boxes):
+    return cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+
+def detect_plate(img, detector):
+    """以 YOLO 偵測車牌並回傳透視校正後的車牌陣列"""
+    return extract_plate(img, detector(img, verbose=False)[0])
+
+def extract_plate(img, plate_results):
+    """取第一個有效的車牌框並做透視校正"""
+    for plate_box in plate_results.boxes:
         x1p, y1p, x2p, y2p = [int(val) for val in plate_box.xyxy[0]]
         plate_crop = img[y1p:y2p, x1p:x2p]
         if plate_crop.size == 0:
             continue
-        warped_plate = correct_perspective_debug(plate_crop)
-        save_path = f"processed_plate_{i+1}.png"
-        cv2.imwrite(save_path, warped_plate)
-        return save_path
+        return correct_perspective_debug(plate_crop)
     return None
 
-def recognize_plate_with_gemini(image_path, api_key):
-    genai.configure(api_key=api_key)
-    if not os.path.exists(image_path):
+def crop_plate(img, plate_box):
+    """依呼叫端提供的車牌框裁切 (略過 YOLO 車牌偵測)"""
+    h, w = img.shape[:2]
+    x1p, y1p, x2p, y2p = plate_box
+    plate_crop = img[max(0, y1p):min(h, y2p), max(0, x1p):min(w, x2p)]
+    if plate_crop.size == 0:
         return None
-    model = genai.GenerativeModel('gemini-2.5-flash-lite')
-    image = Image.open(image_path)
-    prompt = """
-你是一個高度專業的車牌辨識 AI。你的任務分為兩個步驟：
-
-**第一步：判斷**
-首先，請嚴格評估提供的圖片，判斷其中是否包含一個清晰、可辨識的台灣車牌。
-
-**第二步：輸出**
-根據第一步的判斷結果，你必須且只能遵循以下其中一條規則進行輸出：
-
-*   **如果 (IF) 圖片中確實存在清晰可辨識的車牌：**
-    1.  辨識出最準確的車牌號碼。
-    2.  對辨識結果應用以下所有標準化規則：
-        *   將 'I' 或 '|' 恆等為 '1'。
-        *   將 'Z' 恆等為 '2'。
-        *   將 'O' 恆等為 '0'。
-        *   若結果為 'N0D3360' 或 'NOD3360'，則一律修正為 'NQD3360'。
-    3.  你的最終輸出**只能是**修正後的車牌號碼字串，不包含任何破折號、空格、解釋或其他文字。
-
-*   **如果 (ELSE) 圖片中不存在清晰可辨識的車牌 (例如圖片模糊、無關物體、或根本沒有車牌)：**
-    *   你的最終輸出**只能是** `NO_PLATE_FOUND` 這一個單詞。禁止輸出任何其他內容。
-
-現在，請分析圖片並提供結果。
-"""
-    try:
-        response = model.generate_content([prompt, image])
-        return response.text.strip()
-    except Exception as e:
-        print(f"呼叫 Gemini API 時發生錯誤: {e}")
+    return correct_perspective_debug(plate_crop)
+
+def dump_debug_image(image, trace_id, name):
+    """設定 DEBUG_DUMP_DIR 時，以 trace id 命名保存中間影像 (併發請求不會互相覆寫)"""
+    if not DEBUG_DUMP_DIR or image is None:
+        return
+    # trace id 來自請求標頭，只保留英數字避免路徑跳脫
+    safe_id = ''.join(c for c in trace_id if c.isalnum())[:64] or uuid.uuid4().hex
+    os.makedirs(DEBUG_DUMP_DIR, exist_ok=True)
+    cv2.imwrite(os.path.join(DEBUG_DUMP_DIR, f"{safe_id}_{uuid.uuid4().hex[:6]}_{name}.png"), image)
+
+def normalize_plate_number(plate_number):
+    """移除辨識結果中所有可能存在的破折號和空格"""
+    if not plate_number:
         return None
+    return plate_number.replace('-', '').replace(' ', '')
+
+def read_batch_container(payload):
+    """解析二進位批次容器：每張圖片為 4 位元組大端序長度 + 圖片位元組"""
+    blobs, offset = [], 0
+    while offset < len(payload):
+        if offset + 4 > len(payload):
+            raise ValueError("批次容器格式錯誤")
+        (length,) = struct.unpack_from('>I', payload, offset)
+        offset += 4
+        if length == 0 or offset + length > len(payload):
+            raise ValueError("批次容器格式錯誤")
+        blobs.append(payload[offset:offset + length])
+        offset += length
+    return blobs
 
+def decode_bytes(blob):
+    """將圖片位元組解碼為 BGR 陣列，無法解碼時回傳 None"""
+    return cv2.imdecode(np.frombuffer(blob, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+def parse_plate_box(raw_box):
+    """解析 plate_box 表單欄位 ("x1,y1,x2,y2")，格式錯誤回傳 None"""
+    try:
+        x1p, y1p, x2p, y2p = [int(float(v)) for v in raw_box.split(',')]
+    except (AttributeError, ValueError):
+        return None
+    if x2p <= x1p or y2p <= y1p:
+        return None
+    return x1p, y1p, x2p, y2p
 
 # ====== 4. 載入模型與金鑰 ======
+# 以 gunicorn preload 啟動時，模型只在主程序載入一次，fork 後各 worker 以 copy-on-write 共用權重；
+# 先在主程序融合 Conv+BN，避免各 worker 首次推理時各自融合而複製一份權重
 detector_path = 'license_plate_detector.pt'
 plate_detector = YOLO(detector_path)
+plate_detector.fuse()
+DETECTOR_READY = False
+
+def warm_up_detector():
+    """以空白影像執行一次推理 (於 worker fork 後呼叫，初始化各 worker 自己的執行緒池與本地 OCR)"""
+    global DETECTOR_READY
+    plate_detector(np.zeros((320, 320, 3), dtype=np.uint8), verbose=False)
+    if local_ocr:
+        local_ocr.recognize_with_confidence(np.zeros((32, 100, 3), dtype=np.uint8))
+    DETECTOR_READY = True
+
+# 車牌辨識器：gemini (預設) 或 stub (本地替身，不需金鑰)
+PLATE_RECOGNIZER = os.getenv('PLATE_RECOGNIZER', 'gemini').lower()
+RECOGNIZER_MAX_CONCURRENCY = int(os.getenv('RECOGNIZER_MAX_CONCURRENCY', 4))
+RECOGNIZER_TIMEOUT = float(os.getenv('RECOGNIZER_TIMEOUT', 10))
+RECOGNIZER_MAX_RETRIES = int(os.getenv('RECOGNIZER_MAX_RETRIES', 2))
+
+recognizer_options = {
+    'max_concurrency': RECOGNIZER_MAX_CONCURRENCY,
+    'max_retries': RECOGNIZER_MAX_RETRIES,
+    'timeout': RECOGNIZER_TIMEOUT
+}
+if PLATE_RECOGNIZER == 'stub':
+    remote_recognizer = StubPlateRecognizer(
+        os.getenv('STUB_PLATE_NUMBER', 'NO_PLATE_FOUND'),
+        float(os.getenv('STUB_LATENCY_MS', 0)),
+        **recognizer_options
+    )
+else:
+    GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
+    if not GEMINI_API_KEY:
+        raise ValueError("請在 .env 檔案中設定 GEMINI_API_KEY 環境變數")
+    remote_recognizer = GeminiPlateRecognizer(GEMINI_API_KEY, 'gemini-2.5-flash-lite', **recognizer_options)
+
+# 本地 OCR 層 (設定 LOCAL_OCR_MODEL_PATH 才啟用)：信心度達門檻即採用，否則升級至遠端辨識器
+LOCAL_OCR_MODEL_PATH = os.getenv('LOCAL_OCR_MODEL_PATH')
+LOCAL_OCR_MIN_CONFIDENCE = float(os.getenv('LOCAL_OCR_MIN_CONFIDENCE', 0.85))
+LOCAL_OCR_ALPHABET = os.getenv('LOCAL_OCR_ALPHABET', '0123456789abcdefghijklmnopqrstuvwxyz')
+LOCAL_OCR_INPUT_SIZE = (100, 32)
+
+local_ocr = None
+if LOCAL_OCR_MODEL_PATH:
+    if not os.path.exists(LOCAL_OCR_MODEL_PATH):
+        raise ValueError(f"本地 OCR 模型不存在: {LOCAL_OCR_MODEL_PATH}")
+    local_ocr = LocalOcrRecognizer(LOCAL_OCR_MODEL_PATH, LOCAL_OCR_ALPHABET, LOCAL_OCR_INPUT_SIZE)
+plate_recognizer = RecognizerChain(local_ocr, remote_recognizer, LOCAL_OCR_MIN_CONFIDENCE)
+
+# 呼叫端提供車牌框/車牌圖時，信心度需達此門檻才略過本服務的車牌偵測
+PLATE_HINT_MIN_CONF = float(os.getenv('PLATE_HINT_MIN_CONF', 0.5))
+
+# 偵錯用：設定後保存每個請求的上傳圖片與校正後車牌 (檔名含 trace id)
+DEBUG_DUMP_DIR = os.getenv('DEBUG_DUMP_DIR')
+
+# 批次辨識：單次請求的圖片數與總大小上限、前處理與辨識的併發數
+MAX_BATCH_IMAGES = int(os.getenv('MAX_BATCH_IMAGES', 16))
+MAX_BATCH_BYTES = int(os.getenv('MAX_BATCH_BYTES', 20 * 1024 * 1024))
+BATCH_WORKERS = int(os.getenv('BATCH_WORKERS', 8))
+BATCH_CONTENT_TYPE = 'application/x-plate-batch'
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_WORKERS)
+
+# ====== 5. 端到端追蹤 ======
+TRACE_SERVICE_NAME = 'carplate_detect_api'
+
+def add_trace_span(spans, name, start):
+    """記錄本服務的處理區段，回傳給呼叫端合併至同一條追蹤"""
+    spans.append({
+        'name': name,
+        'service': TRACE_SERVICE_NAME,
+        'start': start,
+        'end': time.time()
+    })
 
-GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
-if not GEMINI_API_KEY:
-    raise ValueError("請在 .env 檔案中設定 GEMINI_API_KEY 環境變數")
+# ====== 6. 【修改後】的 API 端點 ======
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    """就緒探針：模型已載入並完成暖機才回傳 200"""
+    status = {
+        "ready": DETECTOR_READY,
+        "pid": os.getpid(),
+        "torch_threads": torch.get_num_threads()
+    }
+    return jsonify(status), 200 if DETECTOR_READY else 503
+
+@app.route("/recognizer/stats", methods=["GET"])
+def recognizer_stats():
+    """車牌辨識器統計：各層延遲與勝出次數、升級次數，以及遠端辨識器的呼叫數、重試與上傳大小"""
+    return jsonify(plate_recognizer.stats())
 
-# ====== 5. 【修改後】的 API 端點 ======
 @app.route("/recognize_plate", methods=["POST"])
 def recognize_plate():
-    if "file" not in request.files:
+    if "file" not in request.files and "plate" not in request.files:
         return jsonify({"error": "No file uploaded"}), 400
 
-    file = request.files["file"]
-    save_path = "uploaded_image.jpg"
-    file.save(save_path)
+    # 沿用偵測端於擷取框架時產生的 trace id
+    trace = {
+        "trace_id": request.headers.get('X-Trace-Id') or uuid.uuid4().hex,
+        "spans": []
+    }
 
-    processed_plate_path = detect_and_save_plate(save_path, plate_detector)
-    plate_number = None
-    if processed_plate_path:
-        plate_number = recognize_plate_with_gemini(processed_plate_path, GEMINI_API_KEY)
-    else:
-        plate_number = recognize_plate_with_gemini(save_path, GEMINI_API_KEY)
+    # 上傳圖片直接於記憶體解碼，整個流程不落地 (併發請求互不干擾)
+    span_start = time.time()
+    image = decode_upload(request.files["file"]) if "file" in request.files else None
+    uploaded_plate = decode_upload(request.files["plate"]) if "plate" in request.files else None
+    if image is None and uploaded_plate is None:
+        return jsonify({"error": "Invalid image", "trace": trace}), 400
+    add_trace_span(trace["spans"], 'decode_upload', span_start)
+    dump_debug_image(image, trace["trace_id"], 'upload')
+
+    # 呼叫端已偵測到車牌 (車牌框或預先裁切的車牌圖) 且信心度足夠時，略過 YOLO 車牌偵測
+    plate_conf = request.form.get('plate_conf', type=float)
+    trust_hint = plate_conf is None or plate_conf >= PLATE_HINT_MIN_CONF
+    plate_box = parse_plate_box(request.form.get('plate_box'))
+    plate_image = None
+
+    span_start = time.time()
+    if uploaded_plate is not None and uploaded_plate.size and (trust_hint or image is None):
+        plate_image = correct_perspective_debug(uploaded_plate)
+    elif plate_box and trust_hint and image is not None:
+        plate_image = crop_plate(image, plate_box)
+    if plate_image is not None:
+        add_trace_span(trace["spans"], 'plate_hint_crop', span_start)
+    elif image is not None:
+        plate_image = detect_plate(image, plate_detector)
+        add_trace_span(trace["spans"], 'plate_detection', span_start)
+    dump_debug_image(plate_image, trace["trace_id"], 'plate')
+
+    recognition = plate_recognizer.recognize_detailed(plate_image if plate_image is not None else image)
+    for tier, start, end in recognition['attempts']:
+        trace["spans"].append({'name': f"{tier}_recognition", 'service': TRACE_SERVICE_NAME, 'start': start, 'end': end})
+    plate_number = recognition['text']
 
     # 【核心修改 1】防禦性清理：確保 plate_number 格式統一
+    plate_number = normalize_plate_number(plate_number)
     if plate_number:
-        # 強制移除所有可能存在的破折號和空格
-        plate_number = plate_number.replace('-', '').replace(' ', '')
         print(f"--- DEBUG: 清理後的車牌號碼: '{plate_number}'")
 
     # 【核心修改 2】健壯的邏輯判斷
     # 確保 plate_number 是一個有效的字串，且不是 'NO_PLATE_FOUND'
     if plate_number and plate_number != 'NO_PLATE_FOUND':
+        span_start = time.time()
         owner_info = Owner.query.filter_by(license_plate_number=plate_number).first()
+        add_trace_span(trace["spans"], 'owner_lookup', span_start)
 
         if owner_info:
             # 在資料庫中找到了車主資料
             return jsonify({
-                "data": owner_info.to_dict()
+                "data": owner_info.to_dict(),
+                "trace": trace
             })
         else:
             # 辨識出車牌，但在資料庫中找不到
@@ -200,15 +337,105 @@ def recognize_plate():
                 "status": "not_found",
                 "message": "資料庫中查無此車牌號碼",
                 "license_plate_number": plate_number, 
-                "data": None
+                "data": None,
+                "trace": trace
             }), 404
 
     else:
         # 處理辨識失敗的情況 (回傳 None 或 'NO_PLATE_FOUND')
         return jsonify({
             "status": "error",
-            "message": "從圖片中辨識車牌失敗或未找到車牌。"
+            "message": "從圖片中辨識車牌失敗或未找到車牌。",
+            "trace": trace
         }), 500
 
+@app.route("/recognize_plates", methods=["POST"])
+def recognize_plates():
+    """批次車牌辨識：YOLO 對整批圖片推理一次，校正與辨識併發執行，依上傳順序回傳各圖片結果"""
+    if request.content_length and request.content_length > MAX_BATCH_BYTES:
+        return jsonify({"error": f"請求大小超過上限 {MAX_BATCH_BYTES} bytes"}), 413
+
+    trace = {
+        "trace_id": request.headers.get('X-Trace-Id') or uuid.uuid4().hex,
+        "spans": []
+    }
+
+    # 支援 multipart (多個 files 欄位) 或二進位批次容器
+    span_start = time.time()
+    if request.mimetype == BATCH_CONTENT_TYPE:
+        try:
+            blobs = read_batch_container(request.get_data())
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+    else:
+        blobs = [file.read() for file in request.files.getlist("files")]
+    if not blobs:
+        return jsonify({"error": "No file uploaded"}), 400
+    if len(blobs) > MAX_BATCH_IMAGES:
+        return jsonify({"error": f"單次最多 {MAX_BATCH_IMAGES} 張圖片"}), 413
+    if sum(len(blob) for blob in blobs) > MAX_BATCH_BYTES:
+        return jsonify({"error": f"圖片總大小超過上限 {MAX_BATCH_BYTES} bytes"}), 413
+
+    images = list(batch_executor.map(decode_bytes, blobs))
+    add_trace_span(trace["spans"], 'decode_upload', span_start)
+
+    # 單次批次推理 (無法解碼的圖片不送入模型)
+    valid_indexes = [i for i, image in enumerate(images) if image is not None]
+    plate_images = [None] * len(images)
+    if valid_indexes:
+        span_start = time.time()
+        batch_results = plate_detector([images[i] for i in valid_indexes], verbose=False)
+        add_trace_span(trace["spans"], 'plate_detection', span_start)
+
+        span_start = time.time()
+        crops = batch_executor.map(lambda pair: extract_plate(*pair),
+                                   [(images[i], result) for i, result in zip(valid_indexes, batch_results)])
+        for i, plate_image in zip(valid_indexes, crops):
+            plate_images[i] = plate_image if plate_image is not None else images[i]
+        add_trace_span(trace["spans"], 'plate_rectify', span_start)
+
+    span_start = time.time()
+    recognitions = batch_executor.map(
+        plate_recognizer.recognize,
+        plate_images
+    )
+    plate_numbers = [normalize_plate_number(plate_number) for plate_number in recognitions]
+    add_trace_span(trace["spans"], 'plate_recognition', span_start)
+
+    # 一次查詢所有辨識出的車牌
+    span_start = time.time()
+    found_plates = {p for p in plate_numbers if p and p != 'NO_PLATE_FOUND'}
+    owners = {}
+    if found_plates:
+        owners = {
+            owner.license_plate_number: owner.to_dict()
+            for owner in Owner.query.filter(Owner.license_plate_number.in_(found_plates)).all()
+        }
+    add_trace_span(trace["spans"], 'owner_lookup', span_start)
+
+    # 部分失敗不影響其他圖片：每張圖片各自回報狀態
+    results = []
+    for index, (image, plate_number) in enumerate(zip(images, plate_numbers)):
+        if image is None:
+            results.append({"index": index, "status": "error", "message": "無法解碼圖片"})
+        elif not plate_number or plate_number == 'NO_PLATE_FOUND':
+            results.append({"index": index, "status": "error", "message": "從圖片中辨識車牌失敗或未找到車牌。"})
+        elif plate_number in owners:
+            results.append({"index": index, "status": "success", "license_plate_number": plate_number,
+                            "data": owners[plate_number]})
+        else:
+            results.append({"index": index, "status": "not_found", "license_plate_number": plate_number,
+                            "message": "資料庫中查無此車牌號碼", "data": None})
+
+    return jsonify({
+        "status": "success",
+        "count": len(results),
+        "succeeded": sum(1 for r in results if r["status"] == "success"),
+        "results": results,
+        "trace": trace
+    })
+
 if __name__ == "__main__":
+    # 開發用伺服器；正式環境請使用 gunicorn -c gunicorn.conf.py run:app
+    warm_up_detector()
     app.run(host='0.0.0.0', port=3001, debug=True)
\ No newline at end of file
@@ -0,0 +1,233 @@
+"""
+遠端車牌辨識器 (PlateRecognizer) 單元測試
+以 StubPlateRecognizer 取代 Gemini，驗證併發合併、併發上限、重試退避與影像縮小。
+執行: pytest tests/
+"""
+
+import threading
+import pytest
+
+cv2 = pytest.importorskip('cv2')
+np = pytest.importorskip('numpy')
+pytest.importorskip('google.generativeai')
+
+import recognizers
+from recognizers import GeminiPlateRecognizer, PermanentRecognizerError, PlateRecognizer, StubPlateRecognizer
+
+PLATE_NUMBER = 'ABC1234'
+
+
+def make_plate_image(width=640, height=200, seed=0):
+    """產生彩色車牌影像 (不同 seed 產生不同內容，避免被合併為同一次呼叫)"""
+    rng = np.random.default_rng(seed)
+    image = rng.integers(0, 60, size=(height, width, 3), dtype=np.uint8)
+    cv2.rectangle(image, (10, 10), (width - 10, height - 10), (235, 235, 235), -1)
+    cv2.putText(image, PLATE_NUMBER, (30, int(height * 0.7)), cv2.FONT_HERSHEY_SIMPLEX,
+                width / 200, (20, 20, 20), max(2, width // 100))
+    return image
+
+
+def make_stub(latency_ms=0, max_concurrency=4, max_retries=2):
+    return StubPlateRecognizer(PLATE_NUMBER, latency_ms, max_concurrency=max_concurrency,
+                               max_retries=max_retries, timeout=1)
+
+
+def run_concurrently(func, arguments):
+    """同時啟動多個執行緒呼叫 func，回傳各自的結果"""
+    barrier = threading.Barrier(len(arguments))
+    results = [None] * len(arguments)
+
+    def worker(index, argument):
+        barrier.wait()
+        results[index] = func(argument)
+
+    threads = [threading.Thread(target=worker, args=(i, arg)) for i, arg in enumerate(arguments)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+class FlakyRecognizer(StubPlateRecognizer):
+    """前 failures 次呼叫拋出指定例外的替身辨識器"""
+
+    def __init__(self, failures, error=ConnectionError, **kwargs):
+        super().__init__(PLATE_NUMBER, 0, **kwargs)
+        self.failures = failures
+        self.error = error
+        self.attempts = 0
+
+    def call(self, payload):
+        self.attempts += 1
+        if self.attempts <= self.failures:
+            raise self.error('模擬錯誤')
+        return self.plate_number
+
+
+class ConcurrencyProbe(StubPlateRecognizer):
+    """記錄同時進行中的最大呼叫數"""
+
+    def __init__(self, **kwargs):
+        super().__init__(PLATE_NUMBER, 50, **kwargs)
+        self.probe_lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+
+    def call(self, payload):
+        with self.probe_lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            return super().call(payload)
+        finally:
+            with self.probe_lock:
+                self.active -= 1
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """攔截重試退避的 sleep，記錄等待秒數"""
+    recorded = []
+    monkeypatch.setattr(recognizers.time, 'sleep', recorded.append)
+    return recorded
+
+
+def test_identical_concurrent_crops_share_one_call():
+    recognizer = make_stub(latency_ms=200)
+    image = make_plate_image()
+
+    results = run_concurrently(recognizer.recognize, [image] * 8)
+
+    assert results == [PLATE_NUMBER] * 8
+    stats = recognizer.stats()
+    assert stats['requests'] == 8
+    assert stats['calls'] == 1
+    assert stats['coalesced'] == 7
+
+
+def test_different_crops_are_not_coalesced():
+    recognizer = make_stub(latency_ms=50)
+    images = [make_plate_image(seed=seed) for seed in range(3)]
+
+    run_concurrently(recognizer.recognize, images)
+
+    assert recognizer.stats()['calls'] == 3
+    assert recognizer.stats()['coalesced'] == 0
+
+
+def test_concurrent_calls_are_bounded_by_semaphore():
+    recognizer = ConcurrencyProbe(max_concurrency=2, max_retries=0, timeout=1)
+    images = [make_plate_image(seed=seed) for seed in range(8)]
+
+    results = run_concurrently(recognizer.recognize, images)
+
+    assert results == [PLATE_NUMBER] * 8
+    assert recognizer.max_active == 2
+
+
+def test_transient_errors_are_retried_with_exponential_backoff(sleeps):
+    recognizer = FlakyRecognizer(failures=2, max_concurrency=1, max_retries=2, timeout=1)
+
+    assert recognizer.recognize(make_plate_image()) == PLATE_NUMBER
+    assert recognizer.attempts == 3
+    assert sleeps == [recognizers.RECOGNIZER_RETRY_BACKOFF, recognizers.RECOGNIZER_RETRY_BACKOFF * 2]
+    stats = recognizer.stats()
+    assert stats['retries'] == 2
+    assert stats['failures'] == 0
+
+
+def test_gives_up_after_max_retries(sleeps):
+    recognizer = FlakyRecognizer(failures=10, max_concurrency=1, max_retries=2, timeout=1)
+
+    assert recognizer.recognize(make_plate_image()) is None
+    assert recognizer.attempts == 3
+    assert len(sleeps) == 2
+    assert recognizer.stats()['failures'] == 1
+
+
+def test_permanent_errors_are_not_retried(sleeps):
+    recognizer = FlakyRecognizer(failures=10, error=PermanentRecognizerError,
+                                 max_concurrency=1, max_retries=2, timeout=1)
+
+    assert recognizer.recognize(make_plate_image()) is None
+    assert recognizer.attempts == 1
+    assert sleeps == []
+    stats = recognizer.stats()
+    assert stats['retries'] == 0
+    assert stats['failures'] == 1
+
+
+class BlockedResponse:
+    """模擬遭安全機制封鎖的 Gemini 回應：沒有候選結果，讀取 text 時拋出 ValueError"""
+
+    prompt_feedback = 'block_reason: SAFETY'
+
+    @property
+    def text(self):
+        raise ValueError('The `response.text` quick accessor only works when the response contains a valid `Part`')
+
+
+class BlockingModel:
+    def __init__(self):
+        self.calls = 0
+
+    def generate_content(self, contents, request_options=None):
+        self.calls += 1
+        return BlockedResponse()
+
+
+def test_blocked_gemini_response_is_not_retried(sleeps):
+    recognizer = GeminiPlateRecognizer('test-key', 'gemini-2.5-flash-lite', max_concurrency=1, max_retries=2, timeout=1)
+    recognizer.model = BlockingModel()
+
+    assert recognizer.recognize(make_plate_image()) is None
+    assert recognizer.model.calls == 1
+    assert sleeps == []
+
+
+def test_failed_call_releases_waiting_requests(sleeps):
+    recognizer = FlakyRecognizer(failures=10, max_concurrency=1, max_retries=0, timeout=1)
+    image = make_plate_image()
+
+    assert recognizer.recognize(image) is None
+    # 失敗後不應殘留進行中的呼叫，下一次請求重新呼叫
+    assert recognizer.in_flight == {}
+    assert recognizer.recognize(image) is None
+    assert recognizer.attempts == 2
+
+
+def test_minimize_outputs_small_grayscale_jpeg():
+    image = make_plate_image(width=1280, height=400)
+
+    payload = PlateRecognizer.minimize(image)
+    decoded = cv2.imdecode(np.frombuffer(payload, np.uint8), cv2.IMREAD_UNCHANGED)
+
+    assert payload[:2] == b'\xff\xd8'
+    assert decoded.ndim == 2
+    assert decoded.shape == (100, recognizers.RECOGNIZER_MAX_WIDTH)
+    _, full_color = cv2.imencode('.jpg', image)
+    assert len(payload) < len(full_color.tobytes()) / 4
+
+
+def test_minimize_does_not_upscale_small_crops():
+    image = make_plate_image(width=160, height=50)
+
+    decoded = cv2.imdecode(np.frombuffer(PlateRecognizer.minimize(image), np.uint8), cv2.IMREAD_UNCHANGED)
+
+    assert decoded.shape == (50, 160)
+
+
+def test_minimize_is_smaller_than_color_jpeg_without_resize():
+    image = make_plate_image(width=recognizers.RECOGNIZER_MAX_WIDTH, height=100)
+
+    _, full_color = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, recognizers.RECOGNIZER_JPEG_QUALITY])
+
+    assert len(PlateRecognizer.minimize(image)) < len(full_color.tobytes())
+
+
+def test_empty_image_is_not_sent():
+    recognizer = make_stub()
+
+    assert recognizer.recognize(np.zeros((0, 0, 3), dtype=np.uint8)) is None
+    assert recognizer.stats()['requests'] == 0
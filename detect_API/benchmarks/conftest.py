@@ -0,0 +1,74 @@
+"""
+偵測熱路徑微基準測試共用設定
+不需要真實模型與攝影機，以合成偵測結果驅動 DetectionLogic、VideoRenderer 與證據編碼
+
+執行並輸出 JSON (可跨 commit 比較):
+    pytest detect_API/benchmarks --benchmark-json=bench.json
+    pytest detect_API/benchmarks --benchmark-autosave --benchmark-compare
+"""
+
+import importlib
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+DETECT_API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FRAME_SHAPE = (270, 480, 3)
+DENSITIES = [0, 10, 50, 200]
+PERSON_NAMES = {0: 'helmet', 1: 'no-helmet'}
+PLATE_NAMES = {0: 'license_plate'}
+
+
+@pytest.fixture(scope='session')
+def detector(tmp_path_factory):
+    """匯入偵測模組 (於暫存目錄執行，避免在專案內建立截圖、影片與待送佇列檔案)"""
+    os.chdir(tmp_path_factory.mktemp('detector_workdir'))
+    sys.path.insert(0, DETECT_API_DIR)
+    module = importlib.import_module('run_local_optimized')
+    module.person_model = SimpleNamespace(names=PERSON_NAMES)
+    module.plate_model = SimpleNamespace(names=PLATE_NAMES)
+    return module
+
+
+@pytest.fixture(autouse=True)
+def no_dispatch(detector, monkeypatch):
+    """違規事件不送出 (避免啟動 LPR 呼叫與資料庫寫入)"""
+    monkeypatch.setattr(detector, 'dispatch_violation_event', lambda *args, **kwargs: None)
+
+
+@pytest.fixture(scope='session')
+def frame():
+    """固定亂數種子的合成框架"""
+    import numpy as np
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 255, FRAME_SHAPE, dtype=np.uint8)
+
+
+def make_results(frame, count, names, box_size, seed):
+    """產生指定數量偵測框的 ultralytics Results (xyxy, conf, cls)"""
+    import numpy as np
+    import torch
+    from ultralytics.engine.results import Results
+    rng = np.random.default_rng(seed)
+    height, width = frame.shape[:2]
+    x1 = rng.uniform(0, width - box_size[0], count)
+    y1 = rng.uniform(0, height - box_size[1], count)
+    data = np.stack([
+        x1, y1, x1 + box_size[0], y1 + box_size[1],
+        rng.uniform(0.5, 1.0, count),
+        rng.integers(0, len(names), count)
+    ], axis=1) if count else np.zeros((0, 6))
+    return Results(orig_img=frame, path='', names=names, boxes=torch.tensor(data, dtype=torch.float32))
+
+
+@pytest.fixture
+def make_person_results(frame):
+    return lambda count: make_results(frame, count, PERSON_NAMES, (24, 24), seed=count)
+
+
+@pytest.fixture
+def make_plate_results(frame):
+    return lambda count: make_results(frame, count, PLATE_NAMES, (30, 10), seed=count + 1)
@@ -0,0 +1,93 @@
+"""偵測熱路徑微基準測試 (偵測框數量 0-200)"""
+
+import copy
+
+import pytest
+
+# 缺少偵測模組的相依套件時整個檔案略過
+for module_name in ['pytest_benchmark', 'cv2', 'numpy', 'torch', 'torchvision', 'ultralytics',
+                    'psycopg2', 'flask', 'flask_cors', 'dotenv', 'requests']:
+    pytest.importorskip(module_name)
+
+from conftest import DENSITIES  # noqa: E402
+
+
+@pytest.mark.parametrize('count', DENSITIES)
+def test_extract_person_detections(benchmark, detector, make_person_results, count):
+    person_results = make_person_results(count)
+    benchmark(detector.DetectionLogic.extract_person_detections, person_results, detector.person_model)
+
+
+@pytest.mark.parametrize('count', DENSITIES)
+def test_extract_plate_detections(benchmark, detector, make_plate_results, count):
+    plate_results = make_plate_results(count)
+    benchmark(detector.DetectionLogic.extract_plate_detections, plate_results, detector.plate_model)
+
+
+@pytest.mark.parametrize('count', DENSITIES)
+def test_analyze_violations_for_plate(benchmark, detector, make_person_results, make_plate_results, count):
+    person_detections = detector.DetectionLogic.extract_person_detections(
+        make_person_results(count), detector.person_model
+    )
+    roi_coords = detector.DetectionLogic.calculate_roi_coordinates([200, 200, 230, 210])
+    benchmark.pedantic(
+        detector.DetectionLogic.analyze_violations_for_plate,
+        setup=lambda: ((copy.deepcopy(person_detections), roi_coords), {}),
+        rounds=200
+    )
+
+
+@pytest.mark.parametrize('count', DENSITIES)
+def test_process_unassociated_riders(benchmark, detector, frame, make_person_results, count):
+    person_detections = detector.DetectionLogic.extract_person_detections(
+        make_person_results(count), detector.person_model
+    )
+    benchmark.pedantic(
+        detector.DetectionLogic.process_unassociated_riders,
+        setup=lambda: ((copy.deepcopy(person_detections), frame.copy()), {}),
+        rounds=200
+    )
+
+
+@pytest.mark.parametrize('count', DENSITIES)
+def test_process_plate_centered_detection(benchmark, detector, frame, make_person_results, make_plate_results, count):
+    person_detections = detector.DetectionLogic.extract_person_detections(
+        make_person_results(count), detector.person_model
+    )
+    plate_detections = detector.DetectionLogic.extract_plate_detections(
+        make_plate_results(max(1, count // 10)), detector.plate_model
+    )
+    benchmark.pedantic(
+        detector.process_plate_centered_detection,
+        setup=lambda: ((plate_detections, copy.deepcopy(person_detections), frame.copy()), {}),
+        rounds=200
+    )
+
+
+@pytest.mark.parametrize('count', DENSITIES)
+def test_draw_person_detections(benchmark, detector, frame, make_person_results, count):
+    person_results = make_person_results(count)
+    benchmark.pedantic(
+        detector.VideoRenderer.draw_person_detections,
+        setup=lambda: ((frame.copy(), person_results, 1.0), {}),
+        rounds=100
+    )
+
+
+@pytest.mark.parametrize('count', DENSITIES)
+def test_draw_plate_detections(benchmark, detector, frame, make_plate_results, count):
+    plate_results = make_plate_results(count)
+    benchmark.pedantic(
+        detector.VideoRenderer.draw_plate_detections,
+        setup=lambda: ((frame.copy(), plate_results, 1.0), {}),
+        rounds=100
+    )
+
+
+def test_encode_frame_to_jpeg(benchmark, detector, frame):
+    benchmark(detector.VideoRenderer.encode_frame_to_jpeg, frame)
+
+
+def test_prepare_image_data(benchmark, detector, frame):
+    evidence_crop = frame[60:260, 120:360]
+    benchmark(detector.LPRApiClient.prepare_image_data, evidence_crop)
@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+"""
+雙模型參數掃描基準測試工具
+在本地標註資料集上執行騎士偵測模型與車牌偵測模型，掃描輸入尺寸、推理後端、
+執行緒數與信心度閾值，輸出每幀延遲、吞吐量與各類別 (helmet / no-helmet /
+license_plate) 的 precision / recall，並繪製 Pareto 圖，作為各攝影機參數設定的依據。
+
+資料集格式 (YOLO 標註)：
+    dataset/images/*.jpg
+    dataset/labels/*.txt      # 每行: class_id cx cy w h (正規化座標)
+class_id 依照 --class-names 的順序對應 (預設 helmet,no-helmet,license_plate)。
+
+使用範例：
+    python model_sweep_benchmark.py --dataset ./dataset \\
+        --imgsz 256,320,416 --backends pytorch,onnx --threads 1,2,4 \\
+        --conf 0.3,0.5,0.65 --output sweep_results
+"""
+
+import os
+import sys
+import csv
+import glob
+import time
+import argparse
+import cv2
+import numpy as np
+import torch
+from ultralytics import YOLO
+from dotenv import load_dotenv
+
+# 設定環境變數檔案路徑
+env_path = os.path.join(os.path.dirname(__file__), '..', '.env')
+load_dotenv(env_path)
+
+DEFAULT_CLASS_NAMES = ['helmet', 'no-helmet', 'license_plate']
+EXPORT_FORMATS = {'pytorch': None, 'torchscript': 'torchscript', 'onnx': 'onnx', 'openvino': 'openvino'}
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+WARMUP_FRAMES = 3
+MATCH_IOU_THRESHOLD = 0.5
+
+# ==================== 1. 參數解析 ====================
+def parse_list(value, cast):
+    """解析以逗號分隔的參數列表"""
+    return [cast(item.strip()) for item in value.split(',') if item.strip()]
+
+def parse_arguments():
+    """解析命令列參數"""
+    parser = argparse.ArgumentParser(description='騎士/車牌模型參數掃描基準測試')
+    parser.add_argument('--dataset', required=True, help='標註資料集目錄 (包含 images/ 與 labels/)')
+    parser.add_argument('--person-model', default=os.getenv('HELMATE_MODEL_PATH'), help='騎士偵測模型路徑')
+    parser.add_argument('--plate-model', default=os.getenv('PLATE_MODEL_PATH'), help='車牌偵測模型路徑')
+    parser.add_argument('--class-names', default=','.join(DEFAULT_CLASS_NAMES), help='標註檔 class_id 對應的類別名稱')
+    parser.add_argument('--imgsz', default='320', help='輸入尺寸列表，例如 256,320,416')
+    parser.add_argument('--backends', default='pytorch', help=f"推理後端列表: {','.join(EXPORT_FORMATS)}")
+    parser.add_argument('--threads', default=str(torch.get_num_threads()), help='執行緒數列表，例如 1,2,4')
+    parser.add_argument('--conf', default='0.3,0.5,0.65', help='信心度閾值列表')
+    parser.add_argument('--max-images', type=int, default=0, help='最多使用的圖片數 (0 表示全部)')
+    parser.add_argument('--output', default='sweep_results', help='輸出目錄 (CSV 與 Pareto 圖)')
+    return parser.parse_args()
+
+# ==================== 2. 資料集載入 ====================
+class LabelledDataset:
+    """YOLO 格式標註資料集"""
+
+    def __init__(self, root, class_names, max_images=0):
+        self.class_names = class_names
+        image_paths = sorted(
+            path for path in glob.glob(os.path.join(root, 'images', '*'))
+            if path.lower().endswith(IMAGE_EXTENSIONS)
+        )
+        if max_images > 0:
+            image_paths = image_paths[:max_images]
+        self.samples = [self.load_sample(root, path) for path in image_paths]
+        self.samples = [sample for sample in self.samples if sample is not None]
+
+    def load_sample(self, root, image_path):
+        """載入單張圖片與其標註框 (轉換為像素 xyxy 座標)"""
+        image = cv2.imread(image_path)
+        if image is None:
+            print(f"⚠️ 無法讀取圖片，略過: {image_path}")
+            return None
+        h, w = image.shape[:2]
+        stem = os.path.splitext(os.path.basename(image_path))[0]
+        label_path = os.path.join(root, 'labels', f"{stem}.txt")
+
+        boxes = []
+        if os.path.exists(label_path):
+            with open(label_path, 'r') as label_file:
+                for line in label_file:
+                    parts = line.split()
+                    if len(parts) < 5:
+                        continue
+                    class_id = int(parts[0])
+                    cx, cy, bw, bh = (float(v) for v in parts[1:5])
+                    if class_id >= len(self.class_names):
+                        continue
+                    boxes.append({
+                        'class_name': self.class_names[class_id],
+                        'box': np.array([(cx - bw / 2) * w, (cy - bh / 2) * h,
+                                         (cx + bw / 2) * w, (cy + bh / 2) * h])
+                    })
+        return {'path': image_path, 'image': image, 'labels': boxes}
+
+# ==================== 3. 模型與後端管理 ====================
+class BackendModelCache:
+    """依 (模型, 後端, 輸入尺寸) 快取匯出的模型"""
+
+    def __init__(self):
+        self.models = {}
+
+    def get(self, model_path, backend, imgsz):
+        """取得指定後端的模型，必要時先匯出"""
+        key = (model_path, backend, imgsz)
+        if key not in self.models:
+            export_format = EXPORT_FORMATS[backend]
+            if export_format is None:
+                self.models[key] = YOLO(model_path)
+            else:
+                print(f"📦 匯出 {os.path.basename(model_path)} -> {backend} (imgsz={imgsz})...")
+                exported_path = YOLO(model_path).export(format=export_format, imgsz=imgsz)
+                self.models[key] = YOLO(exported_path, task='detect')
+        return self.models[key]
+
+def apply_thread_count(threads):
+    """設定推理執行緒數 (作用於 PyTorch 與 OpenCV；其他後端使用其預設執行緒池)"""
+    torch.set_num_threads(threads)
+    cv2.setNumThreads(threads)
+
+# ==================== 4. 推理與評估 ====================
+class SweepRunner:
+    """執行單一組態的推理並計算指標"""
+
+    @staticmethod
+    def collect_predictions(result, model):
+        """將 ultralytics 結果轉換為預測列表"""
+        return [
+            {
+                'class_name': model.names[int(box.cls[0])],
+                'conf': box.conf[0].item(),
+                'box': box.xyxy[0].cpu().numpy()
+            }
+            for box in result.boxes
+        ]
+
+    @staticmethod
+    def run_inference(samples, person_model, plate_model, imgsz, min_conf):
+        """對所有圖片執行雙模型推理，回傳預測與每幀延遲"""
+        predictions, latencies = [], []
+        for index, sample in enumerate(samples):
+            start = time.perf_counter()
+            person_result = person_model(sample['image'], conf=min_conf, verbose=False, imgsz=imgsz)[0]
+            plate_result = plate_model(sample['image'], conf=min_conf, verbose=False, imgsz=imgsz)[0]
+            elapsed_ms = (time.perf_counter() - start) * 1000.0
+            if index >= WARMUP_FRAMES or len(samples) <= WARMUP_FRAMES:
+                latencies.append(elapsed_ms)
+            predictions.append(
+                SweepRunner.collect_predictions(person_result, person_model) +
+                SweepRunner.collect_predictions(plate_result, plate_model)
+            )
+        return predictions, latencies
+
+    @staticmethod
+    def box_iou(box_a, box_b):
+        """計算兩個 xyxy 框的 IoU"""
+        x1, y1 = max(box_a[0], box_b[0]), max(box_a[1], box_b[1])
+        x2, y2 = min(box_a[2], box_b[2]), min(box_a[3], box_b[3])
+        inter = max(0.0, x2 - x1) * max(0.0, y2 - y1)
+        area_a = (box_a[2] - box_a[0]) * (box_a[3] - box_a[1])
+        area_b = (box_b[2] - box_b[0]) * (box_b[3] - box_b[1])
+        union = area_a + area_b - inter
+        return inter / union if union > 0 else 0.0
+
+    @staticmethod
+    def evaluate(samples, predictions, class_names, conf_threshold):
+        """在指定信心度閾值下計算各類別的 precision / recall"""
+        counts = {name: {'tp': 0, 'fp': 0, 'fn': 0} for name in class_names}
+        for sample, image_predictions in zip(samples, predictions):
+            for class_name in class_names:
+                labels = [label['box'] for label in sample['labels'] if label['class_name'] == class_name]
+                preds = sorted(
+                    (p for p in image_predictions if p['class_name'] == class_name and p['conf'] >= conf_threshold),
+                    key=lambda p: p['conf'], reverse=True
+                )
+                matched = set()
+                for pred in preds:
+                    best_iou, best_index = 0.0, None
+                    for index, label_box in enumerate(labels):
+                        if index in matched:
+                            continue
+                        iou = SweepRunner.box_iou(pred['box'], label_box)
+                        if iou > best_iou:
+                            best_iou, best_index = iou, index
+                    if best_index is not None and best_iou >= MATCH_IOU_THRESHOLD:
+                        matched.add(best_index)
+                        counts[class_name]['tp'] += 1
+                    else:
+                        counts[class_name]['fp'] += 1
+                counts[class_name]['fn'] += len(labels) - len(matched)
+
+        metrics = {}
+        for class_name, c in counts.items():
+            precision = c['tp'] / (c['tp'] + c['fp']) if c['tp'] + c['fp'] else 0.0
+            recall = c['tp'] / (c['tp'] + c['fn']) if c['tp'] + c['fn'] else 0.0
+            f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+            metrics[class_name] = {'precision': precision, 'recall': recall, 'f1': f1}
+        return metrics
+
+# ==================== 5. 輸出報表 ====================
+class SweepReport:
+    """輸出表格、CSV 與 Pareto 圖"""
+
+    @staticmethod
+    def build_row(backend, imgsz, threads, conf, latencies, metrics):
+        """組合單一組態的結果列"""
+        latency_mean = float(np.mean(latencies)) if latencies else 0.0
+        row = {
+            'backend': backend,
+            'imgsz': imgsz,
+            'threads': threads,
+            'conf': conf,
+            'latency_ms_mean': round(latency_mean, 2),
+            'latency_ms_p95': round(float(np.percentile(latencies, 95)), 2) if latencies else 0.0,
+            'throughput_fps': round(1000.0 / latency_mean, 2) if latency_mean > 0 else 0.0
+        }
+        for class_name, m in metrics.items():
+            row[f'{class_name}_precision'] = round(m['precision'], 3)
+            row[f'{class_name}_recall'] = round(m['recall'], 3)
+            row[f'{class_name}_f1'] = round(m['f1'], 3)
+        return row
+
+    @staticmethod
+    def print_table(rows):
+        """以固定寬度表格印出結果"""
+        if not rows:
+            return
+        columns = list(rows[0].keys())
+        widths = {col: max(len(col), *(len(str(row[col])) for row in rows)) for col in columns}
+        print(' | '.join(col.ljust(widths[col]) for col in columns))
+        print('-+-'.join('-' * widths[col] for col in columns))
+        for row in rows:
+            print(' | '.join(str(row[col]).ljust(widths[col]) for col in columns))
+
+    @staticmethod
+    def write_csv(rows, output_path):
+        """寫出 CSV"""
+        with open(output_path, 'w', newline='', encoding='utf-8') as csv_file:
+            writer = csv.DictWriter(csv_file, fieldnames=list(rows[0].keys()))
+            writer.writeheader()
+            writer.writerows(rows)
+
+    @staticmethod
+    def pareto_front(points):
+        """找出 (延遲越低越好, F1 越高越好) 的 Pareto 前緣索引"""
+        front = []
+        for i, (lat_i, f1_i) in enumerate(points):
+            dominated = any(
+                lat_j <= lat_i and f1_j >= f1_i and (lat_j < lat_i or f1_j > f1_i)
+                for j, (lat_j, f1_j) in enumerate(points) if j != i
+            )
+            if not dominated:
+                front.append(i)
+        return sorted(front, key=lambda i: points[i][0])
+
+    @staticmethod
+    def plot_pareto(rows, class_names, output_path):
+        """為每個類別繪製延遲與 F1 的 Pareto 圖"""
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+
+        fig, axes = plt.subplots(1, len(class_names), figsize=(6 * len(class_names), 5), squeeze=False)
+        for ax, class_name in zip(axes[0], class_names):
+            points = [(row['latency_ms_mean'], row[f'{class_name}_f1']) for row in rows]
+            ax.scatter([p[0] for p in points], [p[1] for p in points], alpha=0.5, label='configs')
+            front = SweepReport.pareto_front(points)
+            ax.plot([points[i][0] for i in front], [points[i][1] for i in front], 'r-o', label='Pareto front')
+            for i in front:
+                row = rows[i]
+                ax.annotate(f"{row['backend']}/{row['imgsz']}/t{row['threads']}/c{row['conf']}",
+                            points[i], fontsize=7, xytext=(4, 4), textcoords='offset points')
+            ax.set_title(class_name)
+            ax.set_xlabel('latency per frame (ms)')
+            ax.set_ylabel('F1')
+            ax.grid(True, alpha=0.3)
+            ax.legend()
+        fig.tight_layout()
+        fig.savefig(output_path, dpi=120)
+        plt.close(fig)
+
+# ==================== 6. 主程序入口 ====================
+def run_sweep(args):
+    """執行完整的參數掃描"""
+    class_names = parse_list(args.class_names, str)
+    imgsz_list = parse_list(args.imgsz, int)
+    backends = parse_list(args.backends, str)
+    thread_list = parse_list(args.threads, int)
+    conf_list = sorted(parse_list(args.conf, float))
+
+    for backend in backends:
+        if backend not in EXPORT_FORMATS:
+            raise ValueError(f"不支援的推理後端: {backend}")
+    for model_path in [args.person_model, args.plate_model]:
+        if not model_path or not os.path.exists(model_path):
+            raise ValueError(f"模型不存在: {model_path}")
+
+    dataset = LabelledDataset(args.dataset, class_names, args.max_images)
+    if not dataset.samples:
+        raise ValueError(f"資料集中沒有可用的圖片: {args.dataset}")
+    print(f"📂 資料集: {len(dataset.samples)} 張圖片")
+
+    os.makedirs(args.output, exist_ok=True)
+    model_cache = BackendModelCache()
+    rows = []
+
+    for backend in backends:
+        for imgsz in imgsz_list:
+            person_model = model_cache.get(args.person_model, backend, imgsz)
+            plate_model = model_cache.get(args.plate_model, backend, imgsz)
+            for threads in thread_list:
+                apply_thread_count(threads)
+                print(f"⏱️ 執行組態: backend={backend}, imgsz={imgsz}, threads={threads}")
+                # 以最低閾值推理一次，再於各閾值下評估
+                predictions, latencies = SweepRunner.run_inference(
+                    dataset.samples, person_model, plate_model, imgsz, conf_list[0]
+                )
+                for conf in conf_list:
+                    metrics = SweepRunner.evaluate(dataset.samples, predictions, class_names, conf)
+                    rows.append(SweepReport.build_row(backend, imgsz, threads, conf, latencies, metrics))
+
+    SweepReport.print_table(rows)
+    csv_path = os.path.join(args.output, 'sweep_results.csv')
+    chart_path = os.path.join(args.output, 'pareto.png')
+    SweepReport.write_csv(rows, csv_path)
+    SweepReport.plot_pareto(rows, class_names, chart_path)
+    print(f"\n✅ 結果已輸出: {csv_path}, {chart_path}")
+
+if __name__ == "__main__":
+    try:
+        run_sweep(parse_arguments())
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
@@ -17,12 +17,36 @@ import threading
 import logging
 import queue
 import base64
+import json
+import sqlite3
+import uuid
+import hmac
+import tracemalloc
+import numpy as np
+import torch
+from collections import Counter, OrderedDict, deque
 from datetime import datetime
+from functools import wraps
+from urllib.parse import urlsplit, urlunsplit
+from torchvision.ops import batched_nms
 from ultralytics import YOLO
+from ultralytics.engine.results import Results
 from dotenv import load_dotenv
 from flask import Flask, jsonify, request, Response
 from flask_cors import CORS
 
+try:
+    import redis
+except ImportError:
+    redis = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
 # 設定環境變數檔案路徑
 env_path = os.path.join(os.path.dirname(__file__), '..', '.env')
 load_dotenv(env_path)
@@ -42,6 +66,22 @@ class Config:
         self.DATABASE_URL = os.getenv('DATABASE_URL')
         self.LPR_API_URL = "http://localhost:3001/recognize_plate"
         self.WEB_API_URL = "http://localhost:3002"
+        self.CASCADE_INFERENCE = os.getenv('CASCADE_INFERENCE', 'False').lower() in ['true', '1', 't']
+        self.CLIP_CAPTURE_ENABLED = os.getenv('CLIP_CAPTURE_ENABLED', 'True').lower() in ['true', '1', 't']
+        self.TILED_INFERENCE = os.getenv('TILED_INFERENCE', 'False').lower() in ['true', '1', 't']
+        self.TILE_SIZE = int(os.getenv('TILE_SIZE', 640))
+        self.TILE_OVERLAP = float(os.getenv('TILE_OVERLAP', 0.2))
+        self.TILE_INCLUDE_FULL_FRAME = os.getenv('TILE_INCLUDE_FULL_FRAME', 'True').lower() in ['true', '1', 't']
+        self.PLATE_DEDUP_REDIS_URL = os.getenv('PLATE_DEDUP_REDIS_URL')
+        self.TRAFFIC_FLOW_ENABLED = os.getenv('TRAFFIC_FLOW_ENABLED', 'True').lower() in ['true', '1', 't']
+        self.TRAFFIC_FLOW_FLUSH_SECONDS = float(os.getenv('TRAFFIC_FLOW_FLUSH_SECONDS', 60))
+        self.DETECTION_LOG_ENABLED = os.getenv('DETECTION_LOG_ENABLED', 'False').lower() in ['true', '1', 't']
+        self.SHARED_PREPROCESS = os.getenv('SHARED_PREPROCESS', 'True').lower() in ['true', '1', 't']
+        self.ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
+        self.TRACK_BETWEEN_DETECTIONS = os.getenv('TRACK_BETWEEN_DETECTIONS', 'False').lower() in ['true', '1', 't']
+        self.DETECT_EVERY_N = int(os.getenv('DETECT_EVERY_N', 4))
+        self.TRACK_OPTICAL_FLOW = os.getenv('TRACK_OPTICAL_FLOW', 'False').lower() in ['true', '1', 't']
+        self.CAMERA_NAME = os.getenv('CAMERA_NAME')
     
     def setup_constants(self):
         """設置常數"""
@@ -61,6 +101,89 @@ class Config:
         self.CONFIDENCE_THRESHOLD = 0.65
         self.VISUAL_CONFIDENCE = 0.5
         
+        # 推理輸入尺寸與共用前處理參數 (letterbox 填充色與 stride 與 ultralytics 相同)
+        self.INFERENCE_IMGSZ = 320
+        self.LETTERBOX_STRIDE = 32
+        self.LETTERBOX_PAD_VALUE = 114
+        
+        # 級聯推理參數：以騎士框估計車牌最大尺寸的比例 (騎士框為頭盔/頭部框)
+        self.CASCADE_PLATE_SIZE_RATIO = 0.3
+        self.REGION_NMS_IOU = 0.5
+        # 切片邊緣被截斷的框：面積有此比例落在整張框架推理的同類別框內時視為重複
+        self.TILE_CONTAIN_RATIO = 0.7
+        
+        # 車牌識別快取參數 (只以車牌區域的雜湊比對；車牌框尺寸差異超過比例時視為不同車牌)
+        self.LPR_CACHE_MAX_ENTRIES = 256
+        self.LPR_CACHE_TTL_SECONDS = 30.0
+        self.LPR_CACHE_MAX_HAMMING = 3
+        self.LPR_CACHE_MAX_SIZE_RATIO = 1.3
+        
+        # 本地待送佇列 (Outbox) 參數
+        self.OUTBOX_DRAIN_INTERVAL = 2.0
+        self.OUTBOX_BATCH_SIZE = 20
+        self.OUTBOX_BASE_BACKOFF = 2.0
+        self.OUTBOX_MAX_BACKOFF = 300.0
+        
+        # 事件影片片段參數 (環形緩衝區需涵蓋事件前後的時間，並有記憶體上限)
+        self.CLIP_PRE_SECONDS = 3.0
+        self.CLIP_POST_SECONDS = 3.0
+        self.CLIP_BUFFER_SECONDS = 10.0
+        self.CLIP_BUFFER_MAX_BYTES = 32 * 1024 * 1024
+        self.CLIP_JPEG_QUALITY = 70
+        
+        # 最佳畫面挑選參數 (在事件窗口內依清晰度、車牌大小與信心度挑選截圖)
+        self.BEST_SHOT_WINDOW_SECONDS = 1.0
+        self.BEST_SHOT_MAX_CANDIDATES = 5
+        self.BEST_SHOT_TOP_K = 2
+        self.BEST_SHOT_SHARPNESS_REF = 300.0
+        self.BEST_SHOT_PLATE_AREA_REF = 1500.0
+        self.BEST_SHOT_WEIGHTS = {'sharpness': 0.4, 'size': 0.3, 'confidence': 0.3}
+        self.BEST_SHOT_MATCH_IOU = 0.2
+        
+        # 車牌去重參數 (同一車牌 + 違規類型在時間窗口內只寫入一次，單位秒)
+        self.PLATE_DEDUP_WINDOWS = {'違規乘載人數': 300.0, '未戴安全帽': 300.0}
+        self.PLATE_DEDUP_DEFAULT_WINDOW = 300.0
+        self.PLATE_DEDUP_MAX_ENTRIES = 5000
+        
+        # 車流統計參數 (計數線與車道分隔線皆為畫面比例，追蹤距離為畫面寬度比例)
+        self.TRAFFIC_COUNT_LINE_RATIO = 0.6
+        self.TRAFFIC_LANE_BOUNDARIES = [0.5]
+        self.TRAFFIC_TRACK_MAX_DISTANCE = 0.08
+        
+        # 偵測紀錄 (Parquet) 參數：每批列數、單檔大小與時間上限、待寫入批次上限
+        self.DETECTION_LOG_BATCH_ROWS = 5000
+        self.DETECTION_LOG_MAX_FILE_BYTES = 64 * 1024 * 1024
+        self.DETECTION_LOG_ROTATE_SECONDS = 3600.0
+        self.DETECTION_LOG_QUEUE_BATCHES = 8
+        # 未滿批次的最長停留時間 (車流少的攝影機也會定時落地與輪替)
+        self.DETECTION_LOG_FLUSH_SECONDS = 30.0
+        
+        # 效能剖析參數 (僅在呼叫管理端點時運作)
+        self.PROFILE_MAX_SECONDS = 60.0
+        self.PROFILE_DEFAULT_INTERVAL_MS = 5.0
+        self.TRACEMALLOC_FRAMES = 25
+        
+        # 攝影機心跳參數 (上報至 Web API)
+        self.CAMERA_HEARTBEAT_INTERVAL = 5.0
+        
+        # 辨識失敗待處理參數 (容量上限、保存時間、重試次數、離峰時段 [開始, 結束) 小時、重試放大倍率)
+        self.BACKLOG_MAX_ENTRIES = 500
+        self.BACKLOG_MAX_AGE_HOURS = 72
+        self.BACKLOG_MAX_ATTEMPTS = 3
+        self.BACKLOG_QUIET_HOURS = (1, 5)
+        self.BACKLOG_CHECK_INTERVAL = 300.0
+        self.BACKLOG_UPSCALE = 2.0
+        
+        # 偵測間追蹤參數 (追蹤可信度低於門檻時提前偵測、每幀純預測的可信度衰減、配對 IoU、光流最少特徵點)
+        self.TRACK_MIN_CONFIDENCE = 0.5
+        self.TRACK_CONFIDENCE_DECAY = 0.85
+        self.TRACK_MATCH_IOU = 0.3
+        self.TRACK_FLOW_MIN_POINTS = 4
+        
+        # 模型熱切換參數 (保留的歷史版本數供回滾、切換前驗證的框架數)
+        self.MODEL_HISTORY_SIZE = 3
+        self.MODEL_VALIDATION_FRAMES = 5
+        
         # 性能參數
         self.TARGET_FPS = 15
         self.FRAME_SKIP = 3
@@ -69,11 +192,17 @@ class Config:
         
         # 路徑設定
         self.SCREENSHOT_PATH = "successful_detections"
+        self.OUTBOX_DB_PATH = "violation_outbox.db"
+        self.CLIP_PATH = "violation_clips"
+        self.DETECTION_LOG_PATH = "detection_logs"
+        self.BACKLOG_DB_PATH = "recognition_backlog.db"
+        self.BACKLOG_PATH = "recognition_backlog"
     
     def setup_directories(self):
         """建立必要的目錄"""
-        if not os.path.exists(self.SCREENSHOT_PATH):
-            os.makedirs(self.SCREENSHOT_PATH)
+        for path in [self.SCREENSHOT_PATH, self.CLIP_PATH, self.BACKLOG_PATH]:
+            if not os.path.exists(path):
+                os.makedirs(path)
     
     def print_configuration(self):
         """印出配置資訊"""
@@ -83,11 +212,31 @@ class Config:
         print(f"   資料庫: {'已配置' if self.DATABASE_URL else '未配置'}")
         print(f"   車牌API: {self.LPR_API_URL}")
         print(f"   Web API: {self.WEB_API_URL}")
+        print(f"   級聯推理: {'啟用' if self.CASCADE_INFERENCE else '停用'}")
+        print(f"   事件影片片段: {'啟用' if self.CLIP_CAPTURE_ENABLED else '停用'}")
+        if self.TILED_INFERENCE:
+            print(f"   切片推理: 啟用 (切片 {self.TILE_SIZE}px, 重疊 {self.TILE_OVERLAP:.0%})")
+        else:
+            print("   切片推理: 停用")
+        print(f"   車牌去重索引: {'Redis' if self.PLATE_DEDUP_REDIS_URL else '記憶體'}")
+        if self.TRAFFIC_FLOW_ENABLED:
+            print(f"   車流統計: 啟用 (每 {self.TRAFFIC_FLOW_FLUSH_SECONDS:.0f}s 寫入, {len(self.TRAFFIC_LANE_BOUNDARIES) + 1} 車道)")
+        else:
+            print("   車流統計: 停用")
+        print(f"   偵測紀錄 (Parquet): {'啟用' if self.DETECTION_LOG_ENABLED else '停用'}")
+        print(f"   辨識待處理區: 上限 {self.BACKLOG_MAX_ENTRIES} 筆, 保存 {self.BACKLOG_MAX_AGE_HOURS}h, 離峰 {self.BACKLOG_QUIET_HOURS[0]}-{self.BACKLOG_QUIET_HOURS[1]} 時")
+        if self.TRACK_BETWEEN_DETECTIONS:
+            print(f"   偵測間追蹤: 啟用 (每 {self.DETECT_EVERY_N} 幀偵測, 光流{'啟用' if self.TRACK_OPTICAL_FLOW else '停用'})")
+        else:
+            print("   偵測間追蹤: 停用")
+        print(f"   共用前處理: {'啟用' if self.SHARED_PREPROCESS and not self.TILED_INFERENCE else '停用'}")
+        print(f"   管理端點 (效能剖析): {'啟用' if self.ADMIN_TOKEN else '停用 (未設定 ADMIN_TOKEN)'}")
 
 class SystemState:
     """管理系統狀態和執行緒"""
     def __init__(self):
         self.global_cap = None
+        self.camera_id = None
         self.person_model = None
         self.plate_model = None
         self.stop_detection_flag = True
@@ -97,9 +246,12 @@ class SystemState:
         self.producer_thread = None
         self.logic_thread = None
         self.inference_thread = None
+        self.heartbeat_thread = None
         
         # 共享的最新結果 (受鎖保護)
         self.latest_frame = None
+        self.latest_full_frame = None
+        self.latest_frame_meta = None
         self.latest_results = None
         self.data_lock = threading.Lock()
 
@@ -127,6 +279,7 @@ app = setup_flask_app()
 
 # 向後相容的全域變數 (方便現有代碼使用)
 global_cap = system_state.global_cap
+camera_id = system_state.camera_id
 person_model = system_state.person_model
 plate_model = system_state.plate_model
 stop_detection_flag = system_state.stop_detection_flag
@@ -134,7 +287,10 @@ frame_queue = system_state.frame_queue
 producer_thread = system_state.producer_thread
 logic_thread = system_state.logic_thread
 inference_thread = system_state.inference_thread
+heartbeat_thread = system_state.heartbeat_thread
 latest_frame = system_state.latest_frame
+latest_full_frame = system_state.latest_full_frame
+latest_frame_meta = system_state.latest_frame_meta
 latest_results = system_state.latest_results
 data_lock = system_state.data_lock
 
@@ -159,32 +315,177 @@ LPR_API_URL = config.LPR_API_URL
 WEB_API_URL = config.WEB_API_URL
 PERSON_MODEL_PATH = config.PERSON_MODEL_PATH
 PLATE_MODEL_PATH = config.PLATE_MODEL_PATH
+CASCADE_INFERENCE = config.CASCADE_INFERENCE
+TILED_INFERENCE = config.TILED_INFERENCE
+TILE_SIZE = config.TILE_SIZE
+TILE_OVERLAP = config.TILE_OVERLAP
+TILE_INCLUDE_FULL_FRAME = config.TILE_INCLUDE_FULL_FRAME
+CASCADE_PLATE_SIZE_RATIO = config.CASCADE_PLATE_SIZE_RATIO
+REGION_NMS_IOU = config.REGION_NMS_IOU
+TILE_CONTAIN_RATIO = config.TILE_CONTAIN_RATIO
+LPR_CACHE_MAX_ENTRIES = config.LPR_CACHE_MAX_ENTRIES
+LPR_CACHE_TTL_SECONDS = config.LPR_CACHE_TTL_SECONDS
+LPR_CACHE_MAX_HAMMING = config.LPR_CACHE_MAX_HAMMING
+LPR_CACHE_MAX_SIZE_RATIO = config.LPR_CACHE_MAX_SIZE_RATIO
+OUTBOX_DB_PATH = config.OUTBOX_DB_PATH
+OUTBOX_DRAIN_INTERVAL = config.OUTBOX_DRAIN_INTERVAL
+OUTBOX_BATCH_SIZE = config.OUTBOX_BATCH_SIZE
+OUTBOX_BASE_BACKOFF = config.OUTBOX_BASE_BACKOFF
+OUTBOX_MAX_BACKOFF = config.OUTBOX_MAX_BACKOFF
+CLIP_CAPTURE_ENABLED = config.CLIP_CAPTURE_ENABLED
+CLIP_PRE_SECONDS = config.CLIP_PRE_SECONDS
+CLIP_POST_SECONDS = config.CLIP_POST_SECONDS
+CLIP_BUFFER_SECONDS = config.CLIP_BUFFER_SECONDS
+CLIP_BUFFER_MAX_BYTES = config.CLIP_BUFFER_MAX_BYTES
+CLIP_JPEG_QUALITY = config.CLIP_JPEG_QUALITY
+CLIP_PATH = config.CLIP_PATH
+BEST_SHOT_WINDOW_SECONDS = config.BEST_SHOT_WINDOW_SECONDS
+BEST_SHOT_MAX_CANDIDATES = config.BEST_SHOT_MAX_CANDIDATES
+BEST_SHOT_TOP_K = config.BEST_SHOT_TOP_K
+BEST_SHOT_SHARPNESS_REF = config.BEST_SHOT_SHARPNESS_REF
+BEST_SHOT_PLATE_AREA_REF = config.BEST_SHOT_PLATE_AREA_REF
+BEST_SHOT_WEIGHTS = config.BEST_SHOT_WEIGHTS
+BEST_SHOT_MATCH_IOU = config.BEST_SHOT_MATCH_IOU
+PLATE_DEDUP_REDIS_URL = config.PLATE_DEDUP_REDIS_URL
+PLATE_DEDUP_WINDOWS = config.PLATE_DEDUP_WINDOWS
+PLATE_DEDUP_DEFAULT_WINDOW = config.PLATE_DEDUP_DEFAULT_WINDOW
+PLATE_DEDUP_MAX_ENTRIES = config.PLATE_DEDUP_MAX_ENTRIES
+TRAFFIC_FLOW_ENABLED = config.TRAFFIC_FLOW_ENABLED
+TRAFFIC_FLOW_FLUSH_SECONDS = config.TRAFFIC_FLOW_FLUSH_SECONDS
+TRAFFIC_COUNT_LINE_RATIO = config.TRAFFIC_COUNT_LINE_RATIO
+TRAFFIC_LANE_BOUNDARIES = config.TRAFFIC_LANE_BOUNDARIES
+TRAFFIC_TRACK_MAX_DISTANCE = config.TRAFFIC_TRACK_MAX_DISTANCE
+DETECTION_LOG_ENABLED = config.DETECTION_LOG_ENABLED
+SHARED_PREPROCESS = config.SHARED_PREPROCESS
+INFERENCE_IMGSZ = config.INFERENCE_IMGSZ
+LETTERBOX_STRIDE = config.LETTERBOX_STRIDE
+LETTERBOX_PAD_VALUE = config.LETTERBOX_PAD_VALUE
+DETECTION_LOG_PATH = config.DETECTION_LOG_PATH
+DETECTION_LOG_BATCH_ROWS = config.DETECTION_LOG_BATCH_ROWS
+DETECTION_LOG_MAX_FILE_BYTES = config.DETECTION_LOG_MAX_FILE_BYTES
+DETECTION_LOG_ROTATE_SECONDS = config.DETECTION_LOG_ROTATE_SECONDS
+DETECTION_LOG_QUEUE_BATCHES = config.DETECTION_LOG_QUEUE_BATCHES
+DETECTION_LOG_FLUSH_SECONDS = config.DETECTION_LOG_FLUSH_SECONDS
+ADMIN_TOKEN = config.ADMIN_TOKEN
+PROFILE_MAX_SECONDS = config.PROFILE_MAX_SECONDS
+CAMERA_NAME = config.CAMERA_NAME
+CAMERA_HEARTBEAT_INTERVAL = config.CAMERA_HEARTBEAT_INTERVAL
+MODEL_HISTORY_SIZE = config.MODEL_HISTORY_SIZE
+TRACK_BETWEEN_DETECTIONS = config.TRACK_BETWEEN_DETECTIONS
+DETECT_EVERY_N = config.DETECT_EVERY_N
+TRACK_OPTICAL_FLOW = config.TRACK_OPTICAL_FLOW
+TRACK_MIN_CONFIDENCE = config.TRACK_MIN_CONFIDENCE
+TRACK_CONFIDENCE_DECAY = config.TRACK_CONFIDENCE_DECAY
+TRACK_MATCH_IOU = config.TRACK_MATCH_IOU
+TRACK_FLOW_MIN_POINTS = config.TRACK_FLOW_MIN_POINTS
+BACKLOG_DB_PATH = config.BACKLOG_DB_PATH
+BACKLOG_PATH = config.BACKLOG_PATH
+BACKLOG_MAX_ENTRIES = config.BACKLOG_MAX_ENTRIES
+BACKLOG_MAX_AGE_HOURS = config.BACKLOG_MAX_AGE_HOURS
+BACKLOG_MAX_ATTEMPTS = config.BACKLOG_MAX_ATTEMPTS
+BACKLOG_QUIET_HOURS = config.BACKLOG_QUIET_HOURS
+BACKLOG_CHECK_INTERVAL = config.BACKLOG_CHECK_INTERVAL
+BACKLOG_UPSCALE = config.BACKLOG_UPSCALE
+MODEL_VALIDATION_FRAMES = config.MODEL_VALIDATION_FRAMES
+PROFILE_DEFAULT_INTERVAL_MS = config.PROFILE_DEFAULT_INTERVAL_MS
+TRACEMALLOC_FRAMES = config.TRACEMALLOC_FRAMES
 
 config.print_configuration()
 
+# ==================== 2.1 端到端追蹤模組 ====================
+class TraceContext:
+    """端到端追蹤：以擷取框架時產生的 trace id 串起各處理階段的時間區段"""
+    
+    SERVICE_NAME = 'detect_API'
+    
+    def __init__(self, trace_id=None, captured_at=None, spans=None):
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.captured_at = captured_at or time.time()
+        self.spans = list(spans or [])
+        self.lock = threading.Lock()
+    
+    @staticmethod
+    def from_frame_meta(frame_meta):
+        """由框架中繼資料建立追蹤，補上擷取、排隊、推理與邏輯判斷的區段"""
+        if not frame_meta:
+            return TraceContext()
+        trace = TraceContext(frame_meta['trace_id'], frame_meta['captured_at'])
+        preprocess_done_at = frame_meta['captured_at'] + frame_meta.get('preprocess_ms', 0.0) / 1000
+        trace.add_span('preprocess', frame_meta['captured_at'], preprocess_done_at)
+        trace.add_span('capture_queue', preprocess_done_at, frame_meta['inference_started_at'])
+        trace.add_span('inference', frame_meta['inference_started_at'], frame_meta['inference_done_at'])
+        trace.add_span('detection_logic', frame_meta['inference_done_at'], time.time())
+        return trace
+    
+    @staticmethod
+    def from_payload(payload):
+        """由序列化資料還原追蹤 (本地待送佇列重送時使用)"""
+        if not payload:
+            return None
+        return TraceContext(payload['trace_id'], payload['captured_at'], payload['spans'])
+    
+    def add_span(self, name, start, end, service=None):
+        """記錄一個時間區段 (epoch 秒)"""
+        with self.lock:
+            self.spans.append({
+                'name': name,
+                'service': service or TraceContext.SERVICE_NAME,
+                'start': start,
+                'end': end
+            })
+    
+    def add_remote_spans(self, spans):
+        """合併下游服務回傳的區段"""
+        for span in spans or []:
+            self.add_span(span['name'], span['start'], span['end'], span.get('service'))
+    
+    def fork(self):
+        """複製追蹤，讓同一事件中的每筆違規各自記錄後續區段"""
+        with self.lock:
+            return TraceContext(self.trace_id, self.captured_at, [dict(span) for span in self.spans])
+    
+    def to_payload(self):
+        """序列化追蹤資料"""
+        with self.lock:
+            return {'trace_id': self.trace_id, 'captured_at': self.captured_at, 'spans': list(self.spans)}
+
 # ==================== 3. API 呼叫模組 ====================
 class LPRApiClient:
     """車牌識別 API 客戶端"""
     
     @staticmethod
-    def prepare_image_data(image_data):
+    def prepare_image_data(image_data, jpeg_quality=65):
         """準備圖片數據用於 API 呼叫"""
         try:
-            _, img_encoded = cv2.imencode('.jpg', image_data, [cv2.IMWRITE_JPEG_QUALITY, 65])
+            _, img_encoded = cv2.imencode('.jpg', image_data, [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality])
             return {'file': ('violation.jpg', img_encoded.tobytes(), 'image/jpeg')}
         except Exception:
             logging.error("圖片編碼失敗")
             return None
     
     @staticmethod
-    def make_api_request(files):
+    def prepare_plate_hint(plate_hint):
+        """車牌框提示 (截圖座標) 轉為表單欄位，讓識別服務略過重複的車牌偵測"""
+        if not plate_hint:
+            return None
+        return {
+            'plate_box': ','.join(str(int(v)) for v in plate_hint['box']),
+            'plate_conf': f"{plate_hint['conf']:.4f}"
+        }
+    
+    @staticmethod
+    def make_api_request(files, trace_id=None, data=None):
         """發送 API 請求"""
+        headers = {'Connection': 'close'}
+        if trace_id:
+            headers['X-Trace-Id'] = trace_id
         try:
             response = requests.post(
                 LPR_API_URL, 
                 files=files, 
+                data=data,
                 timeout=5,
-                headers={'Connection': 'close'}
+                headers=headers
             )
             return response
         except requests.exceptions.RequestException as e:
@@ -199,25 +500,152 @@ class LPRApiClient:
             if 'data' in result and result['data'] is not None:
                 return result['data']
         return None
+    
+    @staticmethod
+    def extract_remote_spans(response):
+        """取出車牌識別服務回傳的追蹤區段"""
+        try:
+            return response.json().get('trace', {}).get('spans', [])
+        except ValueError:
+            return []
+
+class PerceptualHash:
+    """感知雜湊 (dHash) 工具"""
+    
+    @staticmethod
+    def compute_dhash(image_data, hash_size=8):
+        """計算圖片的 dHash，回傳 64 位元整數"""
+        gray = image_data if image_data.ndim == 2 else cv2.cvtColor(image_data, cv2.COLOR_BGR2GRAY)
+        resized = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+        diff = resized[:, 1:] > resized[:, :-1]
+        value = 0
+        for bit in diff.flatten():
+            value = (value << 1) | int(bit)
+        return value
+    
+    @staticmethod
+    def hamming_distance(hash_a, hash_b):
+        """計算兩個雜湊值的漢明距離"""
+        return bin(hash_a ^ hash_b).count('1')
 
-def call_lpr_api(image_data):
+class LPRResultCache:
+    """車牌識別結果快取 (每台攝影機一組，以車牌區域感知雜湊 + 車牌框尺寸比對，TTL 作為時間窗口，LRU 淘汰)"""
+    
+    def __init__(self, max_entries, ttl_seconds, max_hamming, max_size_ratio):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_hamming = max_hamming
+        self.max_size_ratio = max_size_ratio
+        self.cameras = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def _entries(self, camera, now):
+        """取得該攝影機的快取並移除超過時間窗口的項目"""
+        entries = self.cameras.setdefault(camera, OrderedDict())
+        expired = [key for key, (stored_at, _, _) in entries.items() if now - stored_at > self.ttl_seconds]
+        for key in expired:
+            del entries[key]
+        return entries
+    
+    def _same_size(self, size_a, size_b):
+        """車牌框寬高差異皆在比例內"""
+        return all(max(a, b) <= min(a, b) * self.max_size_ratio for a, b in zip(size_a, size_b))
+    
+    def get(self, camera, phash, plate_size):
+        """查詢快取，命中時回傳 owner_info 的副本"""
+        now = time.time()
+        with self.lock:
+            entries = self._entries(camera, now)
+            for key in reversed(entries):
+                _, cached_size, owner_info = entries[key]
+                if PerceptualHash.hamming_distance(key, phash) <= self.max_hamming and self._same_size(cached_size, plate_size):
+                    entries.move_to_end(key)
+                    self.hits += 1
+                    return dict(owner_info)
+            self.misses += 1
+            return None
+    
+    def put(self, camera, phash, plate_size, owner_info):
+        """寫入快取，超過容量時淘汰該攝影機最久未使用的項目"""
+        with self.lock:
+            entries = self._entries(camera, time.time())
+            entries[phash] = (time.time(), plate_size, dict(owner_info))
+            entries.move_to_end(phash)
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+                self.evictions += 1
+    
+    def stats(self):
+        """回傳快取統計"""
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                'size': sum(len(entries) for entries in self.cameras.values()),
+                'max_entries_per_camera': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / total, 3) if total else 0.0
+            }
+
+lpr_result_cache = LPRResultCache(
+    LPR_CACHE_MAX_ENTRIES, LPR_CACHE_TTL_SECONDS, LPR_CACHE_MAX_HAMMING, LPR_CACHE_MAX_SIZE_RATIO
+)
+
+def crop_plate_region(image_data, plate_hint):
+    """依車牌框提示裁出車牌區域 (快取只比對車牌本身，避免背景相似的不同車輛互相命中)"""
+    if not plate_hint:
+        return None
+    h, w = image_data.shape[:2]
+    x1, y1, x2, y2 = [int(v) for v in plate_hint['box']]
+    x1, y1, x2, y2 = max(0, x1), max(0, y1), min(w, x2), min(h, y2)
+    if x2 - x1 < 4 or y2 - y1 < 4:
+        return None
+    return image_data[y1:y2, x1:x2]
+
+def call_lpr_api(image_data, trace=None, plate_hint=None):
     """呼叫車牌識別 API (重構版)"""
     api_start_time = time.time()
     
+    # 查詢快取，同一車牌在時間窗口內重複觸發時跳過 API 呼叫 (沒有車牌框時不使用快取)
+    plate_region = crop_plate_region(image_data, plate_hint)
+    phash, plate_size, cached_result = None, None, None
+    if plate_region is not None:
+        phash = PerceptualHash.compute_dhash(plate_region)
+        plate_size = plate_region.shape[1], plate_region.shape[0]
+        cached_result = lpr_result_cache.get(camera_id, phash, plate_size)
+    if cached_result:
+        if trace:
+            trace.add_span('lpr_cache_hit', api_start_time, time.time())
+        logging.info(f"🚗 車牌識別快取命中: {cached_result.get('license_plate_number', 'N/A')}")
+        return cached_result
+    
     # 準備圖片數據
     files = LPRApiClient.prepare_image_data(image_data)
     if not files:
         return None
     
     # 發送請求
-    response = LPRApiClient.make_api_request(files)
+    response = LPRApiClient.make_api_request(
+        files, trace.trace_id if trace else None, LPRApiClient.prepare_plate_hint(plate_hint)
+    )
+    if trace:
+        trace.add_span('lpr_api', api_start_time, time.time())
     if not response:
         return None
     
     # 處理響應
     result = LPRApiClient.process_api_response(response)
+    if trace:
+        trace.add_remote_spans(LPRApiClient.extract_remote_spans(response))
     
     api_duration = time.time() - api_start_time
+    if result and phash is not None:
+        lpr_result_cache.put(camera_id, phash, plate_size, result)
     if result:
         logging.info(f"🚗 車牌識別成功，耗時: {api_duration:.3f}s")
     
@@ -239,10 +667,10 @@ class DatabaseManager:
         return None
     
     @staticmethod
-    def prepare_sql_data(owner_info, image_path, violation_type, fine, confidence):
+    def prepare_sql_data(owner_info, image_path, violation_type, fine, confidence, timestamp=None):
         """準備 SQL 插入數據"""
         image_data = DatabaseManager.encode_image_to_base64(image_path)
-        timestamp_now = datetime.now()
+        timestamp_now = timestamp or datetime.now()
         
         return (
             owner_info.get('license_plate_number', 'N/A'),
@@ -274,6 +702,99 @@ class DatabaseManager:
             logging.error("資料庫寫入錯誤")
             return None, None
     
+    @staticmethod
+    def execute_idempotent_insert(sql, data, natural_key):
+        """冪等插入：若相同 (車牌, 違規類型, 時間) 的紀錄已存在則直接回傳該紀錄"""
+        try:
+            with psycopg2.connect(DATABASE_URL, connect_timeout=3) as conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        """
+                        SELECT id, violation_type, license_plate, timestamp, status
+                        FROM violations
+                        WHERE license_plate = %s AND violation_type = %s AND timestamp = %s
+                        LIMIT 1;
+                        """,
+                        natural_key
+                    )
+                    new_record = cur.fetchone()
+                    if new_record is None:
+                        cur.execute(sql, data)
+                        new_record = cur.fetchone()
+                    conn.commit()
+                    return new_record, time.time()
+        except Exception:
+            logging.error("資料庫寫入錯誤 (重送)")
+            return None, None
+    
+    @staticmethod
+    def record_violation_clip(violation_id, clip_path):
+        """記錄違規事件的影片片段路徑"""
+        try:
+            with psycopg2.connect(DATABASE_URL, connect_timeout=3) as conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        """
+                        CREATE TABLE IF NOT EXISTS violation_clips (
+                            id SERIAL PRIMARY KEY,
+                            violation_id INT NOT NULL UNIQUE,
+                            clip_path TEXT NOT NULL,
+                            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+                        );
+                        """
+                    )
+                    cur.execute(
+                        """
+                        INSERT INTO violation_clips (violation_id, clip_path) VALUES (%s, %s)
+                        ON CONFLICT (violation_id) DO NOTHING;
+                        """,
+                        (violation_id, clip_path)
+                    )
+                    conn.commit()
+            return True
+        except Exception:
+            logging.error("影片片段路徑寫入錯誤")
+            return False
+    
+    @staticmethod
+    def insert_traffic_flow_rows(rows):
+        """批次寫入車流統計 (同一攝影機、時間窗口與車道只保留一筆，重送時不重複)"""
+        try:
+            with psycopg2.connect(DATABASE_URL, connect_timeout=3) as conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        """
+                        CREATE TABLE IF NOT EXISTS traffic_flow_stats (
+                            id SERIAL PRIMARY KEY,
+                            camera_id TEXT NOT NULL,
+                            window_start TIMESTAMP NOT NULL,
+                            window_end TIMESTAMP NOT NULL,
+                            lane INT NOT NULL,
+                            riders INT NOT NULL DEFAULT 0,
+                            helmet INT NOT NULL DEFAULT 0,
+                            no_helmet INT NOT NULL DEFAULT 0,
+                            plates INT NOT NULL DEFAULT 0,
+                            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                            UNIQUE (camera_id, window_start, lane)
+                        );
+                        """
+                    )
+                    cur.executemany(
+                        """
+                        INSERT INTO traffic_flow_stats
+                            (camera_id, window_start, window_end, lane, riders, helmet, no_helmet, plates)
+                        VALUES (%(camera_id)s, %(window_start)s, %(window_end)s, %(lane)s,
+                                %(riders)s, %(helmet)s, %(no_helmet)s, %(plates)s)
+                        ON CONFLICT (camera_id, window_start, lane) DO NOTHING;
+                        """,
+                        rows
+                    )
+                    conn.commit()
+            return True
+        except Exception:
+            logging.error("車流統計寫入錯誤")
+            return False
+    
     @staticmethod
     def format_violation_result(new_record, confidence, latency_ms=None, write_time_iso=None):
         """格式化違規結果"""
@@ -294,8 +815,10 @@ class DatabaseManager:
             return result
         return None
 
-def save_to_database(owner_info, image_path, violation_type, fine, confidence=None):
-    """保存違規資料到資料庫 (重構版)"""
+def save_to_database(owner_info, image_path, violation_type, fine, confidence=None,
+                     timestamp=None, idempotency_key=None, from_outbox=False, clip_path=None, trace=None,
+                     model_versions=None):
+    """保存違規資料到資料庫 (重構版)，寫入失敗時轉存至本地待送佇列"""
     if not DATABASE_URL:
         logging.warning("資料庫未配置，跳過資料儲存")
         return None
@@ -309,64 +832,269 @@ def save_to_database(owner_info, image_path, violation_type, fine, confidence=No
         RETURNING id, violation_type, license_plate, timestamp, status; 
     """
     
+    # 固定事件時間與冪等鍵，重送時才能辨識同一筆違規
+    timestamp = timestamp or datetime.now()
+    idempotency_key = idempotency_key or uuid.uuid4().hex
+    
     # 準備數據
-    data = DatabaseManager.prepare_sql_data(owner_info, image_path, violation_type, fine, confidence)
+    data = DatabaseManager.prepare_sql_data(owner_info, image_path, violation_type, fine, confidence, timestamp)
     
     # 記錄從偵測到寫入的延遲
     detection_start_ts = time.time()
     
-    # 執行查詢
-    new_record, write_completed_at = DatabaseManager.execute_insert_query(sql, data)
+    # 執行查詢 (重送時使用冪等插入)
+    if from_outbox:
+        natural_key = (owner_info.get('license_plate_number', 'N/A'), violation_type, timestamp)
+        new_record, write_completed_at = DatabaseManager.execute_idempotent_insert(sql, data, natural_key)
+    else:
+        new_record, write_completed_at = DatabaseManager.execute_insert_query(sql, data)
+    
+    if write_completed_at is None:
+        if not from_outbox:
+            violation_outbox.enqueue('violation', {
+                'owner_info': owner_info,
+                'image_path': image_path,
+                'violation_type': violation_type,
+                'fine': fine,
+                'confidence': confidence,
+                'timestamp': timestamp.isoformat(),
+                'clip_path': clip_path,
+                'trace': trace.to_payload() if trace else None,
+                'model_versions': model_versions
+            }, idempotency_key, evidence_path=image_path)
+        return None
     
-    # 計算並格式化結果
-    latency_ms = None
-    write_time_iso = None
-    if write_completed_at is not None:
-        latency_ms = (write_completed_at - detection_start_ts) * 1000.0
-        write_time_iso = datetime.fromtimestamp(write_completed_at).isoformat() + 'Z'
-        logging.info(f"⏱️ 偵測至資料庫寫入耗時: {latency_ms:.1f} ms")
-    return DatabaseManager.format_violation_result(new_record, confidence, latency_ms, write_time_iso)
+    # 計算並格式化結果 (有追蹤資料時，延遲從框架擷取開始計算)
+    if trace:
+        trace.add_span('db_insert', detection_start_ts, write_completed_at)
+        detection_start_ts = trace.captured_at
+    latency_ms = (write_completed_at - detection_start_ts) * 1000.0
+    write_time_iso = datetime.fromtimestamp(write_completed_at).isoformat() + 'Z'
+    logging.info(f"⏱️ 偵測至資料庫寫入耗時: {latency_ms:.1f} ms")
+    result = DatabaseManager.format_violation_result(new_record, confidence, latency_ms, write_time_iso)
+    if result:
+        result['idempotencyKey'] = idempotency_key
+        if trace:
+            result['traceId'] = trace.trace_id
+            result['captureTime'] = datetime.fromtimestamp(trace.captured_at).isoformat() + 'Z'
+        if clip_path:
+            DatabaseManager.record_violation_clip(result['id'], clip_path)
+            result['clipPath'] = clip_path
+        if model_versions:
+            result['modelVersions'] = model_versions
+    return result
 
 # ==================== 5. 通知服務模組 ====================
 class NotificationService:
     """通知服務"""
     
     @staticmethod
-    def send_violation_notification(violation_data):
-        """發送違規通知"""
+    def post_violation_broadcast(violation_data):
+        """請求伺服器廣播新違規，成功時回傳 True"""
         notify_url = f'{WEB_API_URL}/api/notify/new-violation'
         try:
             response = requests.post(notify_url, json=violation_data, timeout=3)
             if response.status_code == 200:
                 logging.info(f"✅ 成功通知伺服器廣播新違規: {violation_data['plateNumber']}")
-            else:
-                logging.error(f"❌ 通知伺服器失敗，狀態碼: {response.status_code}")
+                return True
+            logging.error(f"❌ 通知伺服器失敗，狀態碼: {response.status_code}")
         except requests.exceptions.RequestException as e:
             logging.error(f"❌ 呼叫廣播 API 時發生網路錯誤: {e}")
-
-        # 同時上報處理延遲指標（若有）
+        return False
+    
+    @staticmethod
+    def post_latency_metrics(violation_data):
+        """上報處理延遲指標（若有），成功或無需上報時回傳 True"""
+        if 'processingLatencyMs' not in violation_data:
+            return True
         try:
-            if 'processingLatencyMs' in violation_data:
-                metrics_url = f"{WEB_API_URL}/api/metrics/processing-latency"
-                payload = {
-                    'violation_id': violation_data.get('id'),
-                    'plate': violation_data.get('plateNumber'),
-                    'latency_ms': violation_data.get('processingLatencyMs'),
-                    'db_write_time': violation_data.get('dbWriteTime'),
-                    'detect_time': violation_data.get('timestamp')
-                }
-                mresp = requests.post(metrics_url, json=payload, timeout=3)
-                if mresp.status_code == 200:
-                    logging.info(f"此違規項目總花費處理時間{payload['latency_ms']} ms")
-                else:
-                    logging.error(f"❌ 延遲上報失敗，狀態碼: {mresp.status_code}")
+            metrics_url = f"{WEB_API_URL}/api/metrics/processing-latency"
+            trace_payload = violation_data.get('trace') or {}
+            payload = {
+                'violation_id': violation_data.get('id'),
+                'plate': violation_data.get('plateNumber'),
+                'latency_ms': violation_data.get('processingLatencyMs'),
+                'db_write_time': violation_data.get('dbWriteTime'),
+                'detect_time': violation_data.get('captureTime') or violation_data.get('timestamp'),
+                'idempotency_key': violation_data.get('idempotencyKey'),
+                'trace_id': trace_payload.get('trace_id'),
+                'spans': trace_payload.get('spans', [])
+            }
+            mresp = requests.post(metrics_url, json=payload, timeout=3)
+            if mresp.status_code == 200:
+                logging.info(f"此違規項目總花費處理時間{payload['latency_ms']} ms")
+                return True
+            logging.error(f"❌ 延遲上報失敗，狀態碼: {mresp.status_code}")
         except requests.exceptions.RequestException as e:
             logging.error(f"❌ 呼叫延遲上報 API 時發生網路錯誤: {e}")
+        return False
+    
+    @staticmethod
+    def send_violation_notification(violation_data, trace=None):
+        """發送違規通知，失敗的步驟轉存至本地待送佇列"""
+        idempotency_key = violation_data.get('idempotencyKey') or uuid.uuid4().hex
+        violation_data['idempotencyKey'] = idempotency_key
+        
+        notify_start = time.time()
+        if not NotificationService.post_violation_broadcast(violation_data):
+            violation_outbox.enqueue('notify', violation_data, idempotency_key)
+        
+        # 同時上報處理延遲指標與追蹤區段（若有）
+        metrics_data = violation_data
+        if trace:
+            trace.add_span('notify_request', notify_start, time.time())
+            metrics_data = dict(violation_data, trace=trace.to_payload())
+        if not NotificationService.post_latency_metrics(metrics_data):
+            violation_outbox.enqueue('metrics', metrics_data, idempotency_key)
 
 def notify_violation(violation_data):
     """通知違規 (向後相容函數)"""
     NotificationService.send_violation_notification(violation_data)
 
+# ==================== 5.1 本地待送佇列模組 ====================
+class ViolationOutbox:
+    """本地持久化待送佇列 (SQLite)，在資料庫或 Web API 無法連線時保存事件"""
+    
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self.lock:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    idempotency_key TEXT NOT NULL UNIQUE,
+                    kind TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    evidence_path TEXT,
+                    created_at REAL NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL,
+                    last_error TEXT
+                )
+            """)
+            self.conn.commit()
+    
+    def enqueue(self, kind, payload, idempotency_key, evidence_path=None):
+        """寫入一筆待送事件 (相同冪等鍵只保留一筆)"""
+        now = time.time()
+        try:
+            with self.lock:
+                self.conn.execute(
+                    """
+                    INSERT OR IGNORE INTO outbox
+                        (idempotency_key, kind, payload, evidence_path, created_at, next_attempt_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    """,
+                    (f"{kind}:{idempotency_key}", kind, json.dumps(payload, ensure_ascii=False, default=str),
+                     evidence_path, now, now + OUTBOX_BASE_BACKOFF)
+                )
+                self.conn.commit()
+            logging.warning(f"📥 事件已存入本地待送佇列 ({kind})，稍後重送")
+        except sqlite3.Error as e:
+            logging.error(f"❌ 寫入本地待送佇列失敗: {e}")
+    
+    def fetch_due(self, limit):
+        """取出已到重送時間的事件"""
+        with self.lock:
+            rows = self.conn.execute(
+                """
+                SELECT id, idempotency_key, kind, payload, attempts
+                FROM outbox WHERE next_attempt_at <= ?
+                ORDER BY id LIMIT ?
+                """,
+                (time.time(), limit)
+            ).fetchall()
+        return [
+            {'id': row[0], 'idempotency_key': row[1], 'kind': row[2],
+             'payload': json.loads(row[3]), 'attempts': row[4]}
+            for row in rows
+        ]
+    
+    def mark_done(self, entry_id):
+        """重送成功，移除事件"""
+        with self.lock:
+            self.conn.execute("DELETE FROM outbox WHERE id = ?", (entry_id,))
+            self.conn.commit()
+    
+    def mark_failed(self, entry_id, attempts, error=None):
+        """重送失敗，以指數退避安排下一次重送"""
+        delay = min(OUTBOX_BASE_BACKOFF * (2 ** attempts), OUTBOX_MAX_BACKOFF)
+        with self.lock:
+            self.conn.execute(
+                "UPDATE outbox SET attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                (attempts + 1, time.time() + delay, error, entry_id)
+            )
+            self.conn.commit()
+    
+    def stats(self):
+        """回傳佇列積壓數量與最舊事件的等待時間"""
+        with self.lock:
+            total, oldest = self.conn.execute("SELECT COUNT(*), MIN(created_at) FROM outbox").fetchone()
+            by_kind = dict(self.conn.execute("SELECT kind, COUNT(*) FROM outbox GROUP BY kind").fetchall())
+        return {
+            'backlog_size': total,
+            'oldest_age_seconds': round(time.time() - oldest, 1) if oldest else 0.0,
+            'by_kind': by_kind
+        }
+
+class OutboxDrainer:
+    """本地待送佇列重送器"""
+    
+    @staticmethod
+    def replay_violation(payload):
+        """重送資料庫寫入，成功後繼續發送通知"""
+        trace = TraceContext.from_payload(payload.get('trace'))
+        new_violation_data = save_to_database(
+            payload['owner_info'], payload['image_path'],
+            payload['violation_type'], payload['fine'], payload['confidence'],
+            timestamp=datetime.fromisoformat(payload['timestamp']),
+            idempotency_key=payload['idempotency_key'],
+            from_outbox=True,
+            clip_path=payload.get('clip_path'),
+            trace=trace,
+            model_versions=payload.get('model_versions')
+        )
+        if not new_violation_data:
+            return False
+        NotificationService.send_violation_notification(new_violation_data, trace)
+        return True
+    
+    @staticmethod
+    def replay_entry(entry):
+        """依事件類型重送"""
+        payload = entry['payload']
+        if entry['kind'] == 'violation':
+            payload['idempotency_key'] = entry['idempotency_key'].split(':', 1)[1]
+            return OutboxDrainer.replay_violation(payload)
+        if entry['kind'] == 'notify':
+            return NotificationService.post_violation_broadcast(payload)
+        if entry['kind'] == 'metrics':
+            return NotificationService.post_latency_metrics(payload)
+        if entry['kind'] == 'traffic_flow':
+            return DatabaseManager.insert_traffic_flow_rows(payload['rows'])
+        logging.error(f"❌ 未知的待送事件類型: {entry['kind']}")
+        return True
+
+def drain_outbox():
+    """本地待送佇列重送執行緒"""
+    logging.info("📤 待送佇列重送執行緒已啟動")
+    while True:
+        time.sleep(OUTBOX_DRAIN_INTERVAL)
+        for entry in violation_outbox.fetch_due(OUTBOX_BATCH_SIZE):
+            try:
+                if OutboxDrainer.replay_entry(entry):
+                    violation_outbox.mark_done(entry['id'])
+                    logging.info(f"📤 待送事件重送成功 ({entry['kind']})")
+                else:
+                    violation_outbox.mark_failed(entry['id'], entry['attempts'])
+            except Exception as e:
+                violation_outbox.mark_failed(entry['id'], entry['attempts'], str(e))
+                logging.error(f"❌ 待送事件重送錯誤: {e}")
+
+violation_outbox = ViolationOutbox(OUTBOX_DB_PATH)
+
 # ==================== 6. 違規處理模組 ====================
 class ViolationProcessor:
     """違規處理器"""
@@ -390,39 +1118,595 @@ class ViolationProcessor:
             return False
     
     @staticmethod
-    def process_single_violation(owner_info, filename, violation):
+    def process_single_violation(owner_info, filename, violation, clip_path=None, trace=None, timestamp=None):
         """處理單一違規"""
         new_violation_data = save_to_database(
             owner_info, filename, 
             violation['type'], 
             violation['fine'],
-            violation.get('confidence', 0.0)
+            violation.get('confidence', 0.0),
+            timestamp=timestamp,
+            clip_path=clip_path,
+            trace=trace,
+            model_versions=violation.get('model_versions')
         )
         if new_violation_data:
-            NotificationService.send_violation_notification(new_violation_data)
+            NotificationService.send_violation_notification(new_violation_data, trace)
+
+class PlateDedupIndex:
+    """車牌去重索引：以 (車牌, 違規類型) 為鍵的時間窗口索引，可選用 Redis 供多個偵測程序共用"""
+    
+    KEY_PREFIX = 'plate_dedup'
+    
+    def __init__(self, windows, default_window, max_entries, redis_url=None):
+        self.windows = windows
+        self.default_window = default_window
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.passed = {}
+        self.suppressed = {}
+        self.redis_client = None
+        if redis_url:
+            if redis is None:
+                logging.warning("⚠️ 未安裝 redis 套件，車牌去重索引改用記憶體模式")
+            else:
+                self.redis_client = redis.Redis.from_url(redis_url, socket_timeout=0.5)
+    
+    def window_for(self, violation_type):
+        """取得違規類型的去重時間窗口"""
+        return self.windows.get(violation_type, self.default_window)
+    
+    def _claim_local(self, key, window, now):
+        """記憶體模式：窗口內已存在則視為重複"""
+        with self.lock:
+            stored_at = self.entries.get(key)
+            if stored_at is not None and now - stored_at < window:
+                return False
+            self.entries[key] = now
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            return True
+    
+    def _claim_redis(self, key, window):
+        """Redis 模式：以 SET NX EX 原子性地佔用鍵"""
+        redis_key = f"{PlateDedupIndex.KEY_PREFIX}:{key[0]}:{key[1]}"
+        return bool(self.redis_client.set(redis_key, camera_id or '', nx=True, ex=max(1, int(window))))
+    
+    def claim(self, plate, violation_type):
+        """嘗試佔用 (車牌, 違規類型)，首次出現回傳 True，窗口內重複回傳 False"""
+        key = (plate, violation_type)
+        window = self.window_for(violation_type)
+        claimed = None
+        if self.redis_client is not None:
+            try:
+                claimed = self._claim_redis(key, window)
+            except Exception as e:
+                logging.warning(f"⚠️ Redis 去重查詢失敗，改用記憶體索引: {e}")
+        if claimed is None:
+            claimed = self._claim_local(key, window, time.time())
+        
+        with self.lock:
+            counters = self.passed if claimed else self.suppressed
+            counters[violation_type] = counters.get(violation_type, 0) + 1
+        return claimed
+    
+    def stats(self):
+        """回傳去重統計"""
+        with self.lock:
+            return {
+                'backend': 'redis' if self.redis_client is not None else 'memory',
+                'local_size': len(self.entries),
+                'windows': {vtype: self.window_for(vtype) for vtype in set(self.windows) | set(self.passed) | set(self.suppressed)},
+                'passed': dict(self.passed),
+                'suppressed': dict(self.suppressed),
+                'suppressed_total': sum(self.suppressed.values())
+            }
+
+plate_dedup_index = PlateDedupIndex(
+    PLATE_DEDUP_WINDOWS, PLATE_DEDUP_DEFAULT_WINDOW, PLATE_DEDUP_MAX_ENTRIES, PLATE_DEDUP_REDIS_URL
+)
 
-def process_multiple_violations(crop_img, violations_list):
+def process_multiple_violations(crop_img, violations_list, clip_job=None, fallback_crops=None, trace=None,
+                                plate_hints=None):
     """處理多個違規事件 (重構版)"""
     if not violations_list:
         return
     
-    logging.info("🚗 偵測到事件，開始進行車牌辨識...")
-    
-    # 1. 呼叫車牌識別 API
-    owner_info = call_lpr_api(crop_img)
+    trace = trace or TraceContext()
+    logging.info(f"🚗 偵測到事件，開始進行車牌辨識... (trace: {trace.trace_id})")
+    
+    # 1. 呼叫車牌識別 API (最佳畫面失敗時依序嘗試備選截圖)
+    owner_info = None
+    candidate_imgs = [crop_img] + list(fallback_crops or [])
+    candidate_hints = list(plate_hints or []) + [None] * len(candidate_imgs)
+    for candidate_img, plate_hint in zip(candidate_imgs, candidate_hints):
+        owner_info = call_lpr_api(candidate_img, trace, plate_hint)
+        if owner_info:
+            crop_img = candidate_img
+            break
     if not owner_info:
-        logging.info("❌ 車牌識別失敗，無法處理此事件中的任何違規。")
+        logging.info("❌ 車牌識別失敗，事件已存入待處理區，將於離峰時段重新辨識。")
+        recognition_backlog.add(candidate_imgs, violations_list, clip_job.finalize() if clip_job else None, trace)
         return
     
-    # 2. 生成並保存圖片
+    record_recognized_event(owner_info, crop_img, violations_list, clip_job, trace)
+
+def record_recognized_event(owner_info, crop_img, violations_list, clip_job=None, trace=None, timestamp=None):
+    """車牌辨識成功後：去重、保存證據圖片並寫入每筆違規 (待處理區重新辨識成功時亦走此流程)"""
+    trace = trace or TraceContext()
+    
+    # 2. 車牌去重：時間窗口內已寫入過的 (車牌, 違規類型) 不再重複寫入與通知
+    plate = owner_info.get('license_plate_number', 'UNKNOWN')
+    violations_list = [v for v in violations_list if plate_dedup_index.claim(plate, v['type'])]
+    if not violations_list:
+        logging.info(f"🔁 車牌 {plate} 的違規已在去重窗口內記錄過，略過此事件")
+        return
+    
+    # 3. 生成並保存圖片
+    save_start = time.time()
     filename = ViolationProcessor.generate_filename(owner_info)
     if not ViolationProcessor.save_violation_image(crop_img, filename):
         return
+    trace.add_span('evidence_write', save_start, time.time())
     
-    # 3. 處理所有違規
+    # 事件確定寫入後才編碼影片片段，編碼失敗時不記錄路徑
+    clip_path = clip_job.finalize() if clip_job else None
+    
+    # 4. 處理所有違規 (每筆違規各自延續追蹤)
     logging.info(f"💾 準備將 {len(violations_list)} 項違規寫入資料庫...")
     for violation in violations_list:
-        ViolationProcessor.process_single_violation(owner_info, filename, violation)
+        ViolationProcessor.process_single_violation(owner_info, filename, violation, clip_path, trace.fork(), timestamp)
+
+class BestShotSelector:
+    """最佳畫面挑選器：每個違規對象 (以車牌框或騎士框識別) 各自一個事件窗口，只送出品質最好的截圖"""
+    
+    def __init__(self):
+        self.events = []
+        self.lock = threading.Lock()
+    
+    @staticmethod
+    def score_candidate(crop_img, plate_conf, plate_area, plate_hint=None):
+        """依車牌區域清晰度 (Laplacian 變異數)、車牌大小與車牌信心度評分 (無車牌框時以整張截圖計算清晰度)"""
+        plate_region = crop_plate_region(crop_img, plate_hint)
+        gray = cv2.cvtColor(plate_region if plate_region is not None else crop_img, cv2.COLOR_BGR2GRAY)
+        sharpness = cv2.Laplacian(gray, cv2.CV_64F).var()
+        return (
+            BEST_SHOT_WEIGHTS['sharpness'] * min(sharpness / BEST_SHOT_SHARPNESS_REF, 1.0) +
+            BEST_SHOT_WEIGHTS['size'] * min(plate_area / BEST_SHOT_PLATE_AREA_REF, 1.0) +
+            BEST_SHOT_WEIGHTS['confidence'] * plate_conf
+        )
+    
+    @staticmethod
+    def box_iou(box_a, box_b):
+        x1, y1 = max(box_a[0], box_b[0]), max(box_a[1], box_b[1])
+        x2, y2 = min(box_a[2], box_b[2]), min(box_a[3], box_b[3])
+        inter = max(0.0, x2 - x1) * max(0.0, y2 - y1)
+        union = (box_a[2] - box_a[0]) * (box_a[3] - box_a[1]) + (box_b[2] - box_b[0]) * (box_b[3] - box_b[1]) - inter
+        return inter / union if union > 0 else 0.0
+    
+    def is_collecting(self):
+        """是否有正在收集候選截圖的事件"""
+        with self.lock:
+            return bool(self.events)
+    
+    def find_event(self, anchor):
+        """找出同一對象的事件窗口：錨點種類相同且與最近一次錨點框重疊 (需持有鎖)"""
+        kind, box = anchor
+        matches = [
+            (BestShotSelector.box_iou(event['anchor'][1], box), event)
+            for event in self.events if event['anchor'][0] == kind
+        ]
+        best_iou, best = max(matches, key=lambda item: item[0], default=(0.0, None))
+        return best if best_iou >= BEST_SHOT_MATCH_IOU else None
+    
+    def add_candidate(self, crop_img, violations, anchor, plate_conf=0.0, plate_area=0, frame_meta=None,
+                      plate_hint=None):
+        """加入候選截圖 (anchor 為 ('plate' | 'rider', 推理框架座標框))，必要時為此對象開啟新的事件窗口"""
+        score = BestShotSelector.score_candidate(crop_img, plate_conf, plate_area, plate_hint)
+        now = time.time()
+        with self.lock:
+            event = self.find_event(anchor)
+            if event is None:
+                event = {
+                    'opened_at': now,
+                    'deadline': now + BEST_SHOT_WINDOW_SECONDS,
+                    'clip_job': clip_recorder.request_clip(camera_id, now),
+                    'trace': TraceContext.from_frame_meta(frame_meta),
+                    'candidates': [],
+                    'violations': {}
+                }
+                self.events.append(event)
+            event['anchor'] = anchor
+            candidates = event['candidates']
+            candidates.append((score, crop_img, plate_hint))
+            candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+            del candidates[BEST_SHOT_MAX_CANDIDATES:]
+            
+            # 合併同一對象窗口內的違規，同類型保留最高信心度
+            merged = event['violations']
+            for violation in violations:
+                existing = merged.get(violation['type'])
+                if existing is None or violation.get('confidence', 0.0) > existing.get('confidence', 0.0):
+                    merged[violation['type']] = violation
+    
+    def pop_ready_events(self, force=False):
+        """取出窗口已結束的事件 (依分數排序的截圖、違規清單與追蹤)"""
+        now = time.time()
+        with self.lock:
+            ready = [event for event in self.events if force or now >= event['deadline']]
+            self.events = [event for event in self.events if event not in ready]
+        results = []
+        for event in ready:
+            crops = [crop_img for _, crop_img, _ in event['candidates']]
+            plate_hints = [plate_hint for _, _, plate_hint in event['candidates']]
+            logging.info(f"🎯 最佳畫面挑選完成，候選 {len(crops)} 張，最高分 {event['candidates'][0][0]:.2f}")
+            event['trace'].add_span('best_shot_window', event['opened_at'], time.time())
+            results.append({
+                'crops': crops[:BEST_SHOT_TOP_K],
+                'plate_hints': plate_hints[:BEST_SHOT_TOP_K],
+                'violations': list(event['violations'].values()),
+                'clip_job': event['clip_job'],
+                'trace': event['trace']
+            })
+        return results
+
+best_shot_selector = BestShotSelector()
+
+def dispatch_violation_event(crop_img, violations, anchor, plate_conf=0.0, plate_area=0, frame_meta=None,
+                             plate_hint=None):
+    """送出違規事件：啟用最佳畫面挑選時先加入該對象的候選窗口，否則立即處理"""
+    if frame_meta:
+        # 標記產生此偵測的模型版本
+        violations = [dict(violation, model_versions=frame_meta.get('model_versions')) for violation in violations]
+    if BEST_SHOT_WINDOW_SECONDS > 0:
+        best_shot_selector.add_candidate(crop_img, violations, anchor, plate_conf, plate_area, frame_meta, plate_hint)
+        return
+    clip_job = clip_recorder.request_clip(camera_id, time.time())
+    threading.Thread(
+        target=process_multiple_violations, 
+        args=(crop_img, violations, clip_job, None, TraceContext.from_frame_meta(frame_meta), [plate_hint]), 
+        daemon=True
+    ).start()
+
+def flush_best_shot_event(force=False):
+    """窗口結束後，以各事件的最佳截圖 (與備選截圖) 處理事件"""
+    for event in best_shot_selector.pop_ready_events(force):
+        threading.Thread(
+            target=process_multiple_violations, 
+            args=(event['crops'][0], event['violations'], event['clip_job'], event['crops'][1:], event['trace'],
+                  event['plate_hints']), 
+            daemon=True
+        ).start()
+
+# ==================== 6.1 事件影片片段模組 ====================
+class FrameRingBuffer:
+    """單一攝影機的壓縮框架環形緩衝區 (同時限制時間長度與記憶體用量)"""
+    
+    def __init__(self, max_seconds, max_bytes):
+        self.max_seconds = max_seconds
+        self.max_bytes = max_bytes
+        self.frames = deque()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+    
+    def push(self, timestamp, frame):
+        """壓縮並加入框架，超出時間或記憶體上限時丟棄最舊的框架"""
+        ok, encoded = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, CLIP_JPEG_QUALITY])
+        if not ok:
+            return
+        data = encoded.tobytes()
+        with self.lock:
+            self.frames.append((timestamp, data))
+            self.total_bytes += len(data)
+            while self.frames and (timestamp - self.frames[0][0] > self.max_seconds
+                                   or self.total_bytes > self.max_bytes):
+                _, dropped = self.frames.popleft()
+                self.total_bytes -= len(dropped)
+    
+    def snapshot(self, start_time, end_time):
+        """取出時間範圍內的壓縮框架"""
+        with self.lock:
+            return [(t, data) for t, data in self.frames if start_time <= t <= end_time]
+
+class ClipJob:
+    """單一事件的影片片段：登記時即取出事件前段框架，計時器於事件後段結束時補齊，確認要使用時才編碼"""
+    
+    def __init__(self, buffer, event_time, clip_path):
+        self.buffer = buffer
+        self.event_time = event_time
+        self.clip_path = clip_path
+        # 先取出事件前段，避免等待期間被環形緩衝區淘汰
+        self.frames = buffer.snapshot(event_time - CLIP_PRE_SECONDS, event_time)
+        self.post_roll_ready = threading.Event()
+        self.lock = threading.Lock()
+        self.finalized = False
+        self.result = None
+        timer = threading.Timer(max(0.0, event_time + CLIP_POST_SECONDS - time.time()), self.collect_post_roll)
+        timer.daemon = True
+        timer.start()
+    
+    @staticmethod
+    def completed(clip_path):
+        """以已存在的影片檔建立片段 (待處理區重新辨識時使用)"""
+        job = ClipJob.__new__(ClipJob)
+        job.lock = threading.Lock()
+        job.finalized = True
+        job.result = clip_path if clip_path and os.path.exists(clip_path) else None
+        return job
+    
+    def collect_post_roll(self):
+        """事件後段錄製完成，補齊框架"""
+        post_frames = [frame for frame in self.buffer.snapshot(self.event_time, self.event_time + CLIP_POST_SECONDS)
+                       if frame[0] > self.event_time]
+        self.frames = self.frames + post_frames
+        self.post_roll_ready.set()
+    
+    def finalize(self):
+        """等待事件後段並編碼影片，成功時回傳影片路徑，失敗回傳 None (重複呼叫只編碼一次)"""
+        with self.lock:
+            if self.finalized:
+                return self.result
+            self.finalized = True
+            self.post_roll_ready.wait(CLIP_POST_SECONDS + 5.0)
+            try:
+                if ClipRecorder.write_clip(self.frames, self.clip_path):
+                    self.result = self.clip_path
+            except Exception as e:
+                logging.error(f"❌ 事件影片片段輸出失敗: {e}")
+                if os.path.exists(self.clip_path):
+                    os.remove(self.clip_path)
+            self.frames = []
+            return self.result
+
+class ClipRecorder:
+    """事件影片片段錄製器：每個事件一個片段工作，只有確認寫入的事件才會編碼"""
+    
+    def __init__(self):
+        self.buffers = {}
+        self.buffers_lock = threading.Lock()
+    
+    def get_buffer(self, camera):
+        """取得 (或建立) 攝影機的環形緩衝區"""
+        with self.buffers_lock:
+            if camera not in self.buffers:
+                self.buffers[camera] = FrameRingBuffer(CLIP_BUFFER_SECONDS, CLIP_BUFFER_MAX_BYTES)
+            return self.buffers[camera]
+    
+    def push_frame(self, camera, frame, timestamp=None):
+        """將框架加入攝影機的環形緩衝區"""
+        self.get_buffer(camera).push(timestamp or time.time(), frame)
+    
+    def request_clip(self, camera, event_time):
+        """登記一個事件影片片段，回傳片段工作 (呼叫 finalize 後才編碼並取得路徑)"""
+        if not CLIP_CAPTURE_ENABLED:
+            return None
+        ts_str = datetime.fromtimestamp(event_time).strftime("%Y%m%d_%H%M%S_%f")
+        clip_path = os.path.join(CLIP_PATH, f"clip_{ts_str}_{uuid.uuid4().hex[:6]}.mp4")
+        return ClipJob(self.get_buffer(camera), event_time, clip_path)
+    
+    @staticmethod
+    def write_clip(frames, clip_path):
+        """將壓縮框架解碼並編碼為影片檔"""
+        if len(frames) < 2:
+            logging.warning(f"⚠️ 緩衝區框架不足，略過影片片段: {clip_path}")
+            return False
+        
+        duration = frames[-1][0] - frames[0][0]
+        fps = max(1.0, (len(frames) - 1) / duration) if duration > 0 else float(TARGET_FPS)
+        first = cv2.imdecode(np.frombuffer(frames[0][1], np.uint8), cv2.IMREAD_COLOR)
+        height, width = first.shape[:2]
+        
+        writer = cv2.VideoWriter(clip_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+        try:
+            for _, data in frames:
+                image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+                if image.shape[:2] != (height, width):
+                    image = cv2.resize(image, (width, height))
+                writer.write(image)
+        finally:
+            writer.release()
+        logging.info(f"🎬 事件影片片段已保存至: {clip_path} ({len(frames)} 幀)")
+        return True
+
+clip_recorder = ClipRecorder()
+
+# ==================== 6.2 辨識失敗待處理模組 ====================
+class RecognitionBacklog:
+    """車牌辨識失敗的事件 (證據截圖 + 違規 + 時間) 保存於本地，有容量上限與保存期限"""
+    
+    def __init__(self, db_path, image_dir):
+        self.image_dir = image_dir
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.recovered = 0
+        self.expired = 0
+        with self.lock:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS backlog (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    event_time REAL NOT NULL,
+                    violations TEXT NOT NULL,
+                    crop_paths TEXT NOT NULL,
+                    clip_path TEXT,
+                    trace TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    last_attempt_at REAL
+                )
+            """)
+            self.conn.commit()
+    
+    def add(self, crops, violations, clip_path=None, trace=None):
+        """保存事件 (截圖以高品質 JPEG 存檔)，超過上限時淘汰最舊的事件"""
+        event_time = trace.captured_at if trace else time.time()
+        prefix = os.path.join(self.image_dir, f"backlog_{time.strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}")
+        crop_paths = []
+        for index, crop in enumerate(crops):
+            path = f"{prefix}_{index}.jpg"
+            if cv2.imwrite(path, crop, [cv2.IMWRITE_JPEG_QUALITY, 95]):
+                crop_paths.append(path)
+        if not crop_paths:
+            return
+        try:
+            with self.lock:
+                self.conn.execute(
+                    "INSERT INTO backlog (event_time, violations, crop_paths, clip_path, trace) VALUES (?, ?, ?, ?, ?)",
+                    (event_time, json.dumps(violations, ensure_ascii=False, default=str), json.dumps(crop_paths),
+                     clip_path, json.dumps(trace.to_payload()) if trace else None)
+                )
+                self.conn.commit()
+            self.prune()
+        except sqlite3.Error as e:
+            logging.error(f"❌ 寫入辨識待處理區失敗: {e}")
+    
+    def _delete(self, rows):
+        """刪除事件與其截圖檔；clip_path 不為 None 時一併刪除影片片段 (需持有鎖)"""
+        for entry_id, crop_paths, clip_path in rows:
+            for path in json.loads(crop_paths) + ([clip_path] if clip_path else []):
+                if os.path.exists(path):
+                    os.remove(path)
+            self.conn.execute("DELETE FROM backlog WHERE id = ?", (entry_id,))
+        self.conn.commit()
+    
+    def prune(self):
+        """移除過期、重試次數用盡與超過容量的事件"""
+        cutoff = time.time() - BACKLOG_MAX_AGE_HOURS * 3600
+        with self.lock:
+            stale = self.conn.execute(
+                "SELECT id, crop_paths, clip_path FROM backlog WHERE event_time < ? OR attempts >= ?",
+                (cutoff, BACKLOG_MAX_ATTEMPTS)
+            ).fetchall()
+            overflow = self.conn.execute(
+                "SELECT id, crop_paths, clip_path FROM backlog WHERE event_time >= ? AND attempts < ? "
+                "ORDER BY event_time DESC LIMIT -1 OFFSET ?",
+                (cutoff, BACKLOG_MAX_ATTEMPTS, BACKLOG_MAX_ENTRIES)
+            ).fetchall()
+            self._delete(stale + overflow)
+            self.expired += len(stale) + len(overflow)
+    
+    def fetch_all(self):
+        """取出所有待重新辨識的事件 (舊的優先)"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT id, event_time, violations, crop_paths, clip_path, trace, attempts FROM backlog ORDER BY event_time"
+            ).fetchall()
+        return [
+            {'id': row[0], 'event_time': row[1], 'violations': json.loads(row[2]), 'crop_paths': json.loads(row[3]),
+             'clip_path': row[4], 'trace': json.loads(row[5]) if row[5] else None, 'attempts': row[6]}
+            for row in rows
+        ]
+    
+    def mark_recovered(self, entry_id):
+        """重新辨識成功，移除事件 (截圖已另存為違規證據)"""
+        with self.lock:
+            # 影片片段已成為違規證據，保留不刪
+            row = self.conn.execute("SELECT id, crop_paths, NULL FROM backlog WHERE id = ?", (entry_id,)).fetchone()
+            if row:
+                self._delete([row])
+            self.recovered += 1
+    
+    def mark_attempted(self, entry_id):
+        with self.lock:
+            self.conn.execute(
+                "UPDATE backlog SET attempts = attempts + 1, last_attempt_at = ? WHERE id = ?",
+                (time.time(), entry_id)
+            )
+            self.conn.commit()
+    
+    def stats(self):
+        """回傳待處理數量、最舊事件時間與處理統計"""
+        with self.lock:
+            total, oldest = self.conn.execute("SELECT COUNT(*), MIN(event_time) FROM backlog").fetchone()
+        return {
+            'backlog_size': total,
+            'max_entries': BACKLOG_MAX_ENTRIES,
+            'oldest_age_seconds': round(time.time() - oldest, 1) if oldest else 0.0,
+            'recovered': self.recovered,
+            'expired': self.expired
+        }
+
+recognition_backlog = RecognitionBacklog(BACKLOG_DB_PATH, BACKLOG_PATH)
+
+class BacklogReprocessor:
+    """待處理區重新辨識：以放大銳化與高品質編碼等替代設定重試，成功後走一般寫入流程"""
+    
+    lock = threading.Lock()
+    
+    @staticmethod
+    def in_quiet_hours(now=None):
+        """是否位於離峰時段"""
+        start, end = BACKLOG_QUIET_HOURS
+        hour = (now or datetime.now()).hour
+        return start <= hour < end if start <= end else hour >= start or hour < end
+    
+    @staticmethod
+    def build_variants(crop):
+        """產生重試用的影像：高品質原圖、放大並銳化的版本"""
+        upscaled = cv2.resize(crop, None, fx=BACKLOG_UPSCALE, fy=BACKLOG_UPSCALE, interpolation=cv2.INTER_CUBIC)
+        blurred = cv2.GaussianBlur(upscaled, (0, 0), 3)
+        sharpened = cv2.addWeighted(upscaled, 1.5, blurred, -0.5, 0)
+        return [crop, sharpened]
+    
+    @staticmethod
+    def recognize(crop):
+        """依序以各替代設定呼叫車牌識別 API，回傳 (owner_info, 使用的截圖)"""
+        for variant in BacklogReprocessor.build_variants(crop):
+            files = LPRApiClient.prepare_image_data(variant, jpeg_quality=95)
+            if not files:
+                continue
+            response = LPRApiClient.make_api_request(files)
+            owner_info = LPRApiClient.process_api_response(response) if response else None
+            if owner_info:
+                return owner_info
+        return None
+    
+    @staticmethod
+    def run_once():
+        """處理整個待處理區，回傳 (重新辨識成功數, 嘗試數)"""
+        if not BacklogReprocessor.lock.acquire(blocking=False):
+            return 0, 0
+        try:
+            recognition_backlog.prune()
+            recovered, attempted = 0, 0
+            for entry in recognition_backlog.fetch_all():
+                attempted += 1
+                owner_info, crop = None, None
+                for path in entry['crop_paths']:
+                    crop = cv2.imread(path)
+                    if crop is None:
+                        continue
+                    owner_info = BacklogReprocessor.recognize(crop)
+                    if owner_info:
+                        break
+                if not owner_info:
+                    recognition_backlog.mark_attempted(entry['id'])
+                    continue
+                
+                trace = TraceContext.from_payload(entry['trace'])
+                record_recognized_event(
+                    owner_info, crop, entry['violations'], ClipJob.completed(entry['clip_path']), trace,
+                    timestamp=datetime.fromtimestamp(entry['event_time'])
+                )
+                recognition_backlog.mark_recovered(entry['id'])
+                recovered += 1
+            logging.info(f"🔄 待處理區重新辨識完成: 成功 {recovered} / {attempted}")
+            return recovered, attempted
+        finally:
+            BacklogReprocessor.lock.release()
+
+def reprocess_backlog():
+    """待處理區重新辨識執行緒：只在離峰時段執行"""
+    logging.info("🔄 辨識待處理區執行緒已啟動")
+    while True:
+        time.sleep(BACKLOG_CHECK_INTERVAL)
+        if not BacklogReprocessor.in_quiet_hours():
+            continue
+        try:
+            BacklogReprocessor.run_once()
+        except Exception as e:
+            logging.error(f"❌ 待處理區重新辨識錯誤: {e}")
 
 # ==================== 7. 框架處理模組 ====================
 class FrameProcessor:
@@ -430,9 +1714,9 @@ class FrameProcessor:
     
     @staticmethod
     def resize_frame_if_needed(frame):
-        """如果需要，調整框架大小"""
+        """如果需要，調整框架大小 (切片推理模式保留原始解析度)"""
         height, width = frame.shape[:2]
-        if width > RESIZE_WIDTH:
+        if width > RESIZE_WIDTH and not TILED_INFERENCE:
             scale = RESIZE_WIDTH / width
             frame = cv2.resize(frame, (RESIZE_WIDTH, int(height * scale)))
         return frame
@@ -441,10 +1725,26 @@ class FrameProcessor:
     def should_skip_frame(frame_count):
         """判斷是否應該跳過此框架"""
         return frame_count % FRAME_SKIP != 0
+    
+    @staticmethod
+    def scale_to_full_resolution(full_frame, inference_shape, x1, y1, x2, y2):
+        """將推理框架上的座標放大回原始解析度 (並限制在畫面內)"""
+        full_h, full_w = full_frame.shape[:2]
+        scale_x = full_w / inference_shape[1]
+        scale_y = full_h / inference_shape[0]
+        fx1, fx2 = max(0, int(x1 * scale_x)), min(full_w, int(x2 * scale_x))
+        fy1, fy2 = max(0, int(y1 * scale_y)), min(full_h, int(y2 * scale_y))
+        return fx1, fy1, fx2, fy2
+    
+    @staticmethod
+    def crop_full_resolution(full_frame, inference_shape, x1, y1, x2, y2):
+        """將推理框架上的座標放大回原始解析度後截圖"""
+        fx1, fy1, fx2, fy2 = FrameProcessor.scale_to_full_resolution(full_frame, inference_shape, x1, y1, x2, y2)
+        return full_frame[fy1:fy2, fx1:fx2]
 
 def frame_producer():
     """影像生產者執行緒 (重構版)"""
-    global stop_detection_flag, global_cap, frame_queue
+    global stop_detection_flag, global_cap, frame_queue, camera_id
     logging.info("📹 影像生產者執行緒已啟動")
     frame_count = 0
     
@@ -459,48 +1759,377 @@ def frame_producer():
         if not ret:
             time.sleep(0.1)
             continue
+        camera_telemetry.record_frame_in()
         
         # 框架計數和跳過邏輯
         frame_count += 1
         if FrameProcessor.should_skip_frame(frame_count):
             continue
         
-        # 調整框架大小
+        # 調整框架大小 (保留原始解析度框架供證據截圖使用)
+        full_frame = frame
         frame = FrameProcessor.resize_frame_if_needed(frame)
         
-        # 將框架加入佇列
+        # 加入事件影片的環形緩衝區
+        if CLIP_CAPTURE_ENABLED:
+            clip_recorder.push_frame(camera_id, frame)
+        
+        # 共用前處理 (兩個模型共用同一個輸入張量)
+        captured_at = time.time()
+        preprocessed = None
+        if SHARED_PREPROCESS and not TILED_INFERENCE:
+            preprocessed = SharedPreprocessor.letterbox(frame)
+        preprocess_ms = (time.time() - captured_at) * 1000
+        
+        # 將框架與追蹤資訊加入佇列 (trace id 於擷取時產生)
+        frame_packet = {
+            'frame': frame,
+            'full_frame': full_frame,
+            'preprocessed': preprocessed,
+            'meta': {'trace_id': uuid.uuid4().hex, 'captured_at': captured_at, 'seq': frame_count,
+                     'preprocess_ms': preprocess_ms}
+        }
         try:
-            frame_queue.put_nowait(frame)
+            frame_queue.put_nowait(frame_packet)
         except queue.Full:
+            camera_telemetry.record_queue_drop()
             try:
                 frame_queue.get_nowait()
-                frame_queue.put_nowait(frame)
+                frame_queue.put_nowait(frame_packet)
             except queue.Empty:
                 pass
     
     logging.info("📹 影像生產者執行緒已結束")
 
+# ==================== 7.1 攝影機遙測模組 ====================
+class CameraTelemetry:
+    """攝影機遙測：累計讀取/推理框數與佇列丟棄數，由心跳執行緒換算為 FPS 上報"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+    
+    def reset(self):
+        """開始偵測時重設計數"""
+        with self.lock:
+            self.frames_in = 0
+            self.frames_out = 0
+            self.queue_drops = 0
+            self.inference_ms = None
+            self.preprocess_ms = None
+            self.last_frame_at = None
+    
+    def record_frame_in(self):
+        with self.lock:
+            self.frames_in += 1
+    
+    def record_queue_drop(self):
+        with self.lock:
+            self.queue_drops += 1
+    
+    def record_frame_out(self, frame_meta):
+        """記錄推理完成的框架 (推理耗時以指數移動平均平滑)"""
+        latency_ms = (frame_meta['inference_done_at'] - frame_meta['inference_started_at']) * 1000
+        preprocess_ms = frame_meta.get('preprocess_ms', 0.0)
+        with self.lock:
+            self.frames_out += 1
+            self.last_frame_at = frame_meta['captured_at']
+            self.inference_ms = CameraTelemetry.smooth(self.inference_ms, latency_ms)
+            self.preprocess_ms = CameraTelemetry.smooth(self.preprocess_ms, preprocess_ms)
+    
+    @staticmethod
+    def smooth(previous, value):
+        """指數移動平均"""
+        return value if previous is None else 0.8 * previous + 0.2 * value
+    
+    def snapshot(self):
+        with self.lock:
+            return {
+                'frames_in': self.frames_in,
+                'frames_out': self.frames_out,
+                'queue_drops': self.queue_drops,
+                'inference_ms': self.inference_ms,
+                'preprocess_ms': self.preprocess_ms,
+                'last_frame_at': self.last_frame_at
+            }
+    
+    @staticmethod
+    def public_camera_id(source):
+        """移除串流網址中的帳號密碼，避免上報時外洩"""
+        parts = urlsplit(str(source))
+        if parts.password is None and parts.username is None:
+            return str(source)
+        netloc = parts.hostname + (f":{parts.port}" if parts.port else '')
+        return urlunsplit((parts.scheme, netloc, parts.path, parts.query, parts.fragment))
+
+camera_telemetry = CameraTelemetry()
+
+def send_camera_heartbeat(payload):
+    """發送心跳至 Web API (失敗僅記錄，不重送)"""
+    try:
+        requests.post(f"{WEB_API_URL}/api/cameras/heartbeat", json=payload, timeout=2)
+    except requests.exceptions.RequestException as e:
+        logging.warning(f"⚠️ 攝影機心跳上報失敗: {e}")
+
+def report_camera_heartbeats():
+    """心跳執行緒：定期上報 FPS、推理延遲、最後框架時間與佇列丟棄數"""
+    global stop_detection_flag
+    logging.info("💓 攝影機心跳執行緒已啟動")
+    public_id = CameraTelemetry.public_camera_id(camera_id)
+    if not CAMERA_NAME:
+        logging.warning("⚠️ 未設定 CAMERA_NAME，Web API 無法將心跳對應到 cameras 資料表")
+    base_payload = {'camera_id': public_id, 'name': CAMERA_NAME or public_id}
+    previous, previous_at = camera_telemetry.snapshot(), time.time()
+    
+    while not stop_detection_flag:
+        time.sleep(0.5)
+        now = time.time()
+        if now - previous_at < CAMERA_HEARTBEAT_INTERVAL:
+            continue
+        current = camera_telemetry.snapshot()
+        elapsed = now - previous_at
+        send_camera_heartbeat(dict(
+            base_payload,
+            running=True,
+            fps_in=round((current['frames_in'] - previous['frames_in']) / elapsed, 1),
+            fps_out=round((current['frames_out'] - previous['frames_out']) / elapsed, 1),
+            inference_ms=round(current['inference_ms'], 1) if current['inference_ms'] is not None else None,
+            preprocess_ms=round(current['preprocess_ms'], 1) if current['preprocess_ms'] is not None else None,
+            last_frame_at=current['last_frame_at'],
+            queue_drops=current['queue_drops']
+        ))
+        previous, previous_at = current, now
+    
+    send_camera_heartbeat(dict(base_payload, running=False, fps_in=0.0, fps_out=0.0))
+    logging.info("💓 攝影機心跳執行緒已結束")
+
 # ==================== 8. 推理模組 ====================
+class RegionInference:
+    """區域推理工具：在多個區域上批次推理，並將結果映射回原始框架座標"""
+    
+    @staticmethod
+    def regions_overlap(a, b):
+        """判斷兩個區域是否重疊"""
+        return a['x1'] < b['x2'] and b['x1'] < a['x2'] and a['y1'] < b['y2'] and b['y1'] < a['y2']
+    
+    @staticmethod
+    def merge_overlapping_regions(regions):
+        """合併重疊的區域，避免同一區域被重複推理"""
+        merged = [dict(region) for region in regions]
+        changed = True
+        while changed:
+            changed = False
+            for i in range(len(merged)):
+                for j in range(i + 1, len(merged)):
+                    if RegionInference.regions_overlap(merged[i], merged[j]):
+                        other = merged.pop(j)
+                        merged[i] = {
+                            'x1': min(merged[i]['x1'], other['x1']),
+                            'y1': min(merged[i]['y1'], other['y1']),
+                            'x2': max(merged[i]['x2'], other['x2']),
+                            'y2': max(merged[i]['y2'], other['y2'])
+                        }
+                        changed = True
+                        break
+                if changed:
+                    break
+        return merged
+    
+    @staticmethod
+    def crop_regions(frame, regions):
+        """依區域裁切框架，並過濾掉空的區域"""
+        crops, valid_regions = [], []
+        for region in regions:
+            crop = frame[region['y1']:region['y2'], region['x1']:region['x2']]
+            if crop.size > 0:
+                crops.append(crop)
+                valid_regions.append(region)
+        return crops, valid_regions
+    
+    @staticmethod
+    def build_empty_results(frame, names):
+        """建立沒有任何偵測框的結果"""
+        return Results(orig_img=frame, path='', names=names, boxes=torch.zeros((0, 6)))
+    
+    @staticmethod
+    def map_results_to_frame(results_list, regions, frame, names, global_index=None):
+        """將各區域的偵測框平移回框架座標，並以各類別分開的 NMS 合併重複的框；
+        global_index 為整張框架推理的區域索引，切片框大部分落在其同類別框內時移除"""
+        mapped, from_global = [], []
+        for index, (result, region) in enumerate(zip(results_list, regions)):
+            data = result.boxes.data.cpu().clone()
+            if len(data) == 0:
+                continue
+            data[:, [0, 2]] += region['x1']
+            data[:, [1, 3]] += region['y1']
+            mapped.append(data)
+            from_global.append(torch.full((len(data),), index == global_index, dtype=torch.bool))
+        
+        if not mapped:
+            return RegionInference.build_empty_results(frame, names)
+        
+        data, is_global = torch.cat(mapped), torch.cat(from_global)
+        keep = batched_nms(data[:, :4], data[:, 4], data[:, 5], REGION_NMS_IOU)
+        data, is_global = data[keep], is_global[keep]
+        if is_global.any() and not is_global.all():
+            data = data[~RegionInference.contained_in_global(data, is_global)]
+        return Results(orig_img=frame, path='', names=names, boxes=data)
+    
+    @staticmethod
+    def contained_in_global(data, is_global):
+        """標記切片框中，面積大部分落在整張框架推理同類別框內的框 (切片邊緣截斷造成的重複)"""
+        tile_boxes, global_boxes = data[~is_global], data[is_global]
+        top_left = torch.max(tile_boxes[:, None, :2], global_boxes[None, :, :2])
+        bottom_right = torch.min(tile_boxes[:, None, 2:4], global_boxes[None, :, 2:4])
+        inter = (bottom_right - top_left).clamp(min=0).prod(dim=2)
+        area = ((tile_boxes[:, 2] - tile_boxes[:, 0]) * (tile_boxes[:, 3] - tile_boxes[:, 1])).clamp(min=1e-6)
+        same_class = tile_boxes[:, None, 5] == global_boxes[None, :, 5]
+        contained = ((inter / area[:, None] >= TILE_CONTAIN_RATIO) & same_class).any(dim=1)
+        mask = torch.zeros(len(data), dtype=torch.bool)
+        mask[(~is_global).nonzero(as_tuple=True)[0]] = contained
+        return mask
+
+class SharedPreprocessor:
+    """共用前處理：每個框架只做一次 letterbox、BGR→RGB 與張量轉換，供兩個模型共用"""
+    
+    @staticmethod
+    def letterbox(frame):
+        """縮放並填充至 stride 倍數 (與 ultralytics auto letterbox 相同幾何)，回傳張量與還原參數"""
+        height, width = frame.shape[:2]
+        ratio = min(INFERENCE_IMGSZ / height, INFERENCE_IMGSZ / width)
+        new_w, new_h = int(round(width * ratio)), int(round(height * ratio))
+        pad_w = (INFERENCE_IMGSZ - new_w) % LETTERBOX_STRIDE / 2
+        pad_h = (INFERENCE_IMGSZ - new_h) % LETTERBOX_STRIDE / 2
+        
+        resized = cv2.resize(frame, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+        top, bottom = int(round(pad_h - 0.1)), int(round(pad_h + 0.1))
+        left, right = int(round(pad_w - 0.1)), int(round(pad_w + 0.1))
+        padded = cv2.copyMakeBorder(resized, top, bottom, left, right, cv2.BORDER_CONSTANT,
+                                    value=(LETTERBOX_PAD_VALUE,) * 3)
+        
+        rgb = np.ascontiguousarray(padded[..., ::-1].transpose(2, 0, 1))
+        tensor = torch.from_numpy(rgb).unsqueeze(0).float().div_(255.0)
+        return tensor, {'ratio': ratio, 'pad': (left, top)}
+    
+    @staticmethod
+    def restore_results(result, frame, letterbox_meta, names):
+        """將 letterbox 座標的偵測框還原至推理框架座標，並以原框架建立結果"""
+        data = result.boxes.data.cpu().clone()
+        if len(data):
+            left, top = letterbox_meta['pad']
+            data[:, [0, 2]] = ((data[:, [0, 2]] - left) / letterbox_meta['ratio']).clamp(0, frame.shape[1])
+            data[:, [1, 3]] = ((data[:, [1, 3]] - top) / letterbox_meta['ratio']).clamp(0, frame.shape[0])
+        return Results(orig_img=frame, path='', names=names, boxes=data)
+
 class InferenceEngine:
     """推理引擎"""
     
     @staticmethod
-    def run_person_detection(person_model, frame):
-        """執行人員檢測"""
-        return person_model(frame, conf=0.3, verbose=False, imgsz=320)
+    def run_person_detection(person_model, frame, preprocessed=None):
+        """執行人員檢測 (有共用前處理張量時直接使用)"""
+        if preprocessed is not None:
+            return InferenceEngine.run_on_preprocessed(person_model, frame, preprocessed)
+        return person_model(frame, conf=0.3, verbose=False, imgsz=INFERENCE_IMGSZ)
+    
+    @staticmethod
+    def run_plate_detection(plate_model, frame, preprocessed=None):
+        """執行車牌檢測 (有共用前處理張量時直接使用)"""
+        if preprocessed is not None:
+            return InferenceEngine.run_on_preprocessed(plate_model, frame, preprocessed)
+        return plate_model(frame, conf=0.3, verbose=False, imgsz=INFERENCE_IMGSZ)
     
     @staticmethod
-    def run_plate_detection(plate_model, frame):
-        """執行車牌檢測"""
-        return plate_model(frame, conf=0.3, verbose=False, imgsz=320)
+    def run_on_preprocessed(model, frame, preprocessed):
+        """以共用前處理張量推理，結果還原至框架座標"""
+        tensor, letterbox_meta = preprocessed
+        results = model(tensor, conf=0.3, verbose=False)
+        return [SharedPreprocessor.restore_results(results[0], frame, letterbox_meta, model.names)]
     
     @staticmethod
-    def update_shared_results(frame, person_results, plate_results):
+    def calculate_plate_search_region(person_box, frame_shape):
+        """由騎士框反推車牌可能出現的區域 (ROI_EXPAND_* 的反向幾何)"""
+        px1, py1, px2, py2 = map(int, person_box)
+        h, w = frame_shape[:2]
+        center_x, center_y = (px1 + px2) / 2, (py1 + py2) / 2
+        plate_h = max(1.0, (py2 - py1) * CASCADE_PLATE_SIZE_RATIO)
+        plate_w = max(1.0, (px2 - px1) * CASCADE_PLATE_SIZE_RATIO)
+        
+        # 車牌 ROI 需包含騎士中心點，反推車牌框可能出現的範圍
+        return {
+            'x1': max(0, int(center_x - plate_w * (ROI_EXPAND_RIGHT + 1))),
+            'x2': min(w, int(center_x + plate_w * (ROI_EXPAND_LEFT + 1))),
+            'y1': max(0, int(center_y - plate_h * (ROI_EXPAND_DOWN + 1))),
+            'y2': min(h, int(center_y + plate_h * (ROI_EXPAND_UP + 1)))
+        }
+    
+    @staticmethod
+    def run_cascade_plate_detection(plate_model, frame, person_results):
+        """級聯車牌檢測：僅在騎士周圍的區域批次執行車牌模型"""
+        person_boxes = person_results[0].boxes
+        if len(person_boxes) == 0:
+            return [RegionInference.build_empty_results(frame, plate_model.names)]
+        
+        regions = [
+            InferenceEngine.calculate_plate_search_region(box.xyxy[0], frame.shape)
+            for box in person_boxes
+        ]
+        regions = RegionInference.merge_overlapping_regions(regions)
+        crops, regions = RegionInference.crop_regions(frame, regions)
+        if not crops:
+            return [RegionInference.build_empty_results(frame, plate_model.names)]
+        
+        region_results = plate_model(crops, conf=0.3, verbose=False, imgsz=320)
+        return [RegionInference.map_results_to_frame(region_results, regions, frame, plate_model.names)]
+    
+    @staticmethod
+    def calculate_tile_regions(frame_shape):
+        """將框架切成互相重疊的切片區域"""
+        h, w = frame_shape[:2]
+        step = max(1, int(TILE_SIZE * (1 - TILE_OVERLAP)))
+        
+        def tile_starts(length):
+            if length <= TILE_SIZE:
+                return [0]
+            starts = list(range(0, length - TILE_SIZE, step))
+            starts.append(length - TILE_SIZE)
+            return starts
+        
+        regions = [
+            {'x1': x, 'y1': y, 'x2': min(w, x + TILE_SIZE), 'y2': min(h, y + TILE_SIZE)}
+            for y in tile_starts(h) for x in tile_starts(w)
+        ]
+        # 加入整張框架，避免跨切片的大型物件被切斷
+        if TILE_INCLUDE_FULL_FRAME and len(regions) > 1:
+            regions.append({'x1': 0, 'y1': 0, 'x2': w, 'y2': h})
+        return regions
+    
+    @staticmethod
+    def run_tiled_detection(person_model, plate_model, frame):
+        """切片推理：兩個模型各自以批次方式處理所有切片，並以跨切片 NMS 合併結果"""
+        tiles, regions = RegionInference.crop_regions(frame, InferenceEngine.calculate_tile_regions(frame.shape))
+        
+        person_tile_results = person_model(tiles, conf=0.3, verbose=False, imgsz=TILE_SIZE)
+        plate_tile_results = plate_model(tiles, conf=0.3, verbose=False, imgsz=TILE_SIZE)
+        
+        full_frame_region = {'x1': 0, 'y1': 0, 'x2': frame.shape[1], 'y2': frame.shape[0]}
+        global_index = regions.index(full_frame_region) if len(regions) > 1 and full_frame_region in regions else None
+        person_results = RegionInference.map_results_to_frame(
+            person_tile_results, regions, frame, person_model.names, global_index
+        )
+        plate_results = RegionInference.map_results_to_frame(
+            plate_tile_results, regions, frame, plate_model.names, global_index
+        )
+        return [person_results], [plate_results]
+    
+    @staticmethod
+    def update_shared_results(frame, person_results, plate_results, frame_meta=None, full_frame=None, models=None):
         """更新共享結果"""
-        global latest_frame, latest_results, data_lock
+        global latest_frame, latest_full_frame, latest_frame_meta, latest_results, data_lock
         with data_lock:
             latest_frame = frame
-            latest_results = {'persons': person_results[0], 'plates': plate_results[0]}
+            latest_full_frame = full_frame if full_frame is not None else frame
+            latest_frame_meta = frame_meta
+            latest_results = {'persons': person_results[0], 'plates': plate_results[0], 'models': models}
 
 def perform_inference():
     """模型推理執行緒 (重構版)"""
@@ -509,23 +2138,392 @@ def perform_inference():
     
     while not stop_detection_flag:
         try:
-            # 從佇列獲取框架
-            frame = frame_queue.get(timeout=1)
+            # 從佇列獲取框架與追蹤資訊
+            frame_packet = frame_queue.get(timeout=1)
+            frame = frame_packet['frame']
+            full_frame = frame_packet['full_frame']
+            frame_meta = dict(frame_packet['meta'], inference_started_at=time.time())
+            
+            # 取得本框架使用的模型 (熱切換只在框架之間生效)
+            active_person_model, active_plate_model, frame_meta['model_versions'] = model_registry.acquire_for_frame()
             
-            # 執行雙模型推理
-            person_results = InferenceEngine.run_person_detection(person_model, frame)
-            plate_results = InferenceEngine.run_plate_detection(plate_model, frame)
+            # 偵測間追蹤模式：非偵測幀以運動模型更新既有框，不呼叫模型
+            if box_tracker and not box_tracker.needs_detection(frame_meta['model_versions']):
+                person_results, plate_results = box_tracker.predict(
+                    frame, active_person_model.names, active_plate_model.names
+                )
+                frame_meta['inference_done_at'] = time.time()
+                frame_meta['tracked'] = True
+                camera_telemetry.record_frame_out(frame_meta)
+                InferenceEngine.update_shared_results(
+                    frame, person_results, plate_results, frame_meta, full_frame,
+                    models={'person': active_person_model, 'plate': active_plate_model}
+                )
+                continue
+            
+            # 執行雙模型推理 (分別計時)
+            preprocessed = frame_packet['preprocessed']
+            if TILED_INFERENCE:
+                person_results, plate_results = InferenceEngine.run_tiled_detection(
+                    active_person_model, active_plate_model, frame
+                )
+                plate_started_at = frame_meta['inference_started_at']
+            else:
+                person_results = InferenceEngine.run_person_detection(active_person_model, frame, preprocessed)
+                plate_started_at = time.time()
+                if CASCADE_INFERENCE:
+                    plate_results = InferenceEngine.run_cascade_plate_detection(active_plate_model, frame, person_results)
+                else:
+                    plate_results = InferenceEngine.run_plate_detection(active_plate_model, frame, preprocessed)
             
             # 更新共享結果
-            InferenceEngine.update_shared_results(frame, person_results, plate_results)
+            frame_meta['inference_done_at'] = time.time()
+            frame_meta['person_inference_ms'] = (plate_started_at - frame_meta['inference_started_at']) * 1000
+            frame_meta['plate_inference_ms'] = (frame_meta['inference_done_at'] - plate_started_at) * 1000
+            frame_meta['tracked'] = False
+            if box_tracker:
+                box_tracker.update(frame, person_results[0], plate_results[0], frame_meta['model_versions'])
+            camera_telemetry.record_frame_out(frame_meta)
+            InferenceEngine.update_shared_results(
+                frame, person_results, plate_results, frame_meta, full_frame,
+                models={'person': active_person_model, 'plate': active_plate_model}
+            )
+            
+            # 寫入偵測紀錄 (離線重播與門檻調整用)
+            if detection_log_sink:
+                detection_log_sink.append_frame(camera_id, frame_meta, frame.shape, person_results[0], plate_results[0])
             
         except queue.Empty:
             continue
         except Exception as e:
             logging.error(f"推理錯誤: {e}")
     
+    if detection_log_sink:
+        detection_log_sink.flush(close_file=True)
     logging.info("🧠 模型推理執行緒已結束")
 
+# ==================== 8.1 偵測紀錄模組 ====================
+class DetectionLogSink:
+    """偵測紀錄：逐框偵測結果累積為 Arrow 批次，由背景執行緒寫入輪替的 Parquet 檔"""
+    
+    COLUMNS = ['camera', 'seq', 'ts', 'model', 'model_version', 'frame_w', 'frame_h', 'x1', 'y1', 'x2', 'y2', 'cls', 'conf']
+    
+    def __init__(self, output_dir, batch_rows, max_file_bytes, rotate_seconds, queue_batches, flush_seconds):
+        self.output_dir = output_dir
+        self.batch_rows = batch_rows
+        self.max_file_bytes = max_file_bytes
+        self.rotate_seconds = rotate_seconds
+        self.flush_seconds = flush_seconds
+        self.schema = pa.schema([
+            ('camera', pa.string()), ('seq', pa.int64()), ('ts', pa.float64()), ('model', pa.string()),
+            ('model_version', pa.string()),
+            ('frame_w', pa.int32()), ('frame_h', pa.int32()),
+            ('x1', pa.float32()), ('y1', pa.float32()), ('x2', pa.float32()), ('y2', pa.float32()),
+            ('cls', pa.int16()), ('conf', pa.float32())
+        ])
+        self.lock = threading.Lock()
+        self.columns = {name: [] for name in DetectionLogSink.COLUMNS}
+        self.batch_queue = queue.Queue(maxsize=queue_batches)
+        self.stats_lock = threading.Lock()
+        self.dropped_batches = 0
+        self.writer = None
+        self.writer_path = None
+        self.writer_opened_at = 0.0
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+        threading.Thread(target=self.run_writer, daemon=True).start()
+    
+    def append_frame(self, camera, frame_meta, frame_shape, person_results, plate_results):
+        """加入一幀的所有偵測框 (座標為推理框架座標)"""
+        frame_h, frame_w = frame_shape[:2]
+        with self.lock:
+            for model_name, results in (('person', person_results), ('plate', plate_results)):
+                boxes = results.boxes
+                count = len(boxes)
+                if count == 0:
+                    continue
+                xyxy = boxes.xyxy.cpu().numpy()
+                self.columns['camera'].extend([camera] * count)
+                self.columns['seq'].extend([frame_meta['seq']] * count)
+                self.columns['ts'].extend([frame_meta['captured_at']] * count)
+                self.columns['model'].extend([model_name] * count)
+                self.columns['model_version'].extend([frame_meta['model_versions'].get(model_name)] * count)
+                self.columns['frame_w'].extend([frame_w] * count)
+                self.columns['frame_h'].extend([frame_h] * count)
+                self.columns['x1'].extend(xyxy[:, 0].tolist())
+                self.columns['y1'].extend(xyxy[:, 1].tolist())
+                self.columns['x2'].extend(xyxy[:, 2].tolist())
+                self.columns['y2'].extend(xyxy[:, 3].tolist())
+                self.columns['cls'].extend(boxes.cls.cpu().numpy().astype(int).tolist())
+                self.columns['conf'].extend(boxes.conf.cpu().numpy().tolist())
+            if len(self.columns['seq']) >= self.batch_rows:
+                self._submit_batch()
+    
+    def _take_batch(self):
+        """將累積的欄位轉為 Arrow 批次並清空 (需持有 self.lock)，沒有資料時回傳 None"""
+        if not self.columns['seq']:
+            return None
+        batch = pa.RecordBatch.from_pydict(self.columns, schema=self.schema)
+        self.columns = {name: [] for name in DetectionLogSink.COLUMNS}
+        return batch
+    
+    def _submit_batch(self):
+        """將累積的批次交給寫入執行緒 (需持有 self.lock；佇列滿時丟棄，不阻塞推理)"""
+        batch = self._take_batch()
+        if batch is None:
+            return
+        try:
+            self.batch_queue.put_nowait(batch)
+        except queue.Full:
+            with self.stats_lock:
+                self.dropped_batches += 1
+                dropped = self.dropped_batches
+            logging.warning(f"⚠️ 偵測紀錄寫入過慢，已丟棄 {dropped} 個批次")
+    
+    def stats(self):
+        """取得寫入統計 (丟棄批次數與目前檔案)"""
+        with self.stats_lock:
+            return {'dropped_batches': self.dropped_batches, 'writer_path': self.writer_path}
+    
+    def flush(self, close_file=False):
+        """送出未滿的批次；close_file 時關閉目前檔案使其可供讀取"""
+        with self.lock:
+            self._submit_batch()
+        if close_file:
+            self.batch_queue.put(None)
+    
+    def _open_writer(self):
+        """開啟新的 Parquet 檔 (寫入中的檔案以 .inprogress 結尾)"""
+        ts_str = time.strftime("%Y%m%d_%H%M%S")
+        self.writer_path = os.path.join(self.output_dir, f"detections_{ts_str}_{uuid.uuid4().hex[:6]}.parquet")
+        self.writer = pq.ParquetWriter(self.writer_path + '.inprogress', self.schema, compression='zstd')
+        self.writer_opened_at = time.time()
+    
+    def _close_writer(self):
+        """關閉目前檔案並改為正式檔名"""
+        if self.writer is None:
+            return
+        self.writer.close()
+        os.replace(self.writer_path + '.inprogress', self.writer_path)
+        logging.info(f"🗂️ 偵測紀錄檔已完成: {self.writer_path}")
+        self.writer = None
+    
+    def run_writer(self):
+        """背景寫入執行緒：依檔案大小與時間輪替；佇列閒置時定時寫入未滿的批次並檢查輪替"""
+        timeout = min(self.flush_seconds, self.rotate_seconds)
+        while True:
+            try:
+                batch = self.batch_queue.get(timeout=timeout)
+            except queue.Empty:
+                with self.lock:
+                    batch = self._take_batch()
+                try:
+                    if batch is not None:
+                        self._write(batch)
+                    elif self.writer is not None and time.time() - self.writer_opened_at >= self.rotate_seconds:
+                        self._close_writer()
+                except Exception as e:
+                    logging.error(f"❌ 偵測紀錄寫入失敗: {e}")
+                continue
+            try:
+                if batch is None:
+                    self._close_writer()
+                    continue
+                self._write(batch)
+            except Exception as e:
+                logging.error(f"❌ 偵測紀錄寫入失敗: {e}")
+    
+    def _write(self, batch):
+        """寫入批次，超過檔案大小或開啟時間上限時輪替"""
+        if self.writer is None:
+            self._open_writer()
+        self.writer.write_batch(batch)
+        file_bytes = os.path.getsize(self.writer_path + '.inprogress')
+        if file_bytes >= self.max_file_bytes or time.time() - self.writer_opened_at >= self.rotate_seconds:
+            self._close_writer()
+
+if DETECTION_LOG_ENABLED and pa is None:
+    logging.warning("⚠️ 未安裝 pyarrow，偵測紀錄已停用")
+detection_log_sink = DetectionLogSink(
+    DETECTION_LOG_PATH, DETECTION_LOG_BATCH_ROWS, DETECTION_LOG_MAX_FILE_BYTES,
+    DETECTION_LOG_ROTATE_SECONDS, DETECTION_LOG_QUEUE_BATCHES, DETECTION_LOG_FLUSH_SECONDS
+) if DETECTION_LOG_ENABLED and pa is not None else None
+
+# ==================== 8.2 偵測間追蹤模組 ====================
+class KalmanBoxTrack:
+    """單一偵測框的等速 Kalman 追蹤 (狀態: 中心 x/y、寬、高與其速度)"""
+    
+    def __init__(self, box, cls, conf):
+        self.cls = cls
+        self.conf = conf
+        self.confidence = 1.0
+        self.filter = cv2.KalmanFilter(8, 4)
+        self.filter.transitionMatrix = np.eye(8, dtype=np.float32)
+        for i in range(4):
+            self.filter.transitionMatrix[i, i + 4] = 1.0
+        self.filter.measurementMatrix = np.eye(4, 8, dtype=np.float32)
+        self.filter.processNoiseCov = np.eye(8, dtype=np.float32) * 1e-2
+        self.filter.processNoiseCov[4:, 4:] *= 0.1
+        self.filter.measurementNoiseCov = np.eye(4, dtype=np.float32) * 1e-1
+        self.filter.errorCovPost = np.eye(8, dtype=np.float32)
+        self.filter.statePost = np.vstack([KalmanBoxTrack.to_measurement(box), np.zeros((4, 1), np.float32)])
+    
+    @staticmethod
+    def to_measurement(box):
+        x1, y1, x2, y2 = box
+        return np.array([[(x1 + x2) / 2], [(y1 + y2) / 2], [x2 - x1], [y2 - y1]], dtype=np.float32)
+    
+    def box(self):
+        """目前狀態對應的 (x1, y1, x2, y2)"""
+        cx, cy, w, h = self.filter.statePost[:4, 0]
+        return [cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2]
+    
+    def predict(self):
+        self.filter.predict()
+        # 無量測時以預測值作為後驗，使下一幀由此繼續推進
+        self.filter.statePost = self.filter.statePre.copy()
+        self.filter.errorCovPost = self.filter.errorCovPre.copy()
+    
+    def correct(self, box):
+        self.filter.correct(KalmanBoxTrack.to_measurement(box))
+
+class BoxTracker:
+    """偵測間追蹤：每 N 幀執行完整偵測，其餘幀以 Kalman 預測 (可選稀疏光流校正) 更新偵測框"""
+    
+    def __init__(self, detect_every_n, use_optical_flow):
+        self.detect_every_n = max(1, detect_every_n)
+        self.use_optical_flow = use_optical_flow
+        self.lock = threading.Lock()
+        self.reset()
+    
+    def reset(self):
+        with self.lock:
+            self.tracks = {'persons': [], 'plates': []}
+            self.frames_since_detection = self.detect_every_n
+            self.model_versions = None
+            self.prev_gray = None
+            self.detected_frames = 0
+            self.tracked_frames = 0
+            self.early_detections = 0
+    
+    def needs_detection(self, model_versions):
+        """是否應在此幀執行完整偵測 (週期到期、模型切換或追蹤可信度衰減時)"""
+        with self.lock:
+            if self.frames_since_detection + 1 >= self.detect_every_n or model_versions != self.model_versions:
+                return True
+            confidences = [t.confidence for tracks in self.tracks.values() for t in tracks]
+            if confidences and min(confidences) < TRACK_MIN_CONFIDENCE:
+                self.early_detections += 1
+                return True
+            return False
+    
+    @staticmethod
+    def iou(box_a, box_b):
+        x1, y1 = max(box_a[0], box_b[0]), max(box_a[1], box_b[1])
+        x2, y2 = min(box_a[2], box_b[2]), min(box_a[3], box_b[3])
+        inter = max(0.0, x2 - x1) * max(0.0, y2 - y1)
+        union = (box_a[2] - box_a[0]) * (box_a[3] - box_a[1]) + (box_b[2] - box_b[0]) * (box_b[3] - box_b[1]) - inter
+        return inter / union if union > 0 else 0.0
+    
+    def match_tracks(self, tracks, results):
+        """以 IoU 貪婪配對新偵測與既有追蹤 (配對成功者延續速度估計)，未配對的追蹤移除"""
+        for track in tracks:
+            track.predict()
+        updated = []
+        unmatched = list(tracks)
+        for box, cls, conf in zip(results.boxes.xyxy.cpu().numpy().tolist(),
+                                  results.boxes.cls.cpu().numpy().astype(int).tolist(),
+                                  results.boxes.conf.cpu().numpy().tolist()):
+            candidates = [(BoxTracker.iou(box, t.box()), t) for t in unmatched if t.cls == cls]
+            best_iou, best = max(candidates, key=lambda item: item[0], default=(0.0, None))
+            if best is not None and best_iou >= TRACK_MATCH_IOU:
+                unmatched.remove(best)
+                best.correct(box)
+                best.conf, best.confidence = conf, 1.0
+                updated.append(best)
+            else:
+                updated.append(KalmanBoxTrack(box, cls, conf))
+        return updated
+    
+    def update(self, frame, person_results, plate_results, model_versions):
+        """偵測幀：以偵測結果重設追蹤"""
+        with self.lock:
+            self.tracks['persons'] = self.match_tracks(self.tracks['persons'], person_results)
+            self.tracks['plates'] = self.match_tracks(self.tracks['plates'], plate_results)
+            self.frames_since_detection = 0
+            self.model_versions = model_versions
+            self.detected_frames += 1
+            if self.use_optical_flow:
+                self.prev_gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    
+    def estimate_flow(self, track, gray):
+        """在前一幀的偵測框內取特徵點，以 LK 光流估計框位移，回傳 (位移後的框, 成功追蹤比例)"""
+        h, w = gray.shape[:2]
+        x1, y1, x2, y2 = [int(v) for v in track.box()]
+        x1, y1, x2, y2 = max(0, x1), max(0, y1), min(w, x2), min(h, y2)
+        if x2 - x1 < 4 or y2 - y1 < 4:
+            return None, 0.0
+        mask = np.zeros_like(self.prev_gray)
+        mask[y1:y2, x1:x2] = 255
+        points = cv2.goodFeaturesToTrack(self.prev_gray, maxCorners=20, qualityLevel=0.01, minDistance=3, mask=mask)
+        if points is None or len(points) < TRACK_FLOW_MIN_POINTS:
+            return None, 0.0
+        next_points, status, _ = cv2.calcOpticalFlowPyrLK(self.prev_gray, gray, points, None)
+        good = status.reshape(-1) == 1
+        if good.sum() < TRACK_FLOW_MIN_POINTS:
+            return None, 0.0
+        dx, dy = np.median((next_points - points).reshape(-1, 2)[good], axis=0)
+        return [x1 + dx, y1 + dy, x2 + dx, y2 + dy], float(good.mean())
+    
+    def predict(self, frame, person_names, plate_names):
+        """追蹤幀：推進所有追蹤並組成與模型輸出相同格式的結果"""
+        with self.lock:
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if self.use_optical_flow and self.prev_gray is not None else None
+            for tracks in self.tracks.values():
+                for track in tracks:
+                    flow_box, flow_ratio = self.estimate_flow(track, gray) if gray is not None else (None, 0.0)
+                    track.predict()
+                    if flow_box is not None:
+                        track.correct(flow_box)
+                        track.confidence *= max(flow_ratio, TRACK_CONFIDENCE_DECAY)
+                    else:
+                        track.confidence *= TRACK_CONFIDENCE_DECAY
+            if gray is not None:
+                self.prev_gray = gray
+            self.frames_since_detection += 1
+            self.tracked_frames += 1
+            return (
+                [BoxTracker.build_results(frame, self.tracks['persons'], person_names)],
+                [BoxTracker.build_results(frame, self.tracks['plates'], plate_names)]
+            )
+    
+    @staticmethod
+    def build_results(frame, tracks, names):
+        """由追蹤框建立 Results (座標限制於框架內，信心度沿用最近一次偵測)"""
+        height, width = frame.shape[:2]
+        data = torch.tensor(
+            [track.box() + [track.conf, track.cls] for track in tracks], dtype=torch.float32
+        ).reshape(-1, 6)
+        if len(data):
+            data[:, [0, 2]] = data[:, [0, 2]].clamp(0, width)
+            data[:, [1, 3]] = data[:, [1, 3]].clamp(0, height)
+        return Results(orig_img=frame, path='', names=names, boxes=data)
+    
+    def stats(self):
+        with self.lock:
+            total = self.detected_frames + self.tracked_frames
+            return {
+                'detect_every_n': self.detect_every_n,
+                'optical_flow': self.use_optical_flow,
+                'detected_frames': self.detected_frames,
+                'tracked_frames': self.tracked_frames,
+                'early_detections': self.early_detections,
+                'model_invocation_ratio': round(self.detected_frames / total, 3) if total else None,
+                'active_tracks': {name: len(tracks) for name, tracks in self.tracks.items()}
+            }
+
+box_tracker = BoxTracker(DETECT_EVERY_N, TRACK_OPTICAL_FLOW) if TRACK_BETWEEN_DETECTIONS else None
+
 # ==================== 9. 檢測邏輯模組 ====================
 class DetectionLogic:
     """檢測邏輯處理器"""
@@ -566,6 +2564,7 @@ class DetectionLogic:
         return {
             'plate_h': plate_h,
             'plate_w': plate_w,
+            'plate_box': (npx1, npy1, npx2, npy2),
             'roi_y1': max(0, npy1 - int(plate_h * ROI_EXPAND_UP)),
             'roi_y2': npy2 + int(plate_h * ROI_EXPAND_DOWN),
             'roi_x1': max(0, npx1 - int(plate_w * ROI_EXPAND_LEFT)),
@@ -617,8 +2616,21 @@ class DetectionLogic:
         return violations
     
     @staticmethod
-    def process_unassociated_riders(person_detections, frame_copy):
-        """處理未關聯的騎士"""
+    def find_plate_in_region(plate_detections, region):
+        """找出中心點落在截圖範圍內、信心度最高的車牌"""
+        inside = [
+            plate for plate in plate_detections
+            if region['x1'] <= (plate['box'][0] + plate['box'][2]) / 2 <= region['x2']
+            and region['y1'] <= (plate['box'][1] + plate['box'][3]) / 2 <= region['y2']
+        ]
+        return max(inside, key=lambda plate: plate['conf'], default=None)
+    
+    @staticmethod
+    def process_unassociated_riders(person_detections, frame_copy, frame_meta=None, full_frame=None,
+                                    plate_detections=None):
+        """處理未關聯的騎士 (每位騎士各自送出事件)"""
+        found = False
+        source_frame = full_frame if full_frame is not None else frame_copy
         for person in person_detections:
             if not person['is_associated'] and person['class_name'] == NO_HELMET_CLASS_NAME:
                 logging.info("🚨 [獨立騎士] 偵測到未戴安全帽! 觸發處理...")
@@ -627,8 +2639,10 @@ class DetectionLogic:
                 crop_coords = DetectionLogic.calculate_rider_crop_coordinates(
                     person['box'], frame_copy.shape
                 )
-                crop_img = frame_copy[crop_coords['y1']:crop_coords['y2'], 
-                                   crop_coords['x1']:crop_coords['x2']]
+                crop_img = FrameProcessor.crop_full_resolution(
+                    source_frame, frame_copy.shape,
+                    crop_coords['x1'], crop_coords['y1'], crop_coords['x2'], crop_coords['y2']
+                )
                 
                 if crop_img.size > 0:
                     violation_info = [{
@@ -636,13 +2650,23 @@ class DetectionLogic:
                         'fine': 800, 
                         'confidence': person['conf']
                     }]
-                    threading.Thread(
-                        target=process_multiple_violations, 
-                        args=(crop_img, violation_info), 
-                        daemon=True
-                    ).start()
-                    return True
-        return False
+                    # 截圖範圍內若有車牌，以其信心度、大小與位置參與最佳畫面評分與車牌提示
+                    plate = DetectionLogic.find_plate_in_region(plate_detections or [], crop_coords)
+                    plate_conf, plate_area, plate_hint = 0.0, 0, None
+                    if plate:
+                        px1, py1, px2, py2 = map(int, plate['box'])
+                        plate_conf, plate_area = plate['conf'], (px2 - px1) * (py2 - py1)
+                        plate_hint = build_plate_hint(source_frame, frame_copy.shape, {
+                            'roi_x1': crop_coords['x1'], 'roi_y1': crop_coords['y1'],
+                            'roi_x2': crop_coords['x2'], 'roi_y2': crop_coords['y2'],
+                            'plate_box': (px1, py1, px2, py2)
+                        }, plate_conf)
+                    dispatch_violation_event(
+                        crop_img, violation_info, ('rider', list(person['box'])),
+                        plate_conf, plate_area, frame_meta, plate_hint
+                    )
+                    found = True
+        return found
     
     @staticmethod
     def calculate_rider_crop_coordinates(person_box, frame_shape):
@@ -661,40 +2685,53 @@ class DetectionLogic:
 
 def get_current_frame_data():
     """獲取當前框架數據"""
-    global latest_frame, latest_results, data_lock
+    global latest_frame, latest_full_frame, latest_frame_meta, latest_results, data_lock
     
     with data_lock:
         if latest_frame is None or latest_results is None:
             return None
         return {
             'frame_copy': latest_frame.copy(),
+            # 原始解析度框架不會被繪製修改，直接共用參考避免每次複製大圖
+            'full_frame': latest_full_frame,
+            'frame_meta': latest_frame_meta,
             'person_results': latest_results['persons'],
-            'plate_results': latest_results['plates']
+            'plate_results': latest_results['plates'],
+            'models': latest_results['models'] or {'person': person_model, 'plate': plate_model}
         }
 
 def process_detection_frame(frame_data, last_detection_time, cooldown):
     """處理檢測框架並返回是否發現違規"""
-    # 檢查冷卻時間
+    # 提取檢測結果
+    # 使用產生此結果的模型類別名稱 (熱切換後新舊模型類別可能不同)
+    plate_detections = DetectionLogic.extract_plate_detections(frame_data['plate_results'], frame_data['models']['plate'])
+    person_detections = DetectionLogic.extract_person_detections(frame_data['person_results'], frame_data['models']['person'])
+    
+    # 車流統計 (不受違規冷卻時間影響)
+    if TRAFFIC_FLOW_ENABLED:
+        traffic_flow_counter.observe(
+            person_detections, plate_detections, frame_data['frame_copy'].shape, frame_data['frame_meta']
+        )
+    
+    # 檢查冷卻時間 (最佳畫面窗口收集中時不受冷卻限制)
     current_time = time.time()
-    if current_time - last_detection_time < cooldown:
+    if current_time - last_detection_time < cooldown and not best_shot_selector.is_collecting():
         return False, last_detection_time
     
-    # 提取檢測結果
-    plate_detections = DetectionLogic.extract_plate_detections(frame_data['plate_results'], plate_model)
-    person_detections = DetectionLogic.extract_person_detections(frame_data['person_results'], person_model)
-    
     violation_found = False
     
     # 主要流程：以車牌為中心的檢測
     if plate_detections:
         violation_found = process_plate_centered_detection(
-            plate_detections, person_detections, frame_data['frame_copy']
+            plate_detections, person_detections, frame_data['frame_copy'],
+            frame_data['frame_meta'], frame_data['full_frame']
         )
     
     # 輔助流程：處理未關聯的騎士
     if not violation_found:
         violation_found = DetectionLogic.process_unassociated_riders(
-            person_detections, frame_data['frame_copy']
+            person_detections, frame_data['frame_copy'], frame_data['frame_meta'], frame_data['full_frame'],
+            plate_detections
         )
     
     # 更新檢測時間
@@ -713,6 +2750,11 @@ def run_detection_logic():
     while not stop_detection_flag:
         time.sleep(0.2)
         
+        # 送出窗口已結束的事件與到期的車流統計
+        flush_best_shot_event()
+        if TRAFFIC_FLOW_ENABLED:
+            traffic_flow_counter.flush_if_due()
+        
         # 獲取當前框架和結果
         frame_data = get_current_frame_data()
         if frame_data is None:
@@ -723,10 +2765,14 @@ def run_detection_logic():
             frame_data, last_successful_detection_time, violation_cooldown
         )
     
+    flush_best_shot_event(force=True)
+    if TRAFFIC_FLOW_ENABLED:
+        traffic_flow_counter.flush_if_due(force=True)
     logging.info("🔍 背景偵測邏輯執行緒已結束")
 
-def process_plate_centered_detection(plate_detections, person_detections, frame_copy):
-    """處理以車牌為中心的檢測"""
+def process_plate_centered_detection(plate_detections, person_detections, frame_copy, frame_meta=None, full_frame=None):
+    """處理以車牌為中心的檢測 (每個車牌各自判斷違規)"""
+    found = False
     for plate in plate_detections:
         # 檢查車牌尺寸有效性
         roi_coords = DetectionLogic.calculate_roi_coordinates(plate['box'])
@@ -747,10 +2793,12 @@ def process_plate_centered_detection(plate_detections, person_detections, frame_
         )
         
         if violations:
-            process_detected_violations(violations, roi_coords, frame_copy, person_count, has_no_helmet)
-            return True
+            process_detected_violations(
+                violations, roi_coords, frame_copy, person_count, has_no_helmet, plate['conf'], frame_meta, full_frame
+            )
+            found = True
     
-    return False
+    return found
 
 def adjust_roi_boundaries(roi_coords, frame_shape):
     """調整 ROI 邊界以符合框架大小"""
@@ -758,21 +2806,139 @@ def adjust_roi_boundaries(roi_coords, frame_shape):
     roi_coords['roi_x2'] = min(frame_shape[1], roi_coords['roi_x2'])
     return roi_coords
 
-def process_detected_violations(violations, roi_coords, frame_copy, person_count, has_no_helmet):
-    """處理檢測到的違規"""
+def process_detected_violations(violations, roi_coords, frame_copy, person_count, has_no_helmet, plate_conf=0.0,
+                                frame_meta=None, full_frame=None):
+    """處理檢測到的違規 (證據截圖取自原始解析度框架)"""
     logging.info(f"🚨 [車牌關聯] 偵測到違規! 人數: {person_count}, 是否有未戴安全帽: {has_no_helmet}")
     
-    crop_img = frame_copy[
-        roi_coords['roi_y1']:roi_coords['roi_y2'], 
-        roi_coords['roi_x1']:roi_coords['roi_x2']
-    ]
+    source_frame = full_frame if full_frame is not None else frame_copy
+    crop_img = FrameProcessor.crop_full_resolution(
+        source_frame, frame_copy.shape,
+        roi_coords['roi_x1'], roi_coords['roi_y1'], roi_coords['roi_x2'], roi_coords['roi_y2']
+    )
     
     if crop_img.size > 0:
-        threading.Thread(
-            target=process_multiple_violations, 
-            args=(crop_img, violations), 
-            daemon=True
-        ).start()
+        plate_area = roi_coords['plate_w'] * roi_coords['plate_h']
+        dispatch_violation_event(
+            crop_img, violations, ('plate', list(roi_coords['plate_box'])), plate_conf, plate_area, frame_meta,
+            build_plate_hint(source_frame, frame_copy.shape, roi_coords, plate_conf)
+        )
+
+def build_plate_hint(source_frame, inference_shape, roi_coords, plate_conf):
+    """計算車牌框在證據截圖中的座標，供車牌識別服務略過重複偵測"""
+    roi_x1, roi_y1, _, _ = FrameProcessor.scale_to_full_resolution(
+        source_frame, inference_shape, roi_coords['roi_x1'], roi_coords['roi_y1'], roi_coords['roi_x2'], roi_coords['roi_y2']
+    )
+    px1, py1, px2, py2 = FrameProcessor.scale_to_full_resolution(source_frame, inference_shape, *roi_coords['plate_box'])
+    return {'box': (px1 - roi_x1, py1 - roi_y1, px2 - roi_x1, py2 - roi_y1), 'conf': plate_conf}
+
+# ==================== 9.1 車流統計模組 ====================
+class TrafficFlowCounter:
+    """車流統計：以上一幀的中心點做最近鄰配對，越過計數線時依車道累計 (固定記憶體)"""
+    
+    def __init__(self, count_line_ratio, lane_boundaries, max_distance_ratio, flush_seconds):
+        self.count_line_ratio = count_line_ratio
+        self.lane_boundaries = sorted(lane_boundaries)
+        self.max_distance_ratio = max_distance_ratio
+        self.flush_seconds = flush_seconds
+        self.lock = threading.Lock()
+        self.previous = {'persons': [], 'plates': []}
+        self.last_seq = None
+        self.window_start = time.time()
+        self.counters = self.empty_counters()
+    
+    def empty_counters(self):
+        """每個車道一組計數器"""
+        return [{'riders': 0, 'helmet': 0, 'no_helmet': 0, 'plates': 0}
+                for _ in range(len(self.lane_boundaries) + 1)]
+    
+    def lane_of(self, center_x, frame_width):
+        """依中心點 x 比例判斷車道"""
+        ratio = center_x / frame_width
+        for lane, boundary in enumerate(self.lane_boundaries):
+            if ratio < boundary:
+                return lane
+        return len(self.lane_boundaries)
+    
+    @staticmethod
+    def box_center(box):
+        """計算框的中心點"""
+        return (box[0] + box[2]) / 2, (box[1] + box[3]) / 2
+    
+    def find_crossings(self, previous_points, current_points, line_y, max_distance):
+        """配對前後兩幀的中心點，回傳越過計數線的目前點"""
+        crossings = []
+        unmatched = list(previous_points)
+        for point in current_points:
+            if not unmatched:
+                break
+            distances = [np.hypot(point[0] - p[0], point[1] - p[1]) for p in unmatched]
+            nearest = int(np.argmin(distances))
+            if distances[nearest] > max_distance:
+                continue
+            prev = unmatched.pop(nearest)
+            if (prev[1] < line_y) != (point[1] < line_y):
+                crossings.append(point)
+        return crossings
+    
+    def observe(self, person_detections, plate_detections, frame_shape, frame_meta=None):
+        """處理一幀檢測結果；同一推理框架只統計一次"""
+        seq = frame_meta.get('seq') if frame_meta else None
+        frame_h, frame_w = frame_shape[:2]
+        line_y = frame_h * self.count_line_ratio
+        max_distance = frame_w * self.max_distance_ratio
+        persons = [(*TrafficFlowCounter.box_center(p['box']), p['class_name']) for p in person_detections]
+        plates = [TrafficFlowCounter.box_center(p['box']) for p in plate_detections]
+        
+        with self.lock:
+            if seq is not None and seq == self.last_seq:
+                return
+            self.last_seq = seq
+            
+            for x, _, class_name in self.find_crossings(self.previous['persons'], persons, line_y, max_distance):
+                lane_counters = self.counters[self.lane_of(x, frame_w)]
+                lane_counters['riders'] += 1
+                if class_name == HELMET_CLASS_NAME:
+                    lane_counters['helmet'] += 1
+                elif class_name == NO_HELMET_CLASS_NAME:
+                    lane_counters['no_helmet'] += 1
+            for x, _ in self.find_crossings(self.previous['plates'], plates, line_y, max_distance):
+                self.counters[self.lane_of(x, frame_w)]['plates'] += 1
+            
+            self.previous = {'persons': persons, 'plates': plates}
+    
+    def flush_if_due(self, force=False):
+        """時間窗口結束時，於背景批次寫入每個車道一列統計"""
+        now = time.time()
+        with self.lock:
+            if not force and now - self.window_start < self.flush_seconds:
+                return
+            counters, window_start = self.counters, self.window_start
+            self.counters, self.window_start = self.empty_counters(), now
+            if force:
+                self.previous = {'persons': [], 'plates': []}
+                self.last_seq = None
+        
+        rows = [dict(lane_counters,
+                     camera_id=camera_id or 'unknown',
+                     window_start=datetime.fromtimestamp(window_start).isoformat(),
+                     window_end=datetime.fromtimestamp(now).isoformat(),
+                     lane=lane)
+                for lane, lane_counters in enumerate(counters)]
+        threading.Thread(target=TrafficFlowCounter.write_rows, args=(rows,), daemon=True).start()
+    
+    @staticmethod
+    def write_rows(rows):
+        """寫入資料庫，失敗時轉存至本地待送佇列"""
+        if DatabaseManager.insert_traffic_flow_rows(rows):
+            logging.info(f"🚦 車流統計已寫入 ({sum(row['riders'] for row in rows)} 名騎士)")
+            return
+        key = f"{rows[0]['camera_id']}:{rows[0]['window_start']}"
+        violation_outbox.enqueue('traffic_flow', {'rows': rows}, key)
+
+traffic_flow_counter = TrafficFlowCounter(
+    TRAFFIC_COUNT_LINE_RATIO, TRAFFIC_LANE_BOUNDARIES, TRAFFIC_TRACK_MAX_DISTANCE, TRAFFIC_FLOW_FLUSH_SECONDS
+)
 
 # ==================== 10. 視頻串流模組 ====================
 class VideoRenderer:
@@ -864,6 +3030,12 @@ class ModelManager:
         if not model_path or not os.path.exists(model_path):
             raise ValueError(f"{model_name}模型不存在: {model_path}")
     
+    @staticmethod
+    def describe_version(model_path):
+        """以檔名與修改時間作為預設版本名稱"""
+        mtime = datetime.fromtimestamp(os.path.getmtime(model_path)).strftime('%Y%m%d%H%M%S')
+        return f"{os.path.basename(model_path)}@{mtime}"
+    
     @staticmethod
     def load_person_model():
         """載入人員檢測模型"""
@@ -871,6 +3043,7 @@ class ModelManager:
         if person_model is None:
             ModelManager.validate_model_path(PERSON_MODEL_PATH, "騎士偵測")
             person_model = YOLO(PERSON_MODEL_PATH)
+            model_registry.register('person', person_model, PERSON_MODEL_PATH)
             logging.info("✅ 騎士偵測 YOLO 模型載入成功！")
     
     @staticmethod
@@ -880,6 +3053,7 @@ class ModelManager:
         if plate_model is None:
             ModelManager.validate_model_path(PLATE_MODEL_PATH, "車牌偵測")
             plate_model = YOLO(PLATE_MODEL_PATH)
+            model_registry.register('plate', plate_model, PLATE_MODEL_PATH)
             logging.info("✅ 車牌偵測 YOLO 模型載入成功！")
     
     @staticmethod
@@ -887,6 +3061,142 @@ class ModelManager:
         """載入所有模型"""
         ModelManager.load_person_model()
         ModelManager.load_plate_model()
+    
+    @staticmethod
+    def required_class_names(role):
+        """切換前檢查新模型必須包含的類別"""
+        return set(PERSON_CLASS_NAMES) if role == 'person' else {NUMBER_PLATE_CLASS_NAME}
+    
+    @staticmethod
+    def collect_validation_frames(count):
+        """取最近的推理框架做為驗證資料 (偵測未執行時以空白框架暖機)"""
+        frames = []
+        for _ in range(count):
+            with data_lock:
+                if latest_frame is not None:
+                    frames.append(latest_frame.copy())
+            time.sleep(0.2)
+        return frames or [np.zeros((RESIZE_WIDTH * 9 // 16, RESIZE_WIDTH, 3), dtype=np.uint8)]
+    
+    @staticmethod
+    def hot_swap(job_id, role, model_path, version):
+        """背景載入、暖機並驗證新模型，通過後於框架之間切換"""
+        try:
+            model_registry.update_job(job_id, state='loading')
+            ModelManager.validate_model_path(model_path, role)
+            candidate = YOLO(model_path)
+            
+            missing = ModelManager.required_class_names(role) - set(candidate.names.values())
+            if missing:
+                raise ValueError(f"新模型缺少必要類別: {sorted(missing)}")
+            
+            model_registry.update_job(job_id, state='validating')
+            imgsz = TILE_SIZE if TILED_INFERENCE else INFERENCE_IMGSZ
+            latencies, detections = [], 0
+            for frame in ModelManager.collect_validation_frames(MODEL_VALIDATION_FRAMES):
+                start = time.time()
+                results = candidate(frame, conf=0.3, verbose=False, imgsz=imgsz)
+                latencies.append((time.time() - start) * 1000)
+                detections += len(results[0].boxes)
+            
+            # 第一次推理含暖機成本，不計入平均延遲
+            steady = latencies[1:] or latencies
+            model_registry.swap(role, candidate, model_path, version)
+            model_registry.update_job(
+                job_id, state='swapped', validation_frames=len(latencies),
+                validation_detections=detections, avg_latency_ms=round(sum(steady) / len(steady), 1)
+            )
+            logging.info(f"🔁 {role} 模型已切換為 {version}")
+        except Exception as e:
+            model_registry.update_job(job_id, state='failed', error=str(e))
+            logging.error(f"❌ 模型熱切換失敗 ({role} → {version}): {e}")
+
+class ModelRegistry:
+    """模型版本登錄：記錄使用中與歷史版本 (供回滾)，切換以參考替換完成，推理在框架開始時取用"""
+    
+    ROLES = ('person', 'plate')
+    MAX_JOBS = 20
+    
+    def __init__(self, history_size):
+        self.lock = threading.Lock()
+        self.active = {}
+        self.history = {role: deque(maxlen=history_size) for role in ModelRegistry.ROLES}
+        self.frame_counts = Counter()
+        self.jobs = OrderedDict()
+    
+    @staticmethod
+    def make_entry(model, model_path, version=None):
+        return {
+            'model': model,
+            'path': model_path,
+            'version': version or ModelManager.describe_version(model_path),
+            'loaded_at': datetime.now().isoformat()
+        }
+    
+    def _set_global(self, role, model):
+        """更新全域模型參考 (顯示與其他模組使用)"""
+        global person_model, plate_model
+        if role == 'person':
+            person_model = model
+        else:
+            plate_model = model
+    
+    def register(self, role, model, model_path):
+        """登錄啟動時載入的模型"""
+        with self.lock:
+            self.active[role] = ModelRegistry.make_entry(model, model_path)
+    
+    def acquire_for_frame(self):
+        """取得目前的模型組合與版本，同一框架內不會改變"""
+        with self.lock:
+            versions = {role: entry['version'] for role, entry in self.active.items()}
+            for version in versions.values():
+                self.frame_counts[version] += 1
+            return self.active['person']['model'], self.active['plate']['model'], versions
+    
+    def swap(self, role, model, model_path, version=None):
+        """切換為新模型，舊版本移入歷史"""
+        with self.lock:
+            if role in self.active:
+                self.history[role].append(self.active[role])
+            self.active[role] = ModelRegistry.make_entry(model, model_path, version)
+            self._set_global(role, model)
+    
+    def rollback(self, role):
+        """回滾至上一個版本，回傳版本名稱 (無歷史版本時回傳 None)"""
+        with self.lock:
+            if not self.history[role]:
+                return None
+            previous = self.history[role].pop()
+            self.active[role] = previous
+            self._set_global(role, previous['model'])
+            return previous['version']
+    
+    def create_job(self, role, model_path, version):
+        job_id = uuid.uuid4().hex[:12]
+        with self.lock:
+            self.jobs[job_id] = {'role': role, 'path': model_path, 'version': version, 'state': 'queued'}
+            while len(self.jobs) > ModelRegistry.MAX_JOBS:
+                self.jobs.popitem(last=False)
+        return job_id
+    
+    def update_job(self, job_id, **fields):
+        with self.lock:
+            self.jobs[job_id].update(fields)
+    
+    def status(self):
+        """回傳使用中版本、歷史版本、各版本處理框數與切換工作"""
+        def describe(entry):
+            return {key: entry[key] for key in ('version', 'path', 'loaded_at')}
+        with self.lock:
+            return {
+                'active': {role: describe(entry) for role, entry in self.active.items()},
+                'history': {role: [describe(entry) for entry in entries] for role, entries in self.history.items()},
+                'frames_by_version': dict(self.frame_counts),
+                'jobs': {job_id: dict(job) for job_id, job in self.jobs.items()}
+            }
+
+model_registry = ModelRegistry(MODEL_HISTORY_SIZE)
 
 # ==================== 12. 攝影機管理模組 ====================
 class CameraManager:
@@ -935,30 +3245,35 @@ class ThreadManager:
     @staticmethod
     def start_detection_threads():
         """啟動檢測執行緒"""
-        global stop_detection_flag, producer_thread, inference_thread, logic_thread
+        global stop_detection_flag, producer_thread, inference_thread, logic_thread, heartbeat_thread
         
         stop_detection_flag = False
+        camera_telemetry.reset()
+        if box_tracker:
+            box_tracker.reset()
         producer_thread = threading.Thread(target=frame_producer, daemon=True)
         inference_thread = threading.Thread(target=perform_inference, daemon=True)
         logic_thread = threading.Thread(target=run_detection_logic, daemon=True)
+        heartbeat_thread = threading.Thread(target=report_camera_heartbeats, daemon=True)
         
         producer_thread.start()
         inference_thread.start()
         logic_thread.start()
+        heartbeat_thread.start()
         
         logging.info("🚀 雙模型偵測任務開始")
     
     @staticmethod
     def stop_detection_threads():
         """停止檢測執行緒"""
-        global stop_detection_flag, producer_thread, logic_thread, inference_thread
-        global global_cap, latest_frame, latest_results, data_lock
+        global stop_detection_flag, producer_thread, logic_thread, inference_thread, heartbeat_thread
+        global global_cap, latest_frame, latest_full_frame, latest_frame_meta, latest_results, data_lock
         
         logging.info("🛑 收到停止偵測的請求...")
         stop_detection_flag = True
         
         # 等待執行緒結束
-        threads = [producer_thread, inference_thread, logic_thread]
+        threads = [producer_thread, inference_thread, logic_thread, heartbeat_thread]
         for thread in threads:
             if thread:
                 thread.join(timeout=2)
@@ -978,10 +3293,101 @@ class ThreadManager:
         # 清理共享數據
         with data_lock:
             latest_frame = None
+            latest_full_frame = None
+            latest_frame_meta = None
             latest_results = None
         
-        producer_thread, inference_thread, logic_thread = None, None, None
+        producer_thread, inference_thread, logic_thread, heartbeat_thread = None, None, None, None
         logging.info("✅ 偵測已完全停止")
+    
+    @staticmethod
+    def start_outbox_drainer():
+        """啟動本地待送佇列重送執行緒 (與偵測生命週期無關)"""
+        threading.Thread(target=drain_outbox, daemon=True).start()
+    
+    @staticmethod
+    def start_backlog_reprocessor():
+        """啟動辨識待處理區重新辨識執行緒 (與偵測生命週期無關)"""
+        threading.Thread(target=reprocess_backlog, daemon=True).start()
+
+# ==================== 13.1 效能剖析模組 ====================
+def admin_token_required(func):
+    """管理端點驗證：需在 X-Admin-Token 標頭帶入 ADMIN_TOKEN，未設定時端點停用"""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if not ADMIN_TOKEN:
+            return jsonify({"status": "fail", "message": "管理端點未啟用 (未設定 ADMIN_TOKEN)"}), 403
+        token = request.headers.get('X-Admin-Token', '')
+        if not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+            return jsonify({"status": "fail", "message": "未授權"}), 401
+        return func(*args, **kwargs)
+    return wrapper
+
+class SamplingProfiler:
+    """取樣式效能剖析：只在請求期間取樣，輸出 flamegraph.pl / speedscope 可讀的 collapsed stacks"""
+    
+    lock = threading.Lock()
+    
+    @staticmethod
+    def parse_duration(default_seconds=10.0):
+        """解析並限制剖析秒數"""
+        seconds = float(request.args.get('seconds', default_seconds))
+        return min(max(seconds, 0.1), PROFILE_MAX_SECONDS)
+    
+    @staticmethod
+    def frame_label(frame):
+        """以函式名稱與定義位置標示堆疊框"""
+        code = frame.f_code
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    
+    @staticmethod
+    def sample_cpu(seconds, interval):
+        """定期擷取所有執行緒 (不含剖析本身) 的堆疊，回傳各堆疊的取樣次數"""
+        own_ident = threading.get_ident()
+        stacks = Counter()
+        samples = 0
+        deadline = time.time() + seconds
+        while time.time() < deadline:
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(SamplingProfiler.frame_label(frame))
+                    frame = frame.f_back
+                labels.append(thread_names.get(ident, f"thread-{ident}"))
+                stacks[';'.join(reversed(labels))] += 1
+            samples += 1
+            time.sleep(interval)
+        return stacks, samples
+    
+    @staticmethod
+    def diff_memory(seconds, limit):
+        """比較兩次 tracemalloc 快照，回傳以新增位元組加權的 collapsed stacks"""
+        started_here = not tracemalloc.is_tracing()
+        if started_here:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        try:
+            before = tracemalloc.take_snapshot()
+            time.sleep(seconds)
+            after = tracemalloc.take_snapshot()
+        finally:
+            if started_here:
+                tracemalloc.stop()
+        
+        stacks = Counter()
+        for stat in after.compare_to(before, 'traceback')[:limit]:
+            if stat.size_diff <= 0:
+                continue
+            labels = [f"{os.path.basename(f.filename)}:{f.lineno}" for f in stat.traceback]
+            stacks[';'.join(labels)] += stat.size_diff
+        return stacks
+    
+    @staticmethod
+    def to_collapsed(stacks):
+        """輸出 collapsed stacks 文字 (每行：堆疊 次數)"""
+        return '\n'.join(f"{stack} {count}" for stack, count in stacks.most_common()) + '\n'
 
 # ==================== 14. Flask API 端點 ====================
 @app.route('/video_feed')
@@ -992,7 +3398,7 @@ def video_feed():
 @app.route('/start_detection', methods=['POST'])
 def start_detection():
     """啟動檢測端點"""
-    global producer_thread
+    global producer_thread, camera_id
     
     # 檢查是否已在運行
     if producer_thread and producer_thread.is_alive():
@@ -1011,6 +3417,7 @@ def start_detection():
         # 設置攝影機
         capture_source = CameraManager.parse_video_source(video_path)
         CameraManager.setup_camera(capture_source)
+        camera_id = str(video_path)
         
         # 啟動執行緒
         ThreadManager.start_detection_threads()
@@ -1086,6 +3493,112 @@ def get_confidence():
         "confidence_percent": int(CONFIDENCE_THRESHOLD * 100)
     })
 
+@app.route('/lpr_cache_stats', methods=['GET'])
+def get_lpr_cache_stats():
+    """獲取車牌識別快取統計端點"""
+    return jsonify({"status": "success", "cache": lpr_result_cache.stats()})
+
+@app.route('/plate_dedup_stats', methods=['GET'])
+def get_plate_dedup_stats():
+    """獲取車牌去重索引統計端點"""
+    return jsonify({"status": "success", "dedup": plate_dedup_index.stats()})
+
+@app.route('/tracking_stats', methods=['GET'])
+def get_tracking_stats():
+    """獲取偵測間追蹤統計端點 (模型呼叫比例)"""
+    if not box_tracker:
+        return jsonify({"status": "success", "tracking": None, "message": "偵測間追蹤未啟用"})
+    return jsonify({"status": "success", "tracking": box_tracker.stats()})
+
+@app.route('/outbox/status', methods=['GET'])
+def get_outbox_status():
+    """獲取本地待送佇列狀態端點"""
+    return jsonify({"status": "success", "outbox": violation_outbox.stats()})
+
+@app.route('/admin/profile/cpu', methods=['GET'])
+@admin_token_required
+def profile_cpu():
+    """取樣 CPU 剖析端點 (?seconds=10&interval_ms=5)，回傳 collapsed stacks"""
+    if not SamplingProfiler.lock.acquire(blocking=False):
+        return jsonify({"status": "fail", "message": "已有剖析正在進行中"}), 409
+    try:
+        seconds = SamplingProfiler.parse_duration()
+        interval = max(float(request.args.get('interval_ms', PROFILE_DEFAULT_INTERVAL_MS)), 1.0) / 1000
+        logging.info(f"🔬 開始 CPU 剖析 {seconds:.1f}s (間隔 {interval * 1000:.0f}ms)")
+        stacks, samples = SamplingProfiler.sample_cpu(seconds, interval)
+        response = Response(SamplingProfiler.to_collapsed(stacks), mimetype='text/plain')
+        response.headers['X-Profile-Samples'] = str(samples)
+        return response
+    except ValueError:
+        return jsonify({"status": "fail", "message": "seconds 與 interval_ms 必須是數字"}), 400
+    finally:
+        SamplingProfiler.lock.release()
+
+@app.route('/admin/profile/memory', methods=['GET'])
+@admin_token_required
+def profile_memory():
+    """tracemalloc 快照差異端點 (?seconds=10&top=50)，回傳以新增位元組加權的 collapsed stacks"""
+    if not SamplingProfiler.lock.acquire(blocking=False):
+        return jsonify({"status": "fail", "message": "已有剖析正在進行中"}), 409
+    try:
+        seconds = SamplingProfiler.parse_duration()
+        limit = int(request.args.get('top', 50))
+        logging.info(f"🔬 開始記憶體剖析 {seconds:.1f}s")
+        stacks = SamplingProfiler.diff_memory(seconds, limit)
+        return Response(SamplingProfiler.to_collapsed(stacks), mimetype='text/plain')
+    except ValueError:
+        return jsonify({"status": "fail", "message": "seconds 與 top 必須是數字"}), 400
+    finally:
+        SamplingProfiler.lock.release()
+
+@app.route('/backlog/status', methods=['GET'])
+def get_backlog_status():
+    """獲取辨識待處理區狀態端點"""
+    return jsonify({"status": "success", "backlog": recognition_backlog.stats()})
+
+@app.route('/admin/backlog/reprocess', methods=['POST'])
+@admin_token_required
+def trigger_backlog_reprocess():
+    """立即於背景重新辨識待處理區 (不受離峰時段限制)"""
+    threading.Thread(target=BacklogReprocessor.run_once, daemon=True).start()
+    return jsonify({"status": "success", "message": "已開始重新辨識待處理區。"}), 202
+
+@app.route('/admin/models', methods=['GET'])
+@admin_token_required
+def get_model_versions():
+    """獲取模型版本狀態端點"""
+    return jsonify({"status": "success", "models": model_registry.status()})
+
+@app.route('/admin/models/swap', methods=['POST'])
+@admin_token_required
+def swap_model():
+    """模型熱切換端點 (背景載入、暖機與驗證後切換)"""
+    data = request.get_json() or {}
+    role, model_path = data.get('role'), data.get('model_path')
+    if role not in ModelRegistry.ROLES or not model_path:
+        return jsonify({"status": "fail", "message": "請提供 'role' (person/plate) 與 'model_path'。"}), 400
+    if not os.path.exists(model_path):
+        return jsonify({"status": "fail", "message": f"模型不存在: {model_path}"}), 400
+    
+    version = data.get('version') or ModelManager.describe_version(model_path)
+    job_id = model_registry.create_job(role, model_path, version)
+    threading.Thread(target=ModelManager.hot_swap, args=(job_id, role, model_path, version), daemon=True).start()
+    return jsonify({"status": "success", "job_id": job_id, "version": version}), 202
+
+@app.route('/admin/models/rollback', methods=['POST'])
+@admin_token_required
+def rollback_model():
+    """模型回滾端點"""
+    data = request.get_json() or {}
+    role = data.get('role')
+    if role not in ModelRegistry.ROLES:
+        return jsonify({"status": "fail", "message": "請提供 'role' (person/plate)。"}), 400
+    version = model_registry.rollback(role)
+    if version is None:
+        return jsonify({"status": "fail", "message": "沒有可回滾的歷史版本。"}), 409
+    logging.info(f"⏪ {role} 模型已回滾至 {version}")
+    return jsonify({"status": "success", "version": version})
+
 @app.route('/test_camera', methods=['POST'])
 def test_camera():
     """測試攝影機端點"""
@@ -1140,6 +3653,10 @@ if __name__ == "__main__":
         # 印出啟動橫幅
         print_startup_banner()
         
+        # 啟動待送佇列重送與辨識待處理區
+        ThreadManager.start_outbox_drainer()
+        ThreadManager.start_backlog_reprocessor()
+        
         # 啟動 Flask 應用
         app.run(host='0.0.0.0', port=5001, debug=False, threaded=True)
         
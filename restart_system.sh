@@ -34,7 +34,7 @@ else
 fi
 
 echo -n "車牌 API (3001): "
-if curl -s -f http://localhost:3001 >/dev/null 2>&1; then
+if curl -s -f http://localhost:3001/healthz >/dev/null 2>&1; then
     echo "✅ 正常"
 else
     echo "❌ 連接失敗"
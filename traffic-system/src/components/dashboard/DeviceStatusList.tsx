@@ -1,5 +1,6 @@
 //影像設定-設備狀態列表
 import React, { useState, useEffect } from 'react';
+import io from 'socket.io-client';
 import './DeviceStatusList.css';
 
 type DeviceStatus = 'online' | 'offline'; 
@@ -8,6 +9,11 @@ export interface Device {
   id: number | string;
   name: string;
   status: DeviceStatus;
+  // 偵測端心跳遙測 (可能尚未上報)
+  fpsIn?: number | null;
+  fpsOut?: number | null;
+  inferenceMs?: number | null;
+  queueDrops?: number | null;
 }
 
 
@@ -43,8 +49,23 @@ const DeviceStatusList: React.FC = () => {
     };
 
     fetchDevices();
+    // 心跳由 Socket.IO 即時推送；定期重新讀取以偵測停止上報 (逾時離線) 的攝影機
     const intervalId = setInterval(fetchDevices, 30000);
-    return () => clearInterval(intervalId);
+
+    const socket = io(API_BASE_URL);
+    socket.on('camera_status', (update: Device) => {
+      setDevices(prevDevices => {
+        const exists = prevDevices.some(device => device.id === update.id);
+        return exists
+          ? prevDevices.map(device => (device.id === update.id ? update : device))
+          : [...prevDevices, update];
+      });
+    });
+
+    return () => {
+      clearInterval(intervalId);
+      socket.disconnect();
+    };
   }, []); 
 
   // --- 輔助函式 ---
@@ -78,6 +99,11 @@ const DeviceStatusList: React.FC = () => {
                 {/* 顯示 ID 和名稱 */}
                 <span className="device-id">{device.id}</span>
                 <span className="device-name">({device.name})</span>
+                {device.status === 'online' && device.fpsOut != null && (
+                  <span className="device-fps">
+                    {device.fpsOut} FPS{device.inferenceMs != null ? ` · ${device.inferenceMs} ms` : ''}
+                  </span>
+                )}
               </div>
               <span className={`status-text ${getStatusClass(device.status)}`}> 
                 {getStatusText(device.status)}
@@ -5,6 +5,10 @@ import base64
 import psutil
 import traceback
 import io
+import threading
+import time
+import json
+from collections import OrderedDict
 from dotenv import load_dotenv
 from flask import Flask, jsonify, request
 from flask_cors import CORS
@@ -19,6 +23,12 @@ from email.mime.image import MIMEImage
 from datetime import datetime, timedelta, timezone
 from flask_jwt_extended import get_jwt_identity
 
+# redis 為選用套件：僅在設定 REDIS_URL 時用於多個 worker 共用攝影機心跳
+try:
+    import redis
+except ImportError:
+    redis = None
+
 
 
 # --- 應用程式設定 ---
@@ -65,6 +75,84 @@ MANUAL_VIOLATION_FINES = {
     "亂丟煙蒂": 600
 }
 
+# --- 重送冪等鍵紀錄 (偵測端本地待送佇列重送時避免重複廣播/寫入) ---
+RECENT_IDEMPOTENCY_KEYS_LIMIT = 5000
+recent_idempotency_keys = OrderedDict()
+recent_idempotency_lock = threading.Lock()
+
+def is_duplicate_delivery(scope, idempotency_key):
+    """檢查冪等鍵，已處理過的重送回傳 True"""
+    if not idempotency_key:
+        return False
+    with recent_idempotency_lock:
+        return f"{scope}:{idempotency_key}" in recent_idempotency_keys
+
+def remember_delivery(scope, idempotency_key):
+    """記錄已成功處理的冪等鍵"""
+    if not idempotency_key:
+        return
+    with recent_idempotency_lock:
+        recent_idempotency_keys[f"{scope}:{idempotency_key}"] = True
+        while len(recent_idempotency_keys) > RECENT_IDEMPOTENCY_KEYS_LIMIT:
+            recent_idempotency_keys.popitem(last=False)
+
+# --- 攝影機心跳 (偵測端定期上報，以 cameras.name 對應攝影機；超過 TTL 未更新視為離線) ---
+CAMERA_HEARTBEAT_TTL_SECONDS = float(os.getenv('CAMERA_HEARTBEAT_TTL_SECONDS', 15))
+CAMERA_HEARTBEAT_REDIS_KEY = 'camera_heartbeats'
+
+class CameraHeartbeatStore:
+    """攝影機心跳儲存：設定 REDIS_URL 時存於 Redis (多個 worker 共用)，否則存於記憶體"""
+
+    def __init__(self, redis_url=None):
+        self.heartbeats = {}
+        self.lock = threading.Lock()
+        self.redis_client = redis.Redis.from_url(redis_url, socket_timeout=0.5) if redis_url and redis else None
+
+    def put(self, heartbeat):
+        if self.redis_client is not None:
+            try:
+                self.redis_client.hset(CAMERA_HEARTBEAT_REDIS_KEY, heartbeat['name'], json.dumps(heartbeat))
+                return
+            except Exception as e:
+                print(f"⚠️ Redis 心跳寫入失敗，改用記憶體: {e}")
+        with self.lock:
+            self.heartbeats[heartbeat['name']] = heartbeat
+
+    def by_name(self):
+        """回傳 {攝影機名稱: 最新心跳}"""
+        if self.redis_client is not None:
+            try:
+                raw_heartbeats = self.redis_client.hgetall(CAMERA_HEARTBEAT_REDIS_KEY)
+                return {name.decode(): json.loads(raw) for name, raw in raw_heartbeats.items()}
+            except Exception as e:
+                print(f"⚠️ Redis 心跳讀取失敗，改用記憶體: {e}")
+        with self.lock:
+            return dict(self.heartbeats)
+
+camera_heartbeat_store = CameraHeartbeatStore(os.getenv('REDIS_URL'))
+
+def fetch_camera_rows():
+    """讀取 cameras 資料表 (id, name)"""
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT id, name FROM cameras;')
+            return cur.fetchall()
+    finally:
+        conn.close()
+
+def format_camera_status(camera_id, camera_name, heartbeat, now=None):
+    """cameras 資料列加上心跳遙測轉為前端設備狀態；無心跳或心跳逾時皆視為離線"""
+    now = now or time.time()
+    camera = {'id': camera_id, 'name': camera_name, 'status': 'offline'}
+    if heartbeat is None:
+        return camera
+    is_fresh = now - heartbeat['receivedAt'] <= CAMERA_HEARTBEAT_TTL_SECONDS
+    camera.update({key: value for key, value in heartbeat.items() if key not in ('id', 'name')})
+    camera['sourceId'] = heartbeat['id']
+    camera['status'] = 'online' if heartbeat.get('running') and is_fresh else 'offline'
+    return camera
+
 # Email發送函數
 import smtplib
 import base64
@@ -456,17 +544,46 @@ def admin_required():
 @app.route('/api/cameras/status', methods=['GET'])
 def get_cameras():
     try:
-        conn = get_db_connection()
-        with conn.cursor() as cur:
-            cur.execute('SELECT id, name, status FROM cameras;')
-            cameras_raw = cur.fetchall()
-        conn.close()
-        cameras = [{'id': row[0], 'name': row[1], 'status': row[2]} for row in cameras_raw]
+        heartbeats = camera_heartbeat_store.by_name()
+        now = time.time()
+        cameras = [
+            format_camera_status(camera_id, camera_name, heartbeats.get(camera_name), now)
+            for camera_id, camera_name in fetch_camera_rows()
+        ]
         return jsonify(cameras)
     except Exception as e:
         print("❌ Error in get_cameras:", e)
         return jsonify({'error': ERROR_INTERNAL_SERVER}), 500
 
+@app.route('/api/cameras/heartbeat', methods=['POST'])
+def receive_camera_heartbeat():
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict) or not payload.get('camera_id'):
+        return jsonify({'error': 'camera_id 為必填'}), 400
+    try:
+        heartbeat = {
+            'id': payload['camera_id'],
+            'name': payload.get('name') or payload['camera_id'],
+            'running': bool(payload.get('running', True)),
+            'fpsIn': payload.get('fps_in'),
+            'fpsOut': payload.get('fps_out'),
+            'inferenceMs': payload.get('inference_ms'),
+            'preprocessMs': payload.get('preprocess_ms'),
+            'lastFrameAt': payload.get('last_frame_at'),
+            'queueDrops': payload.get('queue_drops'),
+            'receivedAt': time.time()
+        }
+        camera_heartbeat_store.put(heartbeat)
+        camera_row = next((row for row in fetch_camera_rows() if row[1] == heartbeat['name']), None)
+        if camera_row is None:
+            print(f"⚠️ 心跳的攝影機名稱不在 cameras 資料表中: {heartbeat['name']}")
+            return jsonify({'message': 'heartbeat stored, camera not registered'}), 202
+        socketio.emit('camera_status', format_camera_status(camera_row[0], camera_row[1], heartbeat))
+        return jsonify({'message': 'heartbeat stored'}), 200
+    except Exception as e:
+        print(f"❌ Error in receive_camera_heartbeat: {e}")
+        return jsonify({'error': ERROR_INTERNAL_SERVER}), 500
+
 @app.route('/api/cameras/list', methods=['GET'])
 def get_cameras_list():
     try:
@@ -844,6 +961,46 @@ def create_manual_violation():
         traceback.print_exc()
         return jsonify({'error': '保存失敗，請稍後再試'}), 500
 
+# ==================================================
+# 端到端追蹤區段儲存
+# ==================================================
+def store_trace_spans(violation_id, trace_id, spans):
+    """將追蹤區段寫入 violation_trace_spans (以 epoch 秒保存起訖時間)"""
+    if violation_id is None or not trace_id or not spans:
+        return
+    conn = None
+    try:
+        conn = get_db_connection()
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                CREATE TABLE IF NOT EXISTS violation_trace_spans (
+                    id SERIAL PRIMARY KEY,
+                    violation_id INT NOT NULL,
+                    trace_id VARCHAR(64) NOT NULL,
+                    service VARCHAR(50),
+                    name VARCHAR(50) NOT NULL,
+                    start_ts DOUBLE PRECISION NOT NULL,
+                    end_ts DOUBLE PRECISION NOT NULL,
+                    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+                );
+                """
+            )
+            cur.executemany(
+                """
+                INSERT INTO violation_trace_spans (violation_id, trace_id, service, name, start_ts, end_ts)
+                VALUES (%s, %s, %s, %s, %s, %s)
+                """,
+                [(violation_id, trace_id, span.get('service'), span['name'], span['start'], span['end'])
+                 for span in spans]
+            )
+        conn.commit()
+    except Exception as e:
+        print(f"❌ Error storing trace spans: {e}")
+    finally:
+        if conn:
+            conn.close()
+
 # ==================================================
 # WebSocket 廣播
 # ==================================================
@@ -852,8 +1009,16 @@ def notify_new_violation():
     new_violation_data = request.json
     if not isinstance(new_violation_data, dict):
         return jsonify({"error": "Invalid data format. JSON object required."}), 400
+    if is_duplicate_delivery('notify', new_violation_data.get('idempotencyKey')):
+        return jsonify({"message": "Duplicate notification ignored."}), 200
     try:
+        emit_start = time.time()
         socketio.emit('new_violation', new_violation_data)
+        remember_delivery('notify', new_violation_data.get('idempotencyKey'))
+        store_trace_spans(
+            new_violation_data.get('id'), new_violation_data.get('traceId'),
+            [{'name': 'socketio_emit', 'service': 'web_api', 'start': emit_start, 'end': time.time()}]
+        )
         print(f"🚀 Broadcasted new violation: {new_violation_data}")
         return jsonify({"message": "Notification broadcasted successfully."}), 200
     except Exception as e:
@@ -900,6 +1065,9 @@ def record_processing_latency():
         if violation_id is None or latency_ms is None:
             return jsonify({'error': 'violation_id 與 latency_ms 為必填'}), 400
 
+        if is_duplicate_delivery('metrics', payload.get('idempotency_key')):
+            return jsonify({'message': 'duplicate metric ignored', 'latency_ms': latency_ms}), 200
+
         conn = get_db_connection()
         with conn.cursor() as cur:
             # 1. 確保表格存在
@@ -933,6 +1101,8 @@ def record_processing_latency():
             )
         conn.commit()
         conn.close()
+        remember_delivery('metrics', payload.get('idempotency_key'))
+        store_trace_spans(violation_id, payload.get('trace_id'), payload.get('spans'))
 
         # (選用) 寫入系統日誌
         try:
@@ -1006,6 +1176,54 @@ def get_violation_processing_duration(violation_id):
             conn.close()
 
 
+@app.route('/api/violations/<int:violation_id>/trace', methods=['GET'])
+def get_violation_trace(violation_id):
+    """回傳違規事件的端到端瀑布圖 (各區段相對於擷取時間的偏移毫秒)"""
+    conn = None
+    try:
+        conn = get_db_connection()
+        with conn.cursor() as cur:
+            cur.execute("SELECT to_regclass('violation_trace_spans')")
+            if cur.fetchone()[0] is None:
+                return jsonify({'error': f'找不到 violation_id: {violation_id} 的追蹤資料'}), 404
+            cur.execute(
+                """
+                SELECT trace_id, service, name, start_ts, end_ts
+                FROM violation_trace_spans
+                WHERE violation_id = %s
+                ORDER BY start_ts ASC
+                """,
+                (violation_id,)
+            )
+            rows = cur.fetchall()
+
+        if not rows:
+            return jsonify({'error': f'找不到 violation_id: {violation_id} 的追蹤資料'}), 404
+
+        origin = rows[0][3]
+        spans = [{
+            'service': service,
+            'name': name,
+            'offset_ms': round((start_ts - origin) * 1000, 1),
+            'duration_ms': round((end_ts - start_ts) * 1000, 1)
+        } for _, service, name, start_ts, end_ts in rows]
+        total_ms = round((max(row[4] for row in rows) - origin) * 1000, 1)
+
+        return jsonify({
+            'violation_id': violation_id,
+            'trace_id': rows[0][0],
+            'total_ms': total_ms,
+            'spans': spans
+        }), 200
+
+    except Exception as e:
+        print(f"❌ Error in get_violation_trace: {e}")
+        return jsonify({'error': ERROR_INTERNAL_SERVER}), 500
+    finally:
+        if conn:
+            conn.close()
+
+
 # ==================================================
 # 罰單相關 API
 # ==================================================
@@ -1162,6 +1380,61 @@ def get_analytics_data():
         if 'conn' in locals() and conn and not conn.closed: conn.close()
         return jsonify({'error': ERROR_INTERNAL_SERVER, 'details': str(e)}), 500
 
+@app.route('/api/analytics/traffic-flow', methods=['GET'])
+def get_traffic_flow_analytics():
+    """車流統計：騎士流量、安全帽配戴率與各車道車牌數 (違規率的分母)"""
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute("SELECT to_regclass('traffic_flow_stats')")
+        if cur.fetchone()[0] is None:
+            cur.close()
+            conn.close()
+            return jsonify({'totals': {'riders': 0, 'helmet': 0, 'noHelmet': 0, 'plates': 0},
+                            'ridersPerMinute': 0.0, 'helmetComplianceRate': None, 'lanes': [], 'trend': {'labels': [], 'data': []}})
+        time_range = request.args.get('time_range', 'last30days')
+        camera_id = request.args.get('camera_id')
+        time_filter_sql = ""
+        if time_range == 'today': time_filter_sql = "AND window_start >= CURRENT_DATE"
+        elif time_range == 'last7days': time_filter_sql = "AND window_start >= NOW() - INTERVAL '7 days'"
+        elif time_range == 'last60days': time_filter_sql = "AND window_start >= NOW() - INTERVAL '60 days'"
+        elif time_range == 'last90days': time_filter_sql = "AND window_start >= NOW() - INTERVAL '90 days'"
+        else: time_filter_sql = "AND window_start >= NOW() - INTERVAL '30 days'"
+        camera_filter_sql = "AND camera_id = %s" if camera_id else ""
+        params = (camera_id,) if camera_id else ()
+        cur.execute(f"""
+            SELECT lane, COALESCE(SUM(riders), 0), COALESCE(SUM(helmet), 0), COALESCE(SUM(no_helmet), 0), COALESCE(SUM(plates), 0)
+            FROM traffic_flow_stats WHERE 1=1 {time_filter_sql} {camera_filter_sql} GROUP BY lane ORDER BY lane;
+        """, params)
+        lanes = [{'lane': l[0], 'riders': int(l[1]), 'helmet': int(l[2]), 'noHelmet': int(l[3]), 'plates': int(l[4])} for l in cur.fetchall()]
+        # 觀測分鐘數以各攝影機的不重複時間窗口計算 (每個窗口有多個車道列)
+        cur.execute(f"""
+            SELECT COALESCE(SUM(EXTRACT(EPOCH FROM (window_end - window_start))), 0) FROM (
+                SELECT DISTINCT camera_id, window_start, window_end FROM traffic_flow_stats WHERE 1=1 {time_filter_sql} {camera_filter_sql}
+            ) AS windows;
+        """, params)
+        observed_minutes = float(cur.fetchone()[0]) / 60
+        cur.execute(f"SELECT date_trunc('day', window_start)::date, SUM(riders) FROM traffic_flow_stats WHERE 1=1 {time_filter_sql} {camera_filter_sql} GROUP BY 1 ORDER BY 1;", params)
+        trend = cur.fetchall()
+        totals = {key: sum(l[key] for l in lanes) for key in ['riders', 'helmet', 'noHelmet', 'plates']}
+        helmet_observed = totals['helmet'] + totals['noHelmet']
+        response_data = {
+            'totals': totals,
+            'observedMinutes': round(observed_minutes, 1),
+            'ridersPerMinute': round(totals['riders'] / observed_minutes, 2) if observed_minutes else 0.0,
+            'helmetComplianceRate': round(totals['helmet'] / helmet_observed, 3) if helmet_observed else None,
+            'lanes': lanes,
+            'trend': {'labels': [t[0].strftime('%m-%d') for t in trend], 'data': [int(t[1]) for t in trend]}
+        }
+        cur.close()
+        conn.close()
+        return jsonify(response_data)
+    except Exception as e:
+        print(f"❌ Error in get_traffic_flow_analytics: {e}")
+        if 'cur' in locals() and cur and not cur.closed: cur.close()
+        if 'conn' in locals() and conn and not conn.closed: conn.close()
+        return jsonify({'error': ERROR_INTERNAL_SERVER, 'details': str(e)}), 500
+
 # ==================================================
 # 使用者管理 API
 # ==================================================